@@ -0,0 +1,311 @@
+from collections import namedtuple
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import OptimizeResult
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import LinearOperator, eigs, splu, spsolve
+
+from .compartments import (_euler_structure, _lagrange_structure, _local_structure, _nodes, _split_args,
+                           _structure, generate_fun, generate_jac, resolve)
+
+#####################################################
+##### ANÁLISIS: R0, UMBRALES Y EQUILIBRIOS ##########
+#####################################################
+#
+# En lugar de integrar hasta tiempos largos:
+#   - `reproduction_number` calcula R0 como el radio espectral de la matriz de
+#     la próxima generación `F V^-1` en el equilibrio libre de enfermedad
+#     (van den Driessche y Watmough), con `eigs` cuando el sistema es grande.
+#   - `node_thresholds` da el número reproductivo de cada nodo aislado y los
+#     casos secundarios que genera un infectado que aparece en cada nodo.
+#   - `endemic_equilibrium` resuelve `fun(y) = 0` con Newton y el jacobiano
+#     analítico (`generate_jac`).
+# Los modelos conservan la población de cada grupo de compartimentos (todos
+# salvo `N`, y `N`) en cada componente conexa del movimiento entre posiciones
+# (en el lagrangiano, cada nodo de residencia con los nodos que visita). Esas
+# leyes de conservación hacen singular al jacobiano; se agregan como
+# ecuaciones `W^T y = W^T y0`.
+
+# Tamaño máximo del espacio infectado para el cual R0 se calcula con una
+# matriz densa; en sistemas mayores se usa `eigs` con la factorización de `V`.
+DENSE_LIMIT = 2000
+
+NextGeneration = namedtuple('NextGeneration', ['F', 'V', 'infected'])
+
+def _movement_structure(movement, mobility, K):
+    if movement == 'lagrange':
+        return _lagrange_structure(*mobility)
+    if movement == 'eulerian':
+        return _euler_structure(mobility[0])
+    return _local_structure(K)
+
+def _infected(spec):
+    '''
+    Índices de los compartimentos infectados: los que se alcanzan desde el
+    destino de la infección con transiciones y llevan a un compartimento que
+    contagia.
+    '''
+    _, _, T, infectious, _, transitions = _structure(spec)
+    edges = {}
+    for src, dst, _ in transitions:
+        edges.setdefault(src, set()).add(dst)
+    def reach(start):
+        seen, stack = {start}, [start]
+        while stack:
+            for d in edges.get(stack.pop(), ()):
+                if d not in seen:
+                    seen.add(d)
+                    stack.append(d)
+        return seen
+    return sorted(c for c in reach(T) if reach(c) & set(infectious))
+
+def _invariants(spec, mov):
+    '''
+    Matriz dispersa `W` (`n x r`) con las cantidades conservadas del modelo:
+    la población de cada grupo de compartimentos en cada componente conexa
+    del grafo de movimiento entre posiciones.
+    '''
+    C = len(spec.compartments)
+    P = mov.shape[0]
+    N = None if spec.population is None else spec.compartments.index(spec.population)
+    groups = [[c for c in range(C) if c != N]] + ([[N]] if N is not None else [])
+    m, labels = connected_components(sp.csr_matrix(mov), connection='weak')
+    rows, cols = [], []
+    for g, group in enumerate(groups):
+        for c in group:
+            rows.append(c * P + np.arange(P))
+            cols.append(g * m + labels)
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    return sp.csr_matrix((np.ones(rows.shape[0]), (rows, cols)), shape=(C * P, len(groups) * m))
+
+def _deflated_solve(A, W, b):
+    '''
+    Resuelve `(A + W W^T) x = b` con `A` dispersa.
+    '''
+    return spsolve(sp.csc_matrix(A + W @ W.T), b)
+
+def disease_free_state(spec, movement, args, y0):
+    '''
+    Equilibrio libre de enfermedad con las mismas poblaciones que `y0`: todos
+    los individuos pasan al compartimento susceptible y el movimiento se lleva
+    a su estado estacionario. Cada componente conexa del movimiento debe
+    tener un único estado estacionario (por ejemplo, ser fuertemente conexa).
+
+    Parámetros
+    ---
+    `spec`, `movement`: Modelo y esquema de movimiento (ver `compartments`).
+
+    `args`: Argumentos de la fábrica del modelo (matrices de movimiento y tasas).
+
+    `y0`: Estado con las poblaciones de referencia.
+
+    Retorno
+    ---
+    Estado con la estructura de `generate_fun(spec, movement)`.
+    '''
+    mobility, params = _split_args(movement, args)
+    C, S, T, infectious, N, Beta, transitions = resolve(spec, params)
+    K = _nodes(mobility, Beta, transitions)
+    mov, dest, _ = _movement_structure(movement, mobility, K)
+    P = dest.shape[0]
+    y0 = np.asarray(y0, dtype=float).reshape((C, P))
+    people = y0[[c for c in range(C) if c != N]].sum(axis=0)
+    W = _invariants(spec._replace(compartments=('S',), population=None), mov)
+    y = np.zeros((C, P))
+    y[S] = _deflated_solve(sp.csr_matrix(mov), W, W @ (W.T @ people))
+    if N is not None:
+        y[N] = _deflated_solve(sp.csr_matrix(mov), W, W @ (W.T @ y0[N]))
+    return y.ravel()
+
+def next_generation(spec, movement, args, y_dfe):
+    '''
+    Matrices de la próxima generación en un equilibrio libre de enfermedad.
+
+    Parámetros
+    ---
+    `spec`, `movement`, `args`: Modelo, esquema de movimiento y argumentos de la fábrica.
+
+    `y_dfe`: Equilibrio libre de enfermedad (ver `disease_free_state`).
+
+    Retorno
+    ---
+    `NextGeneration(F, V, infected)`: matrices CSR de nuevas infecciones `F` y
+    de transiciones `V` sobre el espacio infectado, cuyas posiciones se
+    ordenan por compartimento (`infected`, índices de `spec.compartments`) y
+    luego por posición. La matriz de la próxima generación es `F V^-1`.
+    '''
+    mobility, params = _split_args(movement, args)
+    C, S, T, infectious, N, Beta, transitions = resolve(spec, params)
+    if S is None:
+        raise ValueError('El modelo no tiene infección.')
+    K = _nodes(mobility, Beta, transitions)
+    mov, dest, (p, q) = _movement_structure(movement, mobility, K)
+    P = dest.shape[0]
+    infected = _infected(spec)
+    index = {c: a for a, c in enumerate(infected)}
+    m = len(infected) * P
+    y = np.asarray(y_dfe, dtype=float).reshape((C, P))
+    N_p = y.sum(axis=0) if N is None else y[N]
+    N_n = np.bincount(dest, weights=N_p, minlength=K)
+    Beta = np.broadcast_to(np.asarray(Beta, dtype=float), (K,))
+
+    values = Beta[dest[p]] * y[S, p] / N_n[dest[p]]
+    rows = [index[T] * P + p for c in infectious if c in index]
+    cols = [index[c] * P + q for c in infectious if c in index]
+    F = sp.csr_matrix((np.tile(values, len(rows)), (np.concatenate(rows), np.concatenate(cols))),
+                      shape=(m, m))
+
+    mov = sp.coo_matrix(mov)
+    positions = np.arange(P)
+    rows = [a * P + mov.row for a in range(len(infected))]
+    cols = [a * P + mov.col for a in range(len(infected))]
+    vals = [- mov.data for _ in infected]
+    for src, dst, rate in transitions:
+        if src not in index:
+            continue
+        rate = np.broadcast_to(np.asarray(rate, dtype=float), (K,))[dest]
+        rows.append(index[src] * P + positions)
+        cols.append(index[src] * P + positions)
+        vals.append(rate)
+        if dst in index:
+            rows.append(index[dst] * P + positions)
+            cols.append(index[src] * P + positions)
+            vals.append(- rate)
+    V = sp.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(m, m))
+    return NextGeneration(F, V, infected)
+
+def reproduction_number(spec, movement, args, y_dfe, dense_limit=DENSE_LIMIT):
+    '''
+    Número reproductivo básico R0: radio espectral de `F V^-1`.
+
+    Parámetros
+    ---
+    `spec`, `movement`, `args`, `y_dfe`: Como en `next_generation`.
+
+    `dense_limit`: Tamaño máximo del espacio infectado para usar matrices densas;
+    por encima se usa `eigs` con la factorización LU dispersa de `V`.
+    '''
+    F, V, _ = next_generation(spec, movement, args, y_dfe)
+    m = F.shape[0]
+    if m <= dense_limit:
+        G = np.linalg.solve(V.toarray().T, F.toarray().T).T
+        return float(np.max(np.abs(np.linalg.eigvals(G))))
+    lu = splu(sp.csc_matrix(V))
+    G = LinearOperator((m, m), matvec=lambda x: F @ lu.solve(np.asarray(x).ravel()), dtype=float)
+    return float(np.abs(eigs(G, k=1, which='LM', return_eigenvectors=False)[0]))
+
+def node_thresholds(spec, movement, args, y_dfe):
+    '''
+    Umbrales de invasión por nodo.
+
+    Parámetros
+    ---
+    `spec`, `movement`, `args`, `y_dfe`: Como en `next_generation`.
+
+    Retorno
+    ---
+    `OptimizeResult` con:
+    - `local`: número reproductivo de cada nodo aislado (sin movimiento); el
+      nodo puede sostener un brote por sí solo si es mayor que `1`.
+    - `introduction`: casos secundarios (en todos los nodos) que genera un
+      infectado que aparece en cada nodo (en su nodo de residencia, en el
+      lagrangiano).
+    - `R0`: número reproductivo de toda la red.
+    '''
+    mobility, params = _split_args(movement, args)
+    C, S, T, infectious, N, Beta, transitions = resolve(spec, params)
+    K = _nodes(mobility, Beta, transitions)
+    P = K * K if movement == 'lagrange' else K
+
+    # Nodos aislados: la matriz de la próxima generación es diagonal por bloques.
+    y_local = np.zeros((C, K))
+    y_local[S] = 1.0
+    if N is not None:
+        y_local[N] = 1.0
+    F, V, infected = next_generation(spec, 'none', params, y_local.ravel())
+    G = np.linalg.solve(V.toarray().T, F.toarray().T).T
+    m = len(infected)
+    blocks = G.reshape((m, K, m, K)).diagonal(axis1=1, axis2=3).transpose((2, 0, 1))
+    local = np.max(np.abs(np.linalg.eigvals(blocks)), axis=1)
+
+    F, V, infected = next_generation(spec, movement, args, y_dfe)
+    z = spsolve(sp.csc_matrix(V.T), F.T @ np.ones(F.shape[0]))
+    home = np.arange(K) * (K + 1) if movement == 'lagrange' else np.arange(K)
+    introduction = z[infected.index(T) * P + home]
+    return OptimizeResult(local=local, introduction=introduction,
+                          R0=reproduction_number(spec, movement, args, y_dfe))
+
+def endemic_equilibrium(spec, movement, args, y0, guess=None, tol=1e-9, max_iter=100):
+    '''
+    Equilibrio endémico con el método de Newton y el jacobiano analítico.
+
+    Solo los modelos en los que los infectados vuelven a ser susceptibles
+    (como el SIS o un SEIRS) tienen un equilibrio endémico; en el SIR y el SEIR
+    todos los equilibrios son libres de enfermedad.
+
+    Parámetros
+    ---
+    `spec`, `movement`, `args`: Modelo, esquema de movimiento y argumentos de la fábrica.
+
+    `y0`: Estado con las poblaciones que se conservan (por ejemplo el estado inicial).
+
+    `guess`: Punto inicial. Por defecto se toma el equilibrio libre de
+    enfermedad (`disease_free_state`) con la población repartida por igual
+    entre los compartimentos, lejos de ese equilibrio.
+
+    `tol`: Tolerancia sobre la norma infinito de `fun(y)` relativa a la población.
+
+    `max_iter`: Cantidad máxima de iteraciones.
+
+    Retorno
+    ---
+    `OptimizeResult` con `x` (el equilibrio), `success`, `nit`, `residual`
+    (norma infinito de `fun(x)`) y `message`.
+    '''
+    mobility, params = _split_args(movement, args)
+    C, S, T, infectious, N, Beta, transitions = resolve(spec, params)
+    K = _nodes(mobility, Beta, transitions)
+    fun = generate_fun(spec, movement)(*args)
+    jac, _ = generate_jac(spec, movement)(*args)
+    y0 = np.asarray(y0, dtype=float)
+    W = _invariants(spec, _movement_structure(movement, mobility, K)[0])
+    # Columnas normalizadas para que `W W^T` tenga la escala de `jac`.
+    W = W @ sp.diags(1 / np.sqrt(np.asarray(W.power(2).sum(axis=0)).ravel()))
+    c = W.T @ y0
+    if guess is None:
+        guess = disease_free_state(spec, movement, args, y0).reshape((C, -1))
+        people = [k for k in range(C) if k != N]
+        guess[people] = guess[S] / len(people)
+        guess = guess.ravel()
+    y = np.asarray(guess, dtype=float).copy()
+    scale = max(1.0, np.abs(y0).max())
+
+    def G(y):
+        return fun(0.0, y) + W @ (W.T @ y - c)
+
+    g = G(y)
+    nit = 0
+    success = False
+    while nit < max_iter:
+        if np.abs(g).max() <= tol * scale:
+            success = True
+            break
+        nit += 1
+        step = _deflated_solve(jac(0.0, y), W, - g)
+        # Búsqueda lineal: se reduce el paso hasta que baje el residuo y el
+        # estado siga siendo no negativo (salvo errores de redondeo).
+        alpha = 1.0
+        while alpha > 1e-10:
+            y_new = y + alpha * step
+            if np.all(y_new >= - tol * scale):
+                g_new = G(y_new)
+                if np.linalg.norm(g_new) < np.linalg.norm(g):
+                    break
+            alpha /= 2
+        else:
+            break
+        y, g = y_new, g_new
+    residual = float(np.abs(fun(0.0, y)).max())
+    message = 'Convergió.' if success else 'No convergió.'
+    return OptimizeResult(x=y, success=success, nit=nit, residual=residual, message=message)
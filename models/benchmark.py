@@ -0,0 +1,331 @@
+'''
+Banco de pruebas de rendimiento de las fábricas de modelos.
+
+Uso (desde la raíz del repositorio):
+
+    python -m models.benchmark --K 2 5 10 --backends original vectorized \\
+        --mobility dense sparse --solvers RK45 LSODA \\
+        --history benchmark_history.jsonl --baseline benchmark_baseline.json
+
+Cada corrida agrega un registro JSON a `--history`. Con `--baseline` se
+comparan los tiempos y la memoria con los de un registro anterior y el
+programa termina con código 1 si alguna medición empeora más que `--tolerance`
+y, además, más que la diferencia mínima de `MIN_DIFFERENCE`, que evita tomar
+el ruido de las mediciones de microsegundos por regresiones.
+Con `--save-baseline` el registro de la corrida se guarda como nueva referencia.
+'''
+import argparse
+import datetime
+import importlib
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+from scipy.integrate import solve_ivp
+
+from . import original_models, sparse_models, vectorized_models
+
+#################################################
+##### CASOS DE PRUEBA ###########################
+#################################################
+
+# Movimiento y compartimentos de cada fábrica de `original_models`.
+MODELS = {
+    'fun_sir_model': ('none', ('S', 'I', 'R')),
+    'fun_sis_model': ('none', ('S', 'I')),
+    'fun_seir_model': ('none', ('S', 'E', 'I', 'R')),
+    'fun_euler_mov': ('eulerian', ('N',)),
+    'fun_lagrange_mov': ('lagrange', ('N',)),
+    'fun_sir_eulerian': ('eulerian', ('S', 'I', 'R', 'N')),
+    'fun_sir_eulerian_lite': ('eulerian', ('S', 'I', 'R')),
+    'fun_sir_lagrange': ('lagrange', ('S', 'I', 'R', 'N')),
+    'fun_sir_lagrange_lite': ('lagrange', ('S', 'I', 'R')),
+    'fun_sis_eulerian': ('eulerian', ('S', 'I', 'N')),
+    'fun_sis_eulerian_lite': ('eulerian', ('S', 'I')),
+    'fun_sis_lagrange': ('lagrange', ('S', 'I', 'N')),
+    'fun_sis_lagrange_lite': ('lagrange', ('S', 'I')),
+    'fun_seir_eulerian': ('eulerian', ('S', 'E', 'I', 'R', 'N')),
+    'fun_seir_lagrange': ('lagrange', ('S', 'E', 'I', 'R', 'N')),
+}
+
+# Valores iniciales por nodo, como en experiment_02.
+POPULATION = 2000.0
+INFECTED = 5.0
+
+def _factory(backend, name):
+    '''
+    Fábrica `name` del backend indicado, o `None` si el backend no la implementa.
+    '''
+    if backend == 'original':
+        return getattr(original_models, name)
+    if backend == 'vectorized':
+        return getattr(vectorized_models, name, None)
+    if backend == 'compiled':
+        return getattr(importlib.import_module('.compiled_models', __package__), name)
+    if backend == 'parallel':
+        return getattr(importlib.import_module('.parallel_models', __package__), name, None)
+    if backend == 'sparse':
+        return getattr(sparse_models, name + '_sparse', None)
+    raise ValueError(f'Backend desconocido: {backend}.')
+
+def mobility_matrices(K, mobility, rng, degree=3):
+    '''
+    Genera las matrices `Out` e `In` (la primera sirve también como `F`) con
+    valores en `(0,1)` y diagonal nula. Con `mobility='sparse'` cada nodo se
+    conecta con `degree` nodos elegidos al azar.
+    '''
+    if mobility == 'dense':
+        mask = ~np.eye(K, dtype=bool)
+    elif mobility == 'sparse':
+        mask = np.zeros((K,K), dtype=bool)
+        for i in range(K):
+            others = np.delete(np.arange(K), i)
+            mask[i, rng.choice(others, size=min(degree, K-1), replace=False)] = True
+    else:
+        raise ValueError("`mobility` debe ser 'dense' o 'sparse'.")
+    return rng.random((K,K)) * mask, rng.random((K,K)) * mask
+
+def initial_state(compartments, movement, K):
+    '''
+    Estado inicial con `POPULATION` personas por nodo, de las cuales
+    `INFECTED` están infestadas (y otras tantas expuestas en el SEIR).
+    '''
+    values = {'S': POPULATION - INFECTED, 'E': INFECTED, 'I': INFECTED, 'R': 0.0, 'N': POPULATION}
+    if 'E' in compartments:
+        values['S'] -= INFECTED
+    y = np.array([values[c] for c in compartments])
+    if movement == 'none':
+        return y
+    if movement == 'eulerian':
+        return np.repeat(y, K)
+    return (y[:, None, None] * np.eye(K)).ravel()
+
+def build_case(name, backend, K, mobility, seed=0, threads=None):
+    '''
+    Construye `(fun, y0)` para una fábrica, o `None` si el backend no la
+    implementa. Los modelos clásicos ignoran `K` y `mobility`, y solo el
+    backend `parallel` usa `threads` (por defecto, los hilos actuales de `numba`).
+    '''
+    factory = _factory(backend, name)
+    if factory is None:
+        return None
+    movement, compartments = MODELS[name]
+    rng = np.random.default_rng(seed)
+    n_params = 0 if compartments == ('N',) else 3 if 'E' in compartments else 2
+    if movement == 'none':
+        rates = list(rng.random(n_params))
+        return factory(*rates, POPULATION), initial_state(compartments, movement, 1)
+    Out, In = mobility_matrices(K, mobility, rng)
+    rates = [rng.random(K) for _ in range(n_params)]
+    mob = (Out,) if movement == 'eulerian' else (Out, In)
+    y0 = initial_state(compartments, movement, K)
+    if backend == 'sparse':
+        y0 = sparse_models.pack_lagrange_state(y0, Out, len(compartments))
+    if backend == 'parallel':
+        return factory(*mob, *rates, threads=threads), y0
+    return factory(*mob, *rates), y0
+
+#################################################
+##### MEDICIONES ################################
+#################################################
+
+# Rondas de `rhs_repeats` evaluaciones con que se mide la latencia del sistema.
+RHS_ROUNDS = 5
+
+# Diferencia mínima (absoluta) para considerar que una medición empeoró.
+MIN_DIFFERENCE = {'rhs_time': 2e-6, 'solve_time': 2e-3, 'peak_memory': 64 * 2**10}
+
+def measure(fun, y0, t_end, solver, rhs_repeats=50, solve_repeats=3, memory=True):
+    '''
+    Mide una fábrica ya construida.
+
+    Retorno
+    ---
+    Diccionario con la latencia de una evaluación de `fun` (`rhs_time`, el
+    promedio de `rhs_repeats` evaluaciones seguidas, en la mejor de
+    `RHS_ROUNDS` rondas), el mejor tiempo de `solve_repeats` llamadas a
+    `solve_ivp` (`solve_time`), la cantidad de evaluaciones de `fun` (`nfev`),
+    el pico de memoria reservada durante la solución (`peak_memory`, en bytes,
+    o `None`) y si la solución terminó bien.
+    '''
+    fun(0.0, y0.copy())
+    times = []
+    for _ in range(RHS_ROUNDS):
+        # Las copias se hacen antes de medir, porque algunos modelos modifican `y`.
+        ys = [y0.copy() for _ in range(rhs_repeats)]
+        start = time.perf_counter()
+        for y in ys:
+            fun(0.0, y)
+        times.append((time.perf_counter() - start) / rhs_repeats)
+    solve_times = []
+    for _ in range(solve_repeats):
+        start = time.perf_counter()
+        sol = solve_ivp(fun, (0, t_end), y0.copy(), method=solver)
+        solve_times.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        solve_ivp(fun, (0, t_end), y0.copy(), method=solver)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'rhs_time': min(times), 'solve_time': min(solve_times),
+            'nfev': int(sol.nfev), 'peak_memory': peak, 'success': bool(sol.success)}
+
+def case_key(result):
+    key = '{model}/{backend}/K={K}/{mobility}/{solver}'.format(**result)
+    return key if result.get('threads') is None else f"{key}/threads={result['threads']}"
+
+def run(models, backends, Ks, mobilities, solvers, t_end, rhs_repeats=50,
+        solve_repeats=3, memory=True, seed=0, log=None, threads=None):
+    '''
+    Ejecuta todas las combinaciones y devuelve la lista de resultados.
+    Los modelos clásicos se miden una sola vez, con `K = 1`. El backend
+    `parallel` se mide con cada cantidad de hilos de `threads` (por defecto,
+    los hilos actuales de `numba`).
+    '''
+    if 'compiled' in backends:
+        importlib.import_module('.compiled_models', __package__).precompile()
+    if 'parallel' in backends and not threads:
+        threads = [importlib.import_module('.parallel_models', __package__).get_num_threads()]
+    results = []
+    for name in models:
+        movement = MODELS[name][0]
+        for backend in backends:
+            if backend == 'sparse' and movement != 'lagrange':
+                continue
+            for K in ([1] if movement == 'none' else Ks):
+                for mobility in (['dense'] if movement == 'none' else mobilities):
+                    for n in (threads if backend == 'parallel' else [None]):
+                        case = build_case(name, backend, K, mobility, seed, n)
+                        if case is None:
+                            continue
+                        for solver in solvers:
+                            result = {'model': name, 'backend': backend, 'K': K,
+                                      'mobility': mobility, 'solver': solver, 'threads': n}
+                            result.update(measure(*case, t_end, solver, rhs_repeats, solve_repeats,
+                                                  memory))
+                            results.append(result)
+                            if log is not None:
+                                log(result)
+    return results
+
+#################################################
+##### HISTORIAL Y REGRESIONES ###################
+#################################################
+
+def _commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def make_record(config, results):
+    '''
+    Registro de una corrida, con el entorno en que se ejecutó.
+    '''
+    try:
+        import numba
+        numba_version = numba.__version__
+    except ImportError:
+        numba_version = None
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'commit': _commit(),
+        'machine': platform.machine(), 'processor': platform.processor(), 'node': platform.node(),
+        'python': platform.python_version(), 'numpy': np.__version__,
+        'scipy': scipy.__version__, 'numba': numba_version,
+        'config': config, 'results': results,
+    }
+
+def append_history(path, record):
+    '''
+    Agrega el registro al historial (un objeto JSON por línea).
+    '''
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+def compare(results, baseline, tolerance=0.25, metrics=('rhs_time', 'solve_time', 'peak_memory'),
+            floors=MIN_DIFFERENCE):
+    '''
+    Compara los resultados con los de un registro de referencia.
+
+    Retorno
+    ---
+    Lista de tuplas `(caso, métrica, referencia, actual)` para las mediciones
+    que superan a la referencia en más de `tolerance` (fracción) y en más de
+    `floors[métrica]` (diferencia absoluta).
+    '''
+    reference = {case_key(r): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        base = reference.get(case_key(result))
+        if base is None:
+            continue
+        for metric in metrics:
+            old, new = base.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + tolerance) and new - old > floors.get(metric, 0):
+                regressions.append((case_key(result), metric, old, new))
+    return regressions
+
+def _format(result):
+    peak = result['peak_memory']
+    peak = '-' if peak is None else f'{peak / 2**20:.2f} MiB'
+    return (f"{case_key(result):<60} rhs {result['rhs_time'] * 1e6:10.1f} us  "
+            f"solve {result['solve_time']:9.4f} s  nfev {result['nfev']:7d}  mem {peak}"
+            + ('' if result['success'] else '  (FALLÓ)'))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m models.benchmark',
+                                     description='Banco de pruebas de rendimiento de los modelos.')
+    parser.add_argument('--models', nargs='+', default=list(MODELS), choices=list(MODELS))
+    parser.add_argument('--backends', nargs='+', default=['original', 'vectorized', 'sparse'],
+                        choices=['original', 'vectorized', 'compiled', 'parallel', 'sparse'])
+    parser.add_argument('--threads', nargs='+', type=int,
+                        help='Cantidades de hilos del backend `parallel` (por defecto, las de `numba`).')
+    parser.add_argument('--K', nargs='+', type=int, default=[2, 5, 10])
+    parser.add_argument('--mobility', nargs='+', default=['dense', 'sparse'], choices=['dense', 'sparse'])
+    parser.add_argument('--solvers', nargs='+', default=['RK45'])
+    parser.add_argument('--t-end', type=float, default=100.0)
+    parser.add_argument('--rhs-repeats', type=int, default=50)
+    parser.add_argument('--solve-repeats', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='No medir el pico de memoria.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--history', default='benchmark_history.jsonl')
+    parser.add_argument('--baseline', help='Registro JSON de referencia para detectar regresiones.')
+    parser.add_argument('--save-baseline', help='Guarda el registro de esta corrida como referencia.')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    config = {'models': args.models, 'backends': args.backends, 'K': args.K,
+              'mobility': args.mobility, 'solvers': args.solvers, 't_end': args.t_end,
+              'rhs_repeats': args.rhs_repeats, 'solve_repeats': args.solve_repeats, 'seed': args.seed,
+              'threads': args.threads}
+    results = run(args.models, args.backends, args.K, args.mobility, args.solvers, args.t_end,
+                  args.rhs_repeats, args.solve_repeats, not args.no_memory, args.seed,
+                  log=lambda r: print(_format(r), flush=True), threads=args.threads)
+    record = make_record(config, results)
+    if args.history:
+        append_history(args.history, record)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(record, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for key, metric, old, new in regressions:
+            print(f'REGRESIÓN {key} {metric}: {old:.6g} -> {new:.6g} ({new / old - 1:+.0%})')
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.integrate import solve_ivp
+from scipy.optimize import OptimizeResult
+
+#################################################
+##### CACHÉ DE TRAYECTORIAS #####################
+#################################################
+#
+# `TrajectoryCache.solve` tiene los mismos argumentos que `solve_ivp`, pero
+# recibe la fábrica del modelo y sus argumentos (tupla o diccionario de
+# argumentos por nombre) en lugar de `fun`. La clave de cada solución es un
+# hash de la fábrica, de sus argumentos, de `y0`, del intervalo de tiempo y de
+# las opciones del integrador. Las soluciones se guardan en memoria (LRU
+# acotado) y, opcionalmente, en disco, con un tamaño máximo a partir del cual
+# se eliminan las entradas usadas hace más tiempo.
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'disk_hits', 'misses', 'currsize', 'maxsize', 'disk_bytes'])
+
+# Campos del resultado de `solve_ivp` que se guardan.
+_FIELDS = ('t', 'y', 'sol', 't_events', 'y_events', 'nfev', 'njev', 'nlu', 'status', 'message', 'success')
+
+def _update(h, obj, decimals):
+    '''
+    Agrega `obj` al hash `h`. Los arreglos se agregan con su tipo, forma y
+    contenido; si `decimals` no es `None`, los reales se redondean antes. Los
+    escalares reales (de Python o de numpy) se agregan como arreglos `float64`,
+    de modo que `0.5` y `np.float64(0.5)` dan la misma clave.
+    '''
+    if isinstance(obj, (int, float, np.integer, np.floating)) and not isinstance(obj, (bool, np.bool_)):
+        obj = np.asarray(obj, dtype=float)
+    if obj is None or isinstance(obj, (bool, complex, str, bytes)):
+        h.update(f'{type(obj).__name__}:{obj!r};'.encode())
+    elif sp.issparse(obj):
+        obj = sp.csr_matrix(obj)
+        h.update(b'sparse;')
+        _update(h, (obj.shape, obj.indptr, obj.indices, obj.data), decimals)
+    elif isinstance(obj, np.ndarray) or np.isscalar(obj):
+        arr = np.ascontiguousarray(obj)
+        if decimals is not None and arr.dtype.kind == 'f':
+            arr = np.round(arr, decimals) + 0.0
+        h.update(f'array:{arr.dtype.str}:{arr.shape};'.encode())
+        h.update(arr.tobytes())
+    elif isinstance(obj, (tuple, list)):
+        h.update(f'{type(obj).__name__}:{len(obj)};'.encode())
+        for item in obj:
+            _update(h, item, decimals)
+    elif isinstance(obj, dict):
+        h.update(f'dict:{len(obj)};'.encode())
+        for key in sorted(obj):
+            _update(h, key, decimals)
+            _update(h, obj[key], decimals)
+    elif isinstance(obj, functools.partial):
+        h.update(b'partial;')
+        _update(h, (obj.func, obj.args, obj.keywords), decimals)
+    elif callable(obj):
+        # Las fábricas generadas (`generate_fun`, ...) comparten el nombre, por
+        # lo que también se agregan las variables que capturan.
+        module = getattr(obj, '__module__', type(obj).__module__)
+        name = getattr(obj, '__qualname__', type(obj).__qualname__)
+        h.update(f'callable:{module}.{name};'.encode())
+        closure = getattr(obj, '__closure__', None) or ()
+        _update(h, [cell.cell_contents for cell in closure], decimals)
+    else:
+        raise TypeError(f'No se puede calcular la clave de un objeto de tipo {type(obj).__name__}.')
+
+def solve_key(factory, args, y0, t_span, t_eval=None, method='RK45', decimals=None, **options):
+    '''
+    Clave de una solución: hash SHA-256 de la fábrica, sus argumentos, `y0`,
+    el intervalo de tiempo y las opciones del integrador.
+    '''
+    h = hashlib.sha256()
+    args = args if isinstance(args, dict) else tuple(args)
+    _update(h, (factory, args, y0, tuple(t_span), t_eval, method, options), decimals)
+    return h.hexdigest()
+
+class TrajectoryCache:
+    '''
+    Caché de soluciones de modelos.
+
+    Parámetros
+    ---
+    `maxsize`: Cantidad máxima de soluciones en memoria.
+
+    `directory`: Carpeta del nivel en disco, o `None` para usar solo memoria.
+
+    `max_bytes`: Tamaño máximo del nivel en disco (`None` para no limitarlo).
+
+    `decimals`: Si no es `None`, los parámetros reales se redondean a esa
+    cantidad de decimales al calcular la clave, de modo que puntos casi
+    iguales comparten la solución.
+    '''
+    def __init__(self, maxsize=128, directory=None, max_bytes=None, decimals=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.decimals = decimals
+        self._memory = OrderedDict()
+        self.hits = self.disk_hits = self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def info(self):
+        '''
+        Estadísticas de uso, como `functools.lru_cache.cache_info`.
+        '''
+        return CacheInfo(self.hits, self.disk_hits, self.misses, len(self._memory),
+                         self.maxsize, self._disk_bytes())
+
+    def clear(self):
+        '''
+        Vacía ambos niveles y reinicia las estadísticas.
+        '''
+        self._memory.clear()
+        for path in self._disk_files():
+            os.remove(path)
+        self.hits = self.disk_hits = self.misses = 0
+
+    def solve(self, factory, args, y0, t_span, t_eval=None, method='RK45', **options):
+        '''
+        Devuelve la solución de `solve_ivp(factory(*args), t_span, y0, ...)`
+        (o de `factory(**args)` si `args` es un diccionario),
+        resolviendo el modelo solo si no está en la caché. Los arreglos del
+        resultado son de solo lectura.
+        '''
+        key = solve_key(factory, args, y0, t_span, t_eval, method, self.decimals, **options)
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return OptimizeResult(entry)
+        entry = self._load(key)
+        if entry is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            fun = factory(**args) if isinstance(args, dict) else factory(*args)
+            sol = solve_ivp(fun, t_span, y0, t_eval=t_eval, method=method, **options)
+            entry = {field: sol[field] for field in _FIELDS if field in sol}
+            for value in entry.values():
+                if isinstance(value, np.ndarray):
+                    value.flags.writeable = False
+            self._store(key, entry)
+        self._memory[key] = entry
+        if len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+        return OptimizeResult(entry)
+
+    ##### Nivel en disco #####
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def _disk_files(self):
+        if self.directory is None:
+            return []
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                if name.endswith('.pkl')]
+
+    def _disk_bytes(self):
+        return sum(os.path.getsize(path) for path in self._disk_files())
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        # La fecha de modificación marca el último uso, para la eliminación.
+        # Otro proceso puede haber eliminado la entrada después de leerla.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        for value in entry.values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+        return entry
+
+    def _store(self, key, entry):
+        if self.directory is None:
+            return
+        # Se escribe en un archivo temporal y se renombra, para que otros
+        # procesos que comparten la carpeta nunca lean una entrada incompleta.
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+        if self.max_bytes is not None:
+            self._evict()
+
+    def _evict(self):
+        files = []
+        for path in self._disk_files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
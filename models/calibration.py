@@ -0,0 +1,398 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.integrate import solve_ivp
+from scipy.optimize import OptimizeResult, differential_evolution, least_squares
+
+from .sensitivity import solve_sensitivity
+from .streaming import METHODS
+
+###############################################
+##### CALIBRACIÓN DE PARÁMETROS EN PARALELO ###
+###############################################
+#
+# Una `Calibration` reúne todo lo que necesita la función objetivo de los
+# experimentos de estimación: la fábrica del modelo, los parámetros fijos, la
+# forma en que el vector de parámetros libres `x` se traduce a tasas por nodo,
+# las cotas, el estado inicial y la serie observada. La misma instancia sirve
+# como objetivo escalar (error cuadrático medio, como `fitness_PSO` y
+# `fitness_DE`), como vector de residuos (como `fitness_LS`) y como evaluador
+# de poblaciones completas, que reparte las soluciones entre procesos.
+#
+# Cada proceso trabajador recibe la configuración una sola vez al iniciarse y
+# construye su propio evaluador, de modo que cada tarea solo envía `x`. Los
+# resultados se devuelven en el mismo orden que los candidatos, por lo que
+# una corrida con la misma semilla da el mismo resultado con cualquier
+# cantidad de procesos.
+#
+# `evaluate_pruned` evalúa candidatos con poda: el integrador avanza paso a
+# paso, la pérdida se acumula en los tiempos observados que cubre cada paso y
+# la solución se detiene en cuanto la suma parcial supera el umbral del
+# candidato. Como la suma parcial nunca disminuye, un candidato podado es
+# seguro peor que su umbral; su valor es la cota inferior alcanzada, que ya
+# supera el umbral. `run_pso` y `run_de` con `prune=True` usan como umbral el
+# valor que cada candidato debe mejorar, por lo que dan el mismo resultado
+# que sin poda.
+
+# Residuo que se asigna a cada tiempo cuando el integrador falla.
+FAILED_RESIDUAL = 1e10
+
+# Nombres de los argumentos de movimiento de las fábricas, por esquema.
+_MOBILITY_NAMES = {'none': (), 'eulerian': ('F',), 'lagrange': ('Out', 'In')}
+
+def _evaluate(config, x):
+    '''
+    Resuelve el modelo para el candidato `x` y devuelve los residuos
+    `observado - estimado`.
+    '''
+    factory, fixed, free, y0, t_eval, observed, compartment, compartments, method, options, cache = config
+    x = np.asarray(x, dtype=float)
+    params = dict(fixed)
+    for name, index in free.items():
+        params[name] = x[index]
+    if cache is None:
+        sol = solve_ivp(factory(**params), (t_eval[0], t_eval[-1]), y0,
+                        t_eval=t_eval, method=method, **options)
+    else:
+        sol = cache.solve(factory, params, y0, (t_eval[0], t_eval[-1]),
+                          t_eval=t_eval, method=method, **options)
+    if sol.status != 0 or sol.y.shape[1] != t_eval.shape[0]:
+        return np.full(observed.shape, FAILED_RESIDUAL)
+    estimate = sol.y.reshape((compartments, -1, sol.y.shape[1]))[compartment].sum(axis=0)
+    return observed - estimate
+
+def _evaluate_pruned(config, x, threshold):
+    '''
+    Error cuadrático medio del candidato `x`, deteniendo la solución cuando la
+    pérdida parcial supera `threshold`. Devuelve `(valor, terminado)`.
+    '''
+    factory, fixed, free, y0, t_eval, observed, compartment, compartments, method, options, cache = config
+    if cache is not None or not np.isfinite(threshold):
+        return float(np.mean(_evaluate(config, x) ** 2)), True
+    x = np.asarray(x, dtype=float)
+    params = dict(fixed)
+    for name, index in free.items():
+        params[name] = x[index]
+    T = t_eval.shape[0]
+    P = y0.shape[0] // compartments
+    rows = slice(compartment * P, (compartment + 1) * P)
+    limit = threshold * T
+    residuals = np.empty(T)
+    solver = METHODS.get(method, method)(factory(**params), t_eval[0], y0, t_eval[-1], **options)
+    k, total = 0, 0.0
+    if t_eval[0] == solver.t:
+        residuals[0] = observed[0] - y0[rows].sum()
+        total, k = residuals[0] ** 2, 1
+    while k < T:
+        solver.step()
+        if solver.status == 'failed':
+            return FAILED_RESIDUAL ** 2, True
+        j = np.searchsorted(t_eval, solver.t, side='right')
+        if j > k:
+            estimate = solver.dense_output()(t_eval[k:j])[rows].sum(axis=0)
+            residuals[k:j] = observed[k:j] - estimate
+            total += np.sum(residuals[k:j] ** 2)
+            k = j
+            if total > limit and k < T:
+                return total / T, False
+        if solver.status == 'finished' and k < T:
+            return FAILED_RESIDUAL ** 2, True
+    return float(np.mean(residuals ** 2)), True
+
+_WORKER_CONFIG = None
+
+def _init_worker(config):
+    global _WORKER_CONFIG
+    _WORKER_CONFIG = config
+
+def _worker_residuals(x):
+    return _evaluate(_WORKER_CONFIG, x)
+
+def _worker_pruned(task):
+    return _evaluate_pruned(_WORKER_CONFIG, *task)
+
+class Calibration:
+    '''
+    Problema de calibración de un modelo metapoblacional.
+
+    Parámetros
+    ---
+    `factory`: Fábrica del modelo, por ejemplo `vectorized_models.fun_sir_lagrange`.
+    Debe ser una función de módulo, para poder enviarla a los procesos.
+
+    `fixed`: Diccionario con los argumentos fijos de la fábrica (por ejemplo `Out` e `In`).
+
+    `free`: Diccionario que asigna a cada argumento libre de la fábrica un vector
+    de índices de `x`. Por ejemplo `{'Beta': [0, 0], 'Gamma': [1, 1]}` usa un
+    mismo `Beta` y un mismo `Gamma` en los dos nodos, como en experiment_03.
+
+    `bounds`: Lista de tuplas `(inferior, superior)`, una por componente de `x`.
+
+    `y0`: Estado inicial del modelo.
+
+    `t_eval`: Tiempos de la serie observada. La integración va de `t_eval[0]` a `t_eval[-1]`.
+
+    `observed`: Serie observada, de tamaño `len(t_eval)`.
+
+    `compartment`: Compartimento que se compara con la serie, sumado sobre
+    todos los nodos (por defecto `1`, los infestados).
+
+    `compartments`: Cantidad de compartimentos del modelo (por defecto `4`, SIR completo).
+
+    `method`, `options`: Método y opciones adicionales de `solve_ivp`.
+
+    `workers`: Cantidad de procesos para evaluar poblaciones. `1` evalúa en el
+    proceso actual y `-1` usa todos los núcleos.
+
+    `sensitivity`: Tupla opcional `(spec, movement)` con la especificación del
+    modelo de `factory` (ver `compartments`). Si se indica, `residuals_jacobian`
+    obtiene el jacobiano con una sola integración del sistema de sensibilidades
+    directas, en lugar de diferencias finitas. Si esa integración falla se
+    usan diferencias finitas y se cuenta en `nfallback`.
+
+    `cache`: `cache.TrajectoryCache` opcional para no repetir soluciones ya
+    calculadas. Cada proceso trabajador recibe su propia copia del nivel en
+    memoria; el nivel en disco, si lo hay, es compartido.
+    '''
+    def __init__(self, factory, fixed, free, bounds, y0, t_eval, observed,
+                 compartment=1, compartments=4, method='RK45', options=None, workers=1,
+                 sensitivity=None, cache=None):
+        self.bounds = [tuple(map(float, b)) for b in bounds]
+        free = {name: np.asarray(index, dtype=int) for name, index in free.items()}
+        self._config = (factory, dict(fixed), free, np.asarray(y0, dtype=float),
+                        np.asarray(t_eval, dtype=float), np.asarray(observed, dtype=float),
+                        compartment, compartments, method, dict(options or {}), cache)
+        self.workers = os.cpu_count() if workers == -1 else workers
+        self._pool = None
+        self.nfev = 0
+        self.npruned = 0
+        self.nfallback = 0
+        self.sensitivity = sensitivity
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        '''
+        Cierra el grupo de procesos, si se creó.
+        '''
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def residuals(self, x):
+        '''
+        Residuos `observado - estimado` para el candidato `x`.
+        '''
+        self.nfev += 1
+        return _evaluate(self._config, x)
+
+    def __call__(self, x):
+        '''
+        Error cuadrático medio para el candidato `x`.
+        '''
+        return float(np.mean(self.residuals(x) ** 2))
+
+    def map_residuals(self, X):
+        '''
+        Residuos de varios candidatos. Las filas de `X` son los candidatos; el
+        resultado tiene una fila por candidato, en el mismo orden.
+        '''
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        self.nfev += X.shape[0]
+        if self.workers <= 1 or X.shape[0] == 1:
+            return np.array([_evaluate(self._config, x) for x in X])
+        chunksize = max(1, X.shape[0] // (4 * self.workers))
+        return np.array(list(self._get_pool().map(_worker_residuals, X, chunksize=chunksize)))
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                             initargs=(self._config,))
+        return self._pool
+
+    def evaluate(self, X):
+        '''
+        Error cuadrático medio de varios candidatos (filas de `X`), en paralelo.
+        '''
+        return np.mean(self.map_residuals(X) ** 2, axis=1)
+
+    def evaluate_pruned(self, X, thresholds=np.inf):
+        '''
+        Error cuadrático medio de varios candidatos (filas de `X`), deteniendo
+        cada solución en cuanto su pérdida parcial supera su umbral.
+
+        Parámetros
+        ---
+        `X`: Candidatos, uno por fila.
+
+        `thresholds`: Umbral de cada candidato (o uno común), por ejemplo el
+        mejor valor encontrado. Con `np.inf` no se poda.
+
+        Retorno
+        ---
+        Tupla `(values, finished)`: los valores (para los candidatos podados, la
+        pérdida parcial, que ya supera el umbral) y si cada solución terminó
+        (`True`) o fue podada (`False`). Con `cache` no se poda.
+        '''
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        thresholds = np.broadcast_to(np.asarray(thresholds, dtype=float), (X.shape[0],))
+        self.nfev += X.shape[0]
+        tasks = list(zip(X, thresholds))
+        if self.workers <= 1 or X.shape[0] == 1:
+            results = [_evaluate_pruned(self._config, *task) for task in tasks]
+        else:
+            chunksize = max(1, X.shape[0] // (4 * self.workers))
+            results = list(self._get_pool().map(_worker_pruned, tasks, chunksize=chunksize))
+        values = np.array([value for value, _ in results])
+        finished = np.array([done for _, done in results], dtype=bool)
+        self.npruned += int((~finished).sum())
+        return values, finished
+
+    def residuals_jacobian(self, x):
+        '''
+        Jacobiano de los residuos. Con `sensitivity` se integra una vez el
+        sistema de sensibilidades directas; si no, se usan diferencias hacia
+        adelante y las `len(x) + 1` soluciones necesarias se evalúan en paralelo.
+        Si la integración de las sensibilidades falla también se usan
+        diferencias hacia adelante.
+        '''
+        x = np.asarray(x, dtype=float)
+        if self.sensitivity is not None:
+            J = self._sensitivity_jacobian(x)
+            if J is not None:
+                return J
+            self.nfallback += 1
+        return self._fd_jacobian(x)
+
+    def _fd_jacobian(self, x):
+        h = np.sqrt(np.finfo(float).eps) * np.maximum(1.0, np.abs(x))
+        X = np.vstack((x, x + np.diag(h)))
+        R = self.map_residuals(X)
+        return ((R[1:] - R[0]) / h[:, None]).T
+
+    def _sensitivity_jacobian(self, x):
+        # Devuelve `None` si la integración de las sensibilidades falla.
+        spec, movement = self.sensitivity
+        _, fixed, free, y0, t_eval, _, compartment, compartments, method, options, _ = self._config
+        params = dict(fixed)
+        for name, index in free.items():
+            params[name] = x[index]
+        args = [params[name] for name in _MOBILITY_NAMES[movement] + tuple(spec.parameters)]
+        self.nfev += 1
+        sol = solve_sensitivity(spec, movement, args, y0, (t_eval[0], t_eval[-1]), t_eval=t_eval,
+                                free=free, method=method, **options)
+        m = sol.sensitivity.shape[0]
+        if sol.status != 0 or sol.y.shape[1] != t_eval.shape[0]:
+            return None
+        dS = sol.sensitivity.reshape((m, compartments, -1, t_eval.shape[0]))[:, compartment]
+        return - dS.sum(axis=1).T
+
+def run_pso(calibration, n_particles=15, max_iter=100, w=0.8, c1=0.5, c2=0.5, tol=None, seed=None,
+            prune=False):
+    '''
+    Optimización por enjambre de partículas (PSO) sobre una `Calibration`.
+    Cada generación se evalúa completa con `calibration.evaluate`.
+
+    Parámetros
+    ---
+    `calibration`: Problema de calibración.
+
+    `n_particles`, `max_iter`: Tamaño del enjambre y cantidad máxima de iteraciones.
+
+    `w`, `c1`, `c2`: Inercia y coeficientes cognitivo y social.
+
+    `tol`: Si se indica, se detiene cuando el mejor valor es menor que `tol`.
+
+    `seed`: Semilla del generador aleatorio.
+
+    `prune`: Si es `True`, cada partícula se evalúa con `evaluate_pruned` y su
+    mejor valor propio como umbral. El resultado es el mismo que sin poda.
+
+    Retorno
+    ---
+    `OptimizeResult` con `x`, `fun`, `nit`, `nfev` y `npruned` (soluciones podadas).
+    '''
+    rng = np.random.default_rng(seed)
+    lb, ub = np.array(calibration.bounds).T
+    X = rng.uniform(lb, ub, size=(n_particles, lb.shape[0]))
+    V = rng.uniform(-(ub - lb), ub - lb, size=X.shape)
+    values = calibration.evaluate(X)
+    P, P_values = X.copy(), values.copy()
+    best = np.argmin(P_values)
+    nfev = n_particles
+    npruned = nit = 0
+    while nit < max_iter and not (tol is not None and P_values[best] < tol):
+        nit += 1
+        r1, r2 = rng.random(X.shape), rng.random(X.shape)
+        V = w * V + c1 * r1 * (P - X) + c2 * r2 * (P[best] - X)
+        X = np.clip(X + V, lb, ub)
+        if prune:
+            values, finished = calibration.evaluate_pruned(X, P_values)
+            npruned += int((~finished).sum())
+        else:
+            values = calibration.evaluate(X)
+        nfev += n_particles
+        improved = values < P_values
+        P[improved], P_values[improved] = X[improved], values[improved]
+        best = np.argmin(P_values)
+    return OptimizeResult(x=P[best], fun=P_values[best], nit=nit, nfev=nfev, npruned=npruned)
+
+def run_de(calibration, seed=None, prune=False, **kwargs):
+    '''
+    Evolución diferencial de scipy sobre una `Calibration`. Cada generación se
+    evalúa completa con `calibration.evaluate` (`vectorized=True`).
+
+    Parámetros
+    ---
+    `calibration`: Problema de calibración.
+
+    `seed`: Semilla del generador aleatorio.
+
+    `prune`: Si es `True`, los candidatos de cada generación se evalúan con
+    `evaluate_pruned` y el peor valor de la población como umbral: un
+    candidato que lo supera no puede reemplazar a ningún miembro, por lo que
+    el resultado es el mismo que sin poda. Con poda, `polish` es `False` por
+    defecto: el pulido final evaluaría el objetivo con el umbral de la última
+    generación y podría recibir pérdidas parciales.
+
+    `kwargs`: Argumentos adicionales de `scipy.optimize.differential_evolution`.
+    '''
+    if not prune:
+        return differential_evolution(lambda X: calibration.evaluate(X.T), calibration.bounds,
+                                      vectorized=True, updating='deferred', rng=seed, **kwargs)
+    state = {'threshold': np.inf, 'npruned': 0}
+    def objective(X):
+        values, finished = calibration.evaluate_pruned(X.T, state['threshold'])
+        state['npruned'] += int((~finished).sum())
+        return values
+    user_callback = kwargs.pop('callback', None)
+    def callback(intermediate_result):
+        state['threshold'] = float(np.max(intermediate_result.population_energies))
+        return None if user_callback is None else user_callback(intermediate_result)
+    kwargs.setdefault('polish', False)
+    result = differential_evolution(objective, calibration.bounds, vectorized=True,
+                                    updating='deferred', rng=seed, callback=callback, **kwargs)
+    result.npruned = state['npruned']
+    return result
+
+def run_least_squares(calibration, x0, **kwargs):
+    '''
+    Mínimos cuadrados (`scipy.optimize.least_squares`) sobre una `Calibration`,
+    con el jacobiano de `calibration.residuals_jacobian`.
+
+    Parámetros
+    ---
+    `calibration`: Problema de calibración.
+
+    `x0`: Punto inicial.
+
+    `kwargs`: Argumentos adicionales de `scipy.optimize.least_squares`.
+    '''
+    lb, ub = np.array(calibration.bounds).T
+    kwargs.setdefault('jac', calibration.residuals_jacobian)
+    return least_squares(calibration.residuals, x0, bounds=(lb, ub), **kwargs)
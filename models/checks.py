@@ -0,0 +1,356 @@
+'''
+Verificaciones numéricas de los modelos.
+
+Uso (desde la raíz del repositorio):
+
+    python -m models.checks --K 2 5 --backends vectorized compiled parallel sparse --threads 1 2 4
+    python -m models.checks --checks threshold equilibrium --K 2 5 --t-end 3000
+
+Hay cuatro verificaciones (`--checks`):
+  - `backends`: compara el sistema de cada backend con el de `original_models`
+    (las versiones con ciclos) en varios estados al azar. El backend
+    `parallel` se evalúa con cada cantidad de hilos de `--threads` y debe dar
+    el mismo resultado, bit a bit, con todas.
+  - `closed`: la solución de los modelos lagrangianos con la población exacta
+    (`population.generate_fun_closed_population`), completada con
+    `population.expand_population`, debe coincidir con la del modelo completo.
+  - `threshold`: con `Beta` escalado para que R0 (`analysis.reproduction_number`)
+    sea `1`, la abscisa espectral del sistema linealizado de los infectados
+    en el equilibrio libre de enfermedad debe ser `0`; con el `Beta` original,
+    su signo debe ser el de `R0 - 1`.
+  - `equilibrium`: el equilibrio endémico de `analysis.endemic_equilibrium`
+    debe coincidir con el estado de una integración larga (hasta `--t-end`).
+El programa termina con código 1 si alguna verificación falla.
+'''
+import argparse
+import importlib
+import sys
+
+import numpy as np
+from scipy.integrate import solve_ivp
+
+from . import sparse_models, vectorized_models
+from .analysis import disease_free_state, endemic_equilibrium, next_generation, reproduction_number
+from .benchmark import MODELS, POPULATION, build_case, initial_state, mobility_matrices
+from .compartments import SEIR, SIR, SIR_LITE, SIS, SIS_LITE, generate_fun
+from .population import expand_population, generate_fun_closed_population
+
+#################################################
+##### EQUIVALENCIA DE LOS BACKENDS ##############
+#################################################
+
+def random_state(name, K, Out, rng):
+    '''
+    Estado al azar del modelo `name`, con valores en `(0, POPULATION)`. En los
+    modelos lagrangianos solo hay agentes en la diagonal y en las aristas de
+    `Out`, para que el estado también se pueda representar en `sparse_models`.
+    '''
+    movement, compartments = MODELS[name]
+    C = len(compartments)
+    if movement == 'none':
+        return POPULATION * rng.random(C)
+    if movement == 'eulerian':
+        return POPULATION * rng.random(C*K)
+    mask = np.eye(K, dtype=bool) | (Out > 0)
+    return (POPULATION * rng.random((C,K,K)) * mask).ravel()
+
+def default_threads():
+    '''
+    Cantidades de hilos con que se verifica el backend `parallel`: `1`, `2`,
+    `4` y el máximo de `numba`, las que estén disponibles.
+    '''
+    limit = importlib.import_module('.parallel_models', __package__).MAX_THREADS
+    return sorted({n for n in (1, 2, 4, limit) if n <= limit})
+
+def check_backends(models, backends, Ks, mobilities, states=3, rtol=1e-10, seed=0, log=None,
+                   threads=None):
+    '''
+    Compara el sistema de cada backend con el de `original_models`.
+
+    Parámetros
+    ---
+    `models`, `backends`, `Ks`, `mobilities`: Casos a comparar, como en
+    `benchmark.run`. Los modelos clásicos se comparan una sola vez.
+
+    `states`: Cantidad de estados al azar por caso.
+
+    `rtol`: Diferencia máxima admitida, relativa al mayor valor del sistema.
+
+    `seed`: Semilla de los parámetros y de los estados.
+
+    `log`: Función opcional que recibe cada resultado.
+
+    `threads`: Cantidades de hilos del backend `parallel` (por defecto
+    `default_threads()`). El caso falla si los resultados no son idénticos
+    con todas.
+
+    Retorno
+    ---
+    Lista de diccionarios con `check`, `model`, `backend`, `K`, `mobility`,
+    `error` y `passed`.
+    '''
+    threads = default_threads() if threads is None and 'parallel' in backends else threads
+    results = []
+    for name in models:
+        movement, compartments = MODELS[name]
+        for K in (Ks if movement != 'none' else [1]):
+            for mobility in (mobilities if movement != 'none' else ['dense']):
+                reference = build_case(name, 'original', K, mobility, seed)[0]
+                # Las mismas matrices de movimiento que construye `build_case`.
+                Out = mobility_matrices(K, mobility, np.random.default_rng(seed))[0]
+                rng = np.random.default_rng(seed + 1)
+                Y = [random_state(name, K, Out, rng) for _ in range(states)]
+                expected = [reference(0.0, y.copy()) for y in Y]
+                for backend in backends:
+                    outputs = {}
+                    for n in (threads if backend == 'parallel' else [None]):
+                        case = build_case(name, backend, K, mobility, seed, n)
+                        if case is None:
+                            break
+                        fun = case[0]
+                        outputs[n] = []
+                        for y in Y:
+                            if backend == 'sparse':
+                                y = sparse_models.pack_lagrange_state(y, Out, len(compartments))
+                            outputs[n].append(np.asarray(fun(0.0, y.copy())))
+                    if not outputs:
+                        continue
+                    error = 0.0
+                    for got, f in zip(outputs[next(iter(outputs))], expected):
+                        if backend == 'sparse':
+                            f = sparse_models.pack_lagrange_state(f, Out, len(compartments))
+                        error = max(error, np.max(np.abs(got - f)) / max(1.0, np.max(np.abs(f))))
+                    # Con varios hilos el resultado no debe depender de su cantidad.
+                    first = outputs[next(iter(outputs))]
+                    identical = all(np.array_equal(a, b) for out in outputs.values()
+                                    for a, b in zip(first, out))
+                    result = {'check': 'backends', 'model': name, 'backend': backend, 'K': K,
+                              'mobility': mobility, 'error': float(error),
+                              'passed': bool(error <= rtol and identical)}
+                    results.append(result)
+                    if log is not None:
+                        log(result)
+    return results
+
+#################################################
+##### POBLACIÓN EXACTA ##########################
+#################################################
+
+# Modelos lagrangianos completos con variante de población exacta.
+CLOSED = {'fun_sir_lagrange': SIR, 'fun_sis_lagrange': SIS, 'fun_seir_lagrange': SEIR}
+
+def check_closed(models, Ks, mobilities, t_end=50.0, rtol=1e-6, seed=0, log=None):
+    '''
+    Compara la solución de cada modelo de `CLOSED` (de `vectorized_models`,
+    equivalente a `original_models`) con la de su variante de población exacta
+    completada con `expand_population`.
+
+    Parámetros
+    ---
+    `models`: Nombres de `CLOSED`.
+
+    `Ks`, `mobilities`: Cantidades de nodos y tipos de matrices de movimiento.
+
+    `t_end`: Tiempo final de las soluciones.
+
+    `rtol`: Diferencia máxima admitida, relativa a la población de un nodo.
+
+    `seed`, `log`: Como en `check_backends`.
+
+    Retorno
+    ---
+    Lista de diccionarios con `check`, `model`, `K`, `mobility`, `error` y `passed`.
+    '''
+    results = []
+    for name in models:
+        spec = CLOSED[name]
+        population = spec.compartments.index(spec.population)
+        for K in Ks:
+            for mobility in mobilities:
+                rng = np.random.default_rng(seed)
+                Out, In = mobility_matrices(K, mobility, rng)
+                rates = [rng.random(K) for _ in spec.parameters]
+                y0 = initial_state(spec.compartments, 'lagrange', K)
+                Y0 = y0.reshape((len(spec.compartments), K*K))
+                t_eval = np.linspace(0.0, t_end, 11)
+                options = {'method': 'LSODA', 'rtol': 1e-10, 'atol': 1e-8, 't_eval': t_eval}
+                full = solve_ivp(getattr(vectorized_models, name)(Out, In, *rates), (0.0, t_end), y0,
+                                 **options)
+                fun = generate_fun_closed_population(spec)(Out, In, *rates,
+                                                           N0=Y0[population].reshape((K,K)))
+                reduced = solve_ivp(fun, (0.0, t_end), np.delete(Y0, population, axis=0).ravel(),
+                                    **options)
+                expanded = expand_population(reduced.y, reduced.t, fun.population, spec)
+                error = float(np.max(np.abs(expanded - full.y)) / POPULATION)
+                result = {'check': 'closed', 'model': name, 'K': K, 'mobility': mobility,
+                          'error': error, 'passed': bool(full.success and reduced.success and error <= rtol)}
+                results.append(result)
+                if log is not None:
+                    log(result)
+    return results
+
+#################################################
+##### UMBRAL DE R0 Y EQUILIBRIOS ################
+#################################################
+
+SPECS = {'SIR': SIR, 'SIR_LITE': SIR_LITE, 'SIS': SIS, 'SIS_LITE': SIS_LITE, 'SEIR': SEIR}
+
+# Modelos con equilibrio endémico (los infectados vuelven a ser susceptibles).
+ENDEMIC = ('SIS', 'SIS_LITE')
+
+def build_analysis_case(name, movement, K, R0=None, seed=0):
+    '''
+    Construye `(spec, args, y0)` para el modelo `name` de `SPECS` con
+    movimiento denso (fuertemente conexo) y tasas al azar. Si se indica `R0`,
+    `Beta` se escala para que el número reproductivo sea ese.
+    '''
+    spec = SPECS[name]
+    rng = np.random.default_rng(seed)
+    Out, In = mobility_matrices(K, 'dense', rng)
+    mob = (Out,) if movement == 'eulerian' else (Out, In)
+    args = list(mob) + [0.1 + rng.random(K) for _ in spec.parameters]
+    y0 = initial_state(spec.compartments, movement, K)
+    if R0 is not None:
+        beta = len(mob) + spec.parameters.index('Beta')
+        y_dfe = disease_free_state(spec, movement, args, y0)
+        args[beta] = args[beta] * R0 / reproduction_number(spec, movement, args, y_dfe)
+    return spec, args, y0
+
+def _abscissa(spec, movement, args, y_dfe):
+    # Abscisa espectral de `F - V`, el jacobiano del subsistema infectado.
+    F, V, _ = next_generation(spec, movement, args, y_dfe)
+    return float(np.max(np.linalg.eigvals((F - V).toarray()).real)), abs(V).max()
+
+def check_threshold(models, movements, Ks, rtol=1e-8, seed=0, log=None):
+    '''
+    Verifica el umbral `R0 = 1` de `analysis.reproduction_number`.
+
+    Parámetros
+    ---
+    `models`: Nombres de `SPECS`.
+
+    `movements`, `Ks`: Esquemas de movimiento (`'eulerian'`, `'lagrange'`) y
+    cantidades de nodos.
+
+    `rtol`: Abscisa espectral máxima admitida con `R0 = 1`, relativa a la
+    mayor tasa de `V`.
+
+    `seed`: Semilla de las tasas y de las matrices de movimiento.
+
+    `log`: Función opcional que recibe cada resultado.
+
+    Retorno
+    ---
+    Lista de diccionarios con `check`, `model`, `movement`, `K`, `R0` (el del
+    `Beta` original), `error` y `passed`.
+    '''
+    results = []
+    for name in models:
+        for movement in movements:
+            for K in Ks:
+                spec, args, y0 = build_analysis_case(name, movement, K, seed=seed)
+                y_dfe = disease_free_state(spec, movement, args, y0)
+                R0 = reproduction_number(spec, movement, args, y_dfe)
+                abscissa, _ = _abscissa(spec, movement, args, y_dfe)
+                spec, args, y0 = build_analysis_case(name, movement, K, R0=1.0, seed=seed)
+                critical, scale = _abscissa(spec, movement, args, y_dfe)
+                error = abs(critical) / scale
+                result = {'check': 'threshold', 'model': name, 'movement': movement, 'K': K,
+                          'R0': R0, 'error': error,
+                          'passed': bool(error <= rtol and np.sign(abscissa) == np.sign(R0 - 1))}
+                results.append(result)
+                if log is not None:
+                    log(result)
+    return results
+
+def check_equilibrium(models, movements, Ks, R0=2.0, t_end=3000.0, rtol=1e-5, seed=0, log=None):
+    '''
+    Compara `analysis.endemic_equilibrium` con el estado en `t_end` de una
+    integración desde el estado inicial.
+
+    Parámetros
+    ---
+    `models`: Nombres de `SPECS` con equilibrio endémico (ver `ENDEMIC`).
+
+    `movements`, `Ks`, `seed`, `log`: Como en `check_threshold`.
+
+    `R0`: Número reproductivo de los casos (mayor que `1`).
+
+    `t_end`: Tiempo final de la integración.
+
+    `rtol`: Diferencia máxima admitida, relativa a la población.
+
+    Retorno
+    ---
+    Lista de diccionarios con `check`, `model`, `movement`, `K`, `error` y `passed`.
+    '''
+    results = []
+    for name in models:
+        for movement in movements:
+            for K in Ks:
+                spec, args, y0 = build_analysis_case(name, movement, K, R0=R0, seed=seed)
+                equilibrium = endemic_equilibrium(spec, movement, args, y0)
+                sol = solve_ivp(generate_fun(spec, movement)(*args), (0.0, t_end), y0,
+                                method='LSODA', rtol=1e-10, atol=1e-10)
+                error = np.max(np.abs(equilibrium.x - sol.y[:, -1])) / np.abs(y0).max()
+                result = {'check': 'equilibrium', 'model': name, 'movement': movement, 'K': K,
+                          'error': float(error),
+                          'passed': bool(equilibrium.success and sol.success and error <= rtol)}
+                results.append(result)
+                if log is not None:
+                    log(result)
+    return results
+
+def _format(result):
+    if result['check'] == 'backends':
+        case = f"{result['backend']:<10} K={result['K']:<4} {result['mobility']:<8}"
+    elif result['check'] == 'closed':
+        case = f"{'lagrange':<10} K={result['K']:<4} {result['mobility']:<8}"
+    else:
+        case = f"{result['movement']:<10} K={result['K']:<4} " + (
+            f"R0={result['R0']:<6.3f}" if 'R0' in result else ' ' * 9)
+    return (f"{result['check']:<12} {result['model']:<24} {case} error {result['error']:.2e}"
+            + ('' if result['passed'] else '  (FALLÓ)'))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m models.checks',
+                                     description='Verificaciones numéricas de los modelos.')
+    parser.add_argument('--checks', nargs='+', default=['backends', 'closed', 'threshold', 'equilibrium'],
+                        choices=['backends', 'closed', 'threshold', 'equilibrium'])
+    parser.add_argument('--models', nargs='+', default=list(MODELS), choices=list(MODELS),
+                        help='Fábricas que se comparan en `backends`.')
+    parser.add_argument('--specs', nargs='+', default=list(SPECS), choices=list(SPECS),
+                        help='Modelos de `threshold` y `equilibrium` (en este solo los de `ENDEMIC`).')
+    parser.add_argument('--movements', nargs='+', default=['eulerian', 'lagrange'],
+                        choices=['eulerian', 'lagrange'])
+    parser.add_argument('--backends', nargs='+', default=['vectorized', 'compiled', 'parallel', 'sparse'],
+                        choices=['vectorized', 'compiled', 'parallel', 'sparse'])
+    parser.add_argument('--threads', nargs='+', type=int,
+                        help='Cantidades de hilos del backend `parallel` (por defecto 1, 2, 4 y el máximo).')
+    parser.add_argument('--K', nargs='+', type=int, default=[2, 5, 10])
+    parser.add_argument('--mobility', nargs='+', default=['dense', 'sparse'], choices=['dense', 'sparse'])
+    parser.add_argument('--states', type=int, default=3)
+    parser.add_argument('--rtol', type=float, default=1e-10)
+    parser.add_argument('--t-end', type=float, default=3000.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    log = lambda r: print(_format(r), flush=True)
+    results = []
+    if 'backends' in args.checks:
+        results += check_backends(args.models, args.backends, args.K, args.mobility, args.states,
+                                  args.rtol, args.seed, log=log, threads=args.threads)
+    if 'closed' in args.checks:
+        results += check_closed([name for name in args.models if name in CLOSED], args.K, args.mobility,
+                                seed=args.seed, log=log)
+    if 'threshold' in args.checks:
+        results += check_threshold(args.specs, args.movements, args.K, seed=args.seed, log=log)
+    if 'equilibrium' in args.checks:
+        results += check_equilibrium([name for name in args.specs if name in ENDEMIC], args.movements,
+                                     args.K, t_end=args.t_end, seed=args.seed, log=log)
+    failed = [r for r in results if not r['passed']]
+    print(f'{len(results) - len(failed)} de {len(results)} verificaciones correctas.')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,295 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.cluster.vq import kmeans2
+from scipy.integrate import solve_ivp
+from scipy.optimize import OptimizeResult
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import eigsh
+
+from .analysis import _deflated_solve
+from .compartments import _split_args, euler_operator
+
+#####################################################
+##### REDUCCIÓN DE LA RED (AGRUPAMIENTO) ############
+#####################################################
+#
+# Para explorar escenarios rápidamente se puede reemplazar la red de `K`
+# nodos por una de `M` grupos de nodos muy conectados entre sí:
+#   - `cluster_nodes` agrupa los nodos con agrupamiento espectral del
+#     acoplamiento de movilidad (personas de cada nodo presentes en el otro).
+#   - `coarsen` construye los parámetros del modelo reducido para las mismas
+#     fábricas (`original_models`, `compartments`, ...): las tasas por nodo se
+#     promedian con pesos de población y los flujos entre grupos se toman
+#     del estado estacionario del movimiento: en el euleriano, la población
+#     estacionaria de cada nodo (el movimiento redistribuye a las personas); en
+#     el lagrangiano, las tasas de regreso se eligen para que cada par de
+#     grupos tenga la misma cantidad de personas que la red completa. Así el
+#     estado estacionario del modelo reducido es el de la red completa sumado
+#     por grupos. Los viajes dentro de un mismo grupo desaparecen.
+#   - `restrict` y `prolong` llevan estados de los nodos a los grupos (sumas)
+#     y de los grupos a los nodos (repartiendo cada grupo según la ocupación
+#     estacionaria).
+#   - `coarsening_error` compara el modelo reducido con el completo en una
+#     muestra de escenarios.
+# Con movimiento lagrangiano el costo pasa de `O(K^2)` a `O(M^2)` por evaluación.
+
+# Tamaño máximo de la red para calcular los vectores propios con matrices densas.
+DENSE_NODES = 500
+
+CoarseNetwork = namedtuple('CoarseNetwork', ['labels', 'movement', 'mobility', 'rates', 'populations',
+                                             'weights'])
+
+def _stationary_euler(F, populations):
+    '''
+    Población estacionaria de cada nodo con movimiento euleriano y la misma
+    población total que `populations` en cada componente conexa de `F` (que
+    debe tener un único estado estacionario, como en
+    `analysis.disease_free_state`).
+    '''
+    F = sp.csr_matrix(F)
+    K = F.shape[0]
+    m, labels = connected_components(F, connection='weak')
+    W = sp.csr_matrix((np.ones(K), (np.arange(K), labels)), shape=(K, m))
+    return _deflated_solve(sp.csr_matrix(euler_operator(F)), W, W @ (W.T @ populations))
+
+def _occupancy(movement, mobility, populations):
+    '''
+    Personas del nodo `i` presentes en el nodo `j` (matriz dispersa `K x K`) en
+    el estado estacionario del movimiento lagrangiano, o flujo por unidad de
+    tiempo de `i` a `j` con la población estacionaria en el euleriano.
+    '''
+    N = np.asarray(populations, dtype=float)
+    if movement == 'eulerian':
+        return sp.diags(_stationary_euler(mobility[0], N)) @ sp.csr_matrix(mobility[0])
+    Out, In = sp.csr_matrix(mobility[0]), sp.csr_matrix(mobility[1])
+    ratio = Out.copy()
+    rows, cols = ratio.nonzero()
+    back = np.asarray(In[rows, cols]).ravel()
+    if np.any(back <= 0):
+        raise ValueError('Cada salida (`Out[i,j] > 0`) necesita una tasa de regreso `In[i,j] > 0`.')
+    ratio = sp.csr_matrix((np.asarray(Out[rows, cols]).ravel() / back, (rows, cols)), shape=Out.shape)
+    home = N / (1 + np.asarray(ratio.sum(axis=1)).ravel())
+    return (sp.diags(home) @ ratio + sp.diags(home)).tocsr()
+
+def cluster_nodes(movement, mobility, populations, M, seed=0):
+    '''
+    Agrupa los nodos según el acoplamiento de movilidad.
+
+    Parámetros
+    ---
+    `movement`: `'eulerian'` o `'lagrange'`.
+
+    `mobility`: Tupla `(F,)` o `(Out, In)` (densas o dispersas).
+
+    `populations`: Población de cada nodo.
+
+    `M`: Cantidad de grupos.
+
+    `seed`: Semilla de `kmeans2`.
+
+    Retorno
+    ---
+    Vector con el grupo (`0..M'-1`) de cada nodo. Si algún grupo queda vacío
+    los grupos se renumeran y `M'` puede ser menor que `M`.
+    '''
+    W = _occupancy(movement, mobility, populations)
+    W = (W + W.T).tolil()
+    W.setdiag(0)
+    W = W.tocsr()
+    K = W.shape[0]
+    if not 1 <= M <= K:
+        raise ValueError('`M` debe estar entre 1 y la cantidad de nodos.')
+    if M == K:
+        return np.arange(K)
+    degree = np.asarray(W.sum(axis=1)).ravel()
+    scale = 1 / np.sqrt(np.maximum(degree, np.finfo(float).tiny))
+    A = sp.diags(scale) @ W @ sp.diags(scale)
+    if K <= DENSE_NODES:
+        _, vectors = np.linalg.eigh(A.toarray())
+        vectors = vectors[:, -M:]
+    else:
+        _, vectors = eigsh(A, k=M, which='LA')
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms > 0, norms, 1)
+    _, labels = kmeans2(vectors, M, minit='++', seed=seed)
+    return np.unique(labels, return_inverse=True)[1]
+
+def coarsen(movement, args, populations, labels):
+    '''
+    Parámetros del modelo reducido.
+
+    Parámetros
+    ---
+    `movement`: `'eulerian'` o `'lagrange'`.
+
+    `args`: Argumentos de la fábrica del modelo completo (matrices de movimiento
+    y tasas, por nodo o comunes).
+
+    `populations`: Población de cada nodo.
+
+    `labels`: Grupo de cada nodo (por ejemplo el resultado de `cluster_nodes`).
+
+    Retorno
+    ---
+    `CoarseNetwork(labels, movement, mobility, rates, populations, weights)`:
+    `mobility + rates` son los argumentos de la misma fábrica para los `M`
+    grupos, `populations` la población de cada grupo (la estacionaria, en el
+    euleriano) y `weights` los pesos con que `prolong` reparte cada posición
+    del modelo reducido.
+    '''
+    mobility, rates = _split_args(movement, args)
+    N = np.asarray(populations, dtype=float)
+    if movement == 'eulerian':
+        # Las personas se reparten según la población estacionaria del movimiento.
+        N = _stationary_euler(mobility[0], N)
+    labels = np.asarray(labels)
+    K, M = labels.shape[0], int(labels.max()) + 1
+    P = sp.csr_matrix((np.ones(K), (np.arange(K), labels)), shape=(K, M))
+    N_group = P.T @ N
+    dense = not sp.issparse(mobility[0])
+
+    def mean(x):
+        x = np.asarray(x, dtype=float)
+        return x if x.ndim == 0 else (P.T @ (N * x)) / N_group
+
+    if movement == 'eulerian':
+        F = (P.T @ sp.diags(N) @ sp.csr_matrix(mobility[0]) @ P).tolil()
+        F.setdiag(0)
+        coarse = (sp.diags(1 / N_group) @ F.tocsr(),)
+        weights = N / N_group[labels]
+    else:
+        occupancy = _occupancy(movement, mobility, N)
+        Out = sp.diags(N) @ sp.csr_matrix(mobility[0])
+        Out = (P.T @ Out @ P).tolil()
+        Out.setdiag(0)
+        Out = sp.diags(1 / N_group) @ Out.tocsr()
+        # Ocupación estacionaria de cada par de grupos: `In[a,b] = Out[a,b] x_aa / x_ab`.
+        x = (P.T @ occupancy @ P).toarray()
+        Out = Out.tocoo()
+        In = sp.csr_matrix((Out.data * x[Out.row, Out.row] / x[Out.row, Out.col], (Out.row, Out.col)),
+                           shape=(M, M))
+        coarse = (Out.tocsr(), In)
+        occupancy = occupancy.tocoo()
+        share = np.zeros((K, K))
+        share[occupancy.row, occupancy.col] = occupancy.data / x[labels[occupancy.row], labels[occupancy.col]]
+        weights = share.ravel()
+    if dense:
+        coarse = tuple(m.toarray() for m in coarse)
+    return CoarseNetwork(labels, movement, coarse, tuple(mean(r) for r in rates), N_group, weights)
+
+def _positions(coarse):
+    '''
+    Posición del modelo reducido que corresponde a cada posición del completo.
+    '''
+    labels = coarse.labels
+    M = coarse.populations.shape[0]
+    if coarse.movement == 'eulerian':
+        return labels
+    return (labels[:, None] * M + labels[None, :]).ravel()
+
+def restrict(y, coarse):
+    '''
+    Lleva un estado del modelo completo (o una trayectoria, `n x T`) al
+    reducido, sumando las personas de cada grupo.
+    '''
+    y = np.asarray(y, dtype=float)
+    positions = _positions(coarse)
+    P, Q = positions.shape[0], coarse.populations.shape[0] ** (1 if coarse.movement == 'eulerian' else 2)
+    C = y.shape[0] // P
+    Y = y.reshape((C, P, -1))
+    result = np.zeros((C, Q, Y.shape[2]))
+    for c in range(C):
+        np.add.at(result[c], positions, Y[c])
+    return result.reshape((C * Q,) + y.shape[1:])
+
+def prolong(Y, coarse):
+    '''
+    Lleva un estado del modelo reducido (o una trayectoria, `n x T`) a los
+    nodos, repartiendo cada posición según `coarse.weights`.
+    '''
+    Y = np.asarray(Y, dtype=float)
+    positions = _positions(coarse)
+    Q = coarse.populations.shape[0] ** (1 if coarse.movement == 'eulerian' else 2)
+    C = Y.shape[0] // Q
+    y = Y.reshape((C, Q, -1))[:, positions] * coarse.weights[None, :, None]
+    return y.reshape((C * positions.shape[0],) + Y.shape[1:])
+
+def _by_node(y, movement, K, compartment, C):
+    y = y.reshape((C, -1, y.shape[-1]))[compartment]
+    if movement == 'lagrange':
+        y = y.reshape((K, K, -1)).sum(axis=1)
+    return y
+
+def coarsening_error(factory, movement, scenarios, M, t_eval, compartment=1, sample=None, seed=0,
+                     method='RK45', options=None):
+    '''
+    Error del modelo reducido respecto al completo en una muestra de escenarios.
+
+    Parámetros
+    ---
+    `factory`: Fábrica del modelo (por ejemplo `original_models.fun_sir_lagrange`).
+
+    `movement`: `'eulerian'` o `'lagrange'`.
+
+    `scenarios`: Lista de tuplas `(args, y0, populations)` con los argumentos de
+    la fábrica, el estado inicial completo y la población de cada nodo.
+
+    `M`: Cantidad de grupos del modelo reducido.
+
+    `t_eval`: Tiempos de comparación; la integración va de `t_eval[0]` a `t_eval[-1]`.
+
+    `compartment`: Compartimento que se compara (por defecto `1`, los infestados).
+
+    `sample`: Cantidad de escenarios elegidos al azar (con `seed`); por defecto todos.
+
+    `method`, `options`: Método y opciones adicionales de `solve_ivp`.
+
+    Retorno
+    ---
+    `OptimizeResult` con un valor por escenario de la muestra:
+    - `node_error`: error relativo (norma de Frobenius en nodos y tiempos) del
+      compartimento por nodo de residencia, con la solución reducida llevada a
+      los nodos con `prolong`.
+    - `group_error`: lo mismo para los totales de cada grupo.
+    - `peak_error`: error relativo del máximo del total de la red.
+    - `peak_time_error`: diferencia absoluta del tiempo de ese máximo.
+    - `speedup`: tiempo del modelo completo sobre el del reducido.
+    y `sample`, los índices de los escenarios usados.
+    '''
+    t_eval = np.asarray(t_eval, dtype=float)
+    options = dict(options or {})
+    rng = np.random.default_rng(seed)
+    chosen = np.arange(len(scenarios)) if sample is None else np.sort(
+        rng.choice(len(scenarios), size=min(sample, len(scenarios)), replace=False))
+    errors = {name: [] for name in ('node_error', 'group_error', 'peak_error', 'peak_time_error', 'speedup')}
+    for s in chosen:
+        args, y0, populations = scenarios[s]
+        mobility, _ = _split_args(movement, args)
+        K = mobility[0].shape[0]
+        labels = cluster_nodes(movement, mobility, populations, M, seed=seed)
+        coarse = coarsen(movement, args, populations, labels)
+
+        start = time.perf_counter()
+        full = solve_ivp(factory(*args), (t_eval[0], t_eval[-1]), y0, t_eval=t_eval, method=method, **options)
+        middle = time.perf_counter()
+        reduced = solve_ivp(factory(*coarse.mobility, *coarse.rates), (t_eval[0], t_eval[-1]),
+                            restrict(y0, coarse), t_eval=t_eval, method=method, **options)
+        end = time.perf_counter()
+        if full.status != 0 or reduced.status != 0:
+            for values in errors.values():
+                values.append(np.nan)
+            continue
+        C = full.y.shape[0] // (K if movement == 'eulerian' else K * K)
+        exact = _by_node(full.y, movement, K, compartment, C)
+        approx = _by_node(prolong(reduced.y, coarse), movement, K, compartment, C)
+        G = sp.csr_matrix((np.ones(K), (labels, np.arange(K))), shape=(coarse.populations.shape[0], K))
+        total, total_approx = exact.sum(axis=0), approx.sum(axis=0)
+        errors['node_error'].append(np.linalg.norm(approx - exact) / np.linalg.norm(exact))
+        errors['group_error'].append(np.linalg.norm(G @ approx - G @ exact) / np.linalg.norm(G @ exact))
+        errors['peak_error'].append(abs(total_approx.max() - total.max()) / total.max())
+        errors['peak_time_error'].append(abs(t_eval[total_approx.argmax()] - t_eval[total.argmax()]))
+        errors['speedup'].append((middle - start) / (end - middle))
+    return OptimizeResult(sample=chosen, **{name: np.array(values) for name, values in errors.items()})
@@ -0,0 +1,530 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+import scipy.sparse as sp
+
+#####################################################
+##### ESPECIFICACIÓN DECLARATIVA DE LOS MODELOS #####
+#####################################################
+#
+# Un modelo compartimental se describe con un `ModelSpec`:
+#   - `compartments`: nombres de los compartimentos, en el orden del vector `y`.
+#   - `parameters`: nombres de las tasas por nodo, en el orden en que las
+#     reciben las fábricas (después de las matrices de movimiento).
+#   - `infection`: un `Infection` con el compartimento susceptible, el
+#     compartimento al que pasan los contagiados, los compartimentos que
+#     contagian y el nombre de la tasa de contagio; o `None` si no hay infección.
+#   - `transitions`: transiciones lineales `Transition(origen, destino, tasa)`.
+#   - `population`: compartimento con la población total, o `None` si la
+#     población es la suma de todos los compartimentos (modelos `_lite`).
+#
+# La infección en el nodo `n` es `tasa[n] * S * sum(infecciosos)_n / N_n`,
+# donde en el movimiento lagrangiano las sumas por nodo incluyen a todos los
+# agentes que se encuentran en `n`. Por ejemplo, un SEIRS lite se describe así:
+#
+#   SEIRS = ModelSpec(('S', 'E', 'I', 'R'), ('Beta', 'Sigma', 'Gamma', 'Xi'),
+#                     Infection('S', 'E', ('I',), 'Beta'),
+#                     (Transition('E', 'I', 'Sigma'), Transition('I', 'R', 'Gamma'),
+#                      Transition('R', 'S', 'Xi')), None)
+#   fun_seirs_lagrange = generate_fun(SEIRS, 'lagrange')
+
+ModelSpec = namedtuple('ModelSpec', ['compartments', 'parameters', 'infection', 'transitions', 'population'])
+Infection = namedtuple('Infection', ['susceptible', 'target', 'infectious', 'rate'])
+Transition = namedtuple('Transition', ['source', 'target', 'rate'])
+
+MOVEMENT = ModelSpec(('N',), (), None, (), None)
+
+SIR = ModelSpec(('S', 'I', 'R', 'N'), ('Beta', 'Gamma'),
+                Infection('S', 'I', ('I',), 'Beta'),
+                (Transition('I', 'R', 'Gamma'),), 'N')
+SIR_LITE = ModelSpec(('S', 'I', 'R'), ('Beta', 'Gamma'),
+                     Infection('S', 'I', ('I',), 'Beta'),
+                     (Transition('I', 'R', 'Gamma'),), None)
+
+SIS = ModelSpec(('S', 'I', 'N'), ('Beta', 'Gamma'),
+                Infection('S', 'I', ('I',), 'Beta'),
+                (Transition('I', 'S', 'Gamma'),), 'N')
+SIS_LITE = ModelSpec(('S', 'I'), ('Beta', 'Gamma'),
+                     Infection('S', 'I', ('I',), 'Beta'),
+                     (Transition('I', 'S', 'Gamma'),), None)
+
+SEIR = ModelSpec(('S', 'E', 'I', 'R', 'N'), ('Beta', 'Gamma', 'Sigma'),
+                 Infection('S', 'E', ('I',), 'Beta'),
+                 (Transition('E', 'I', 'Sigma'), Transition('I', 'R', 'Gamma')), 'N')
+# `original_models.fun_seir_eulerian` calcula la fuerza de infección con los
+# expuestos (`y[1]`); esta especificación conserva ese comportamiento.
+SEIR_ORIGINAL_EULERIAN = SEIR._replace(infection=Infection('S', 'E', ('E',), 'Beta'))
+
+def _structure(spec):
+    '''
+    Traduce un `ModelSpec` a índices enteros.
+
+    Retorno
+    ---
+    Tupla `(C, S, T, infectious, N, transitions)`: cantidad de compartimentos,
+    índices del susceptible y del destino de la infección (`None` si no hay
+    infección), lista de índices infecciosos, índice de la población (`None`
+    si es la suma de todos) y lista de `(origen, destino, índice de la tasa)`.
+    '''
+    index = {name: c for c, name in enumerate(spec.compartments)}
+    C = len(spec.compartments)
+    if spec.infection is None:
+        S, T, infectious = None, None, []
+    else:
+        S = index[spec.infection.susceptible]
+        T = index[spec.infection.target]
+        infectious = [index[name] for name in spec.infection.infectious]
+    N = None if spec.population is None else index[spec.population]
+    transitions = [(index[tr.source], index[tr.target], spec.parameters.index(tr.rate))
+                   for tr in spec.transitions]
+    return C, S, T, infectious, N, transitions
+
+def resolve(spec, params):
+    '''
+    Enlaza los valores de los parámetros con la estructura de un modelo.
+
+    Parámetros
+    ---
+    `spec`: Especificación del modelo (`ModelSpec`).
+
+    `params`: Valores de las tasas, en el orden de `spec.parameters`.
+
+    Retorno
+    ---
+    Tupla `(C, S, T, infectious, N, Beta, transitions)` como la de `_structure`,
+    donde `Beta` es el valor de la tasa de contagio (`None` si no hay infección)
+    y cada transición es `(origen, destino, tasa)` con el valor de la tasa.
+    '''
+    if len(params) != len(spec.parameters):
+        raise TypeError(f'Se esperaban los parámetros {spec.parameters}.')
+    C, S, T, infectious, N, transitions = _structure(spec)
+    Beta = None if spec.infection is None else params[spec.parameters.index(spec.infection.rate)]
+    transitions = [(src, dst, params[r]) for src, dst, r in transitions]
+    return C, S, T, infectious, N, Beta, transitions
+
+#########################################
+##### OPERADORES DE MOVIMIENTO ##########
+#########################################
+
+# Densidad máxima de `F` para la cual el operador euleriano se guarda como
+# matriz dispersa CSR en lugar de como arreglo denso.
+EULER_SPARSE_DENSITY = 0.1
+
+_MOBILITY_ARGS = {'none': 0, 'eulerian': 1, 'lagrange': 2}
+
+def euler_operator(F):
+    '''
+    Construye el operador lineal del movimiento euleriano
+    `L = F.T - diag(F.sum(1))`, de modo que el flujo de un compartimento
+    `y` es `L @ y`.
+
+    Parámetros
+    ---
+    `F`: Matriz de movimiento de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser un arreglo denso o una matriz de `scipy.sparse`.
+
+    Retorno
+    ---
+    `L`: Operador de dimensión `K x K`. Es una matriz CSR si la densidad de `F`
+    no supera `EULER_SPARSE_DENSITY`, y un arreglo denso en otro caso.
+    '''
+    K = F.shape[0]
+    nnz = F.nnz if sp.issparse(F) else np.count_nonzero(F)
+    if nnz <= EULER_SPARSE_DENSITY * K * K:
+        F = sp.csr_matrix(F, dtype=float)
+        out_rate = np.asarray(F.sum(axis=1)).ravel()
+        return (F.T - sp.diags(out_rate)).tocsr()
+    F = F.toarray() if sp.issparse(F) else np.asarray(F, dtype=float)
+    return F.T - np.diag(F.sum(axis=1))
+
+def _euler_flux(L, y):
+    '''
+    Aplica el operador `L` a todos los compartimentos de `y` (forma `C x K`)
+    con un solo producto matricial. Devuelve un arreglo nuevo de forma `C x K`.
+    '''
+    return np.asarray(L @ y.T).T.copy()
+
+def _lagrange_movement(y, Out, In, Out_i_k):
+    '''
+    Calcula el término de movimiento lagrangiano de todos los compartimentos
+    a la vez, sin ciclos de Python.
+
+    Parámetros
+    ---
+    `y`: Estado con forma `C x K x K`. `y[c,i,j]` son los agentes del compartimento
+    `c`, residentes en `i`, que se encuentran en `j`.
+
+    `Out`, `In`: Matrices de emigración e inmigración de dimensión `K x K`.
+
+    `Out_i_k`: Suma por filas de `Out`. Vector de tamaño `K`.
+
+    Retorno
+    ---
+    `mov`: Arreglo nuevo de forma `C x K x K` con la variación debida al movimiento.
+    '''
+    K = Out.shape[0]
+    diag = np.arange(K)
+    y_ii = y[:, diag, diag]
+    mov = Out * y_ii[:, :, None] - In * y
+    mov[:, diag, diag] = - y_ii * Out_i_k + (In * y).sum(axis=2)
+    return mov
+
+def _nodes(mobility, Beta, transitions):
+    '''
+    Cantidad de nodos `K`, a partir del movimiento o, si no hay, de las tasas.
+    '''
+    if mobility:
+        return mobility[0].shape[0]
+    rates = ([Beta] if Beta is not None else []) + [rate for _, _, rate in transitions]
+    if not rates:
+        raise ValueError('Sin movimiento ni parámetros no se puede deducir `K`.')
+    return np.shape(rates[0])[0]
+
+def _destinations(movement, K):
+    '''
+    Nodo en que se encuentra cada posición del estado (`K` posiciones sin
+    movimiento o en el euleriano, `K*K` en el lagrangiano).
+    '''
+    if movement == 'lagrange':
+        return np.tile(np.arange(K), K)
+    return np.arange(K)
+
+def _split_args(movement, args):
+    if movement not in _MOBILITY_ARGS:
+        raise ValueError("`movement` debe ser 'none', 'eulerian' o 'lagrange'.")
+    n_mob = _MOBILITY_ARGS[movement]
+    return args[:n_mob], args[n_mob:]
+
+#####################################################
+##### GENERACIÓN DEL SISTEMA DE ECUACIONES (RHS) ####
+#####################################################
+
+def generate_fun(spec, movement):
+    '''
+    Genera la fábrica del sistema de ecuaciones de un modelo compartimental con
+    un esquema de movimiento. El núcleo resultante es vectorizado: el movimiento
+    se aplica a todos los compartimentos a la vez y la infección y las
+    transiciones lineales se evalúan sobre arreglos completos.
+
+    Parámetros
+    ---
+    `spec`: Especificación del modelo (`ModelSpec`).
+
+    `movement`: `'none'` (nodos aislados), `'eulerian'` o `'lagrange'`.
+
+    Retorno
+    ---
+    `factory`: Función que recibe las matrices de movimiento (`F` en el
+    euleriano, `Out` e `In` en el lagrangiano, ninguna sin movimiento) seguidas
+    de las tasas en el orden de `spec.parameters`, y devuelve `fun(t, y)`.
+    El vector `y` tiene tamaño `C*K` (sin movimiento o euleriano) o `C*K*K`
+    (lagrangiano) y no se modifica.
+    '''
+    def factory(*args):
+        mobility, params = _split_args(movement, args)
+        C, S, T, infectious, N, Beta, transitions = resolve(spec, params)
+        K = _nodes(mobility, Beta, transitions)
+        if movement == 'lagrange':
+            Out, In = mobility
+            Out_i_k = Out.sum(axis=1)
+            shape = (C,K,K)
+            move = lambda y: _lagrange_movement(y, Out, In, Out_i_k)
+            pool = lambda x: x.sum(axis=0)
+        else:
+            shape = (C,K)
+            if movement == 'eulerian':
+                L = euler_operator(mobility[0])
+                move = lambda y: _euler_flux(L, y)
+            else:
+                move = np.zeros_like
+            pool = lambda x: x
+        n = int(np.prod(shape))
+        def fun(t,y):
+            y = y.reshape(shape)
+            new_y = move(y)
+            if S is not None:
+                N_p = y.sum(axis=0) if N is None else y[N]
+                I_p = y[infectious[0]] if len(infectious) == 1 else y[infectious].sum(axis=0)
+                infection = Beta * pool(I_p) / pool(N_p) * y[S]
+                new_y[S] -= infection
+                new_y[T] += infection
+            for src, dst, rate in transitions:
+                flow = rate * y[src]
+                new_y[src] -= flow
+                new_y[dst] += flow
+            return new_y.reshape((n,))
+        return fun
+    return factory
+
+def generate_fun_workspace(spec, movement):
+    '''
+    Igual que `generate_fun`, pero el sistema generado no reserva memoria
+    temporal: lee `y` con vistas (sin modificarlo) y hace todas las operaciones
+    sobre arreglos de trabajo preasignados, que son distintos en cada hilo.
+
+    Parámetros
+    ---
+    `spec`: Especificación del modelo (`ModelSpec`).
+
+    `movement`: `'none'` (nodos aislados), `'eulerian'` o `'lagrange'`.
+
+    Retorno
+    ---
+    `factory`: Función con los mismos argumentos que la de `generate_fun`,
+    que devuelve `fun(t, y, out=None)`. Si se pasa `out` (vector de tamaño
+    `n`), el resultado se escribe allí y la evaluación no reserva memoria;
+    `out` puede compartir memoria con `y`. Sin `out` se devuelve un vector
+    nuevo, como espera `solve_ivp`. Con movimiento euleriano y operador
+    disperso (ver `euler_operator`) el producto matricial sí reserva memoria,
+    porque `scipy.sparse` no permite escribir el resultado en un arreglo dado.
+    '''
+    def factory(*args):
+        mobility, params = _split_args(movement, args)
+        C, S, T, infectious, N, Beta, transitions = resolve(spec, params)
+        K = _nodes(mobility, Beta, transitions)
+        if movement == 'lagrange':
+            Out, In = (np.asarray(M, dtype=float) for M in mobility)
+            Out_i_k = Out.sum(axis=1)
+            shape = (C,K,K)
+        else:
+            shape = (C,K)
+            if movement == 'eulerian':
+                L = euler_operator(mobility[0])
+                L_T = L.T if sp.issparse(L) else np.ascontiguousarray(L.T)
+        n = int(np.prod(shape))
+        if Beta is not None:
+            Beta = np.asarray(Beta, dtype=float)
+        transitions = [(src, dst, np.asarray(rate, dtype=float)) for src, dst, rate in transitions]
+        local = threading.local()
+
+        def workspace():
+            ws = getattr(local, 'ws', None)
+            if ws is None:
+                ws = local.ws = {'res': np.empty(shape), 'tmp': np.empty(shape),
+                                 'diag': np.empty((C,K)), 'pos': np.empty(shape[1:]),
+                                 'pos2': np.empty(shape[1:]), 'I_n': np.empty(K),
+                                 'N_n': np.empty(K)}
+            return ws
+
+        def fun(t, y, out=None):
+            y = np.ascontiguousarray(y, dtype=float).reshape(shape)
+            ws = workspace()
+            direct = (out is not None and out.flags.c_contiguous
+                      and not np.may_share_memory(out, y))
+            res = out.reshape(shape) if direct else ws['res']
+            if movement == 'lagrange':
+                # Vistas de las diagonales `y[:, i, i]` y `res[:, i, i]`.
+                y_ii = y.reshape((C, K*K))[:, ::K+1]
+                res_ii = res.reshape((C, K*K))[:, ::K+1]
+                tmp = ws['tmp']
+                np.multiply(Out, y_ii[:, :, None], out=res)
+                np.multiply(In, y, out=tmp)
+                np.subtract(res, tmp, out=res)
+                np.sum(tmp, axis=2, out=ws['diag'])
+                np.multiply(y_ii, Out_i_k, out=res_ii)
+                np.subtract(ws['diag'], res_ii, out=res_ii)
+            elif movement == 'eulerian':
+                if sp.issparse(L_T):
+                    res[...] = y @ L_T
+                else:
+                    np.matmul(y, L_T, out=res)
+            else:
+                res.fill(0)
+            pos = ws['pos']
+            if S is not None:
+                if N is None:
+                    np.sum(y, axis=0, out=ws['pos2'])
+                    N_p = ws['pos2']
+                else:
+                    N_p = y[N]
+                I_p = y[infectious[0]]
+                if len(infectious) > 1:
+                    np.copyto(pos, I_p)
+                    for c in infectious[1:]:
+                        np.add(pos, y[c], out=pos)
+                    I_p = pos
+                if movement == 'lagrange':
+                    force = np.sum(I_p, axis=0, out=ws['I_n'])
+                    N_n = np.sum(N_p, axis=0, out=ws['N_n'])
+                else:
+                    force = ws['I_n']
+                    np.copyto(force, I_p)
+                    N_n = N_p
+                np.multiply(force, Beta, out=force)
+                np.divide(force, N_n, out=force)
+                np.multiply(y[S], force, out=pos)
+                np.subtract(res[S], pos, out=res[S])
+                np.add(res[T], pos, out=res[T])
+            for src, dst, rate in transitions:
+                np.multiply(y[src], rate, out=pos)
+                np.subtract(res[src], pos, out=res[src])
+                np.add(res[dst], pos, out=res[dst])
+            if out is None:
+                return res.reshape((n,)).copy()
+            if not direct:
+                out[...] = res.reshape(out.shape)
+            return out
+        return fun
+    return factory
+
+#####################################################
+##### GENERACIÓN DEL JACOBIANO ANALÍTICO ############
+#####################################################
+#
+# El estado tiene `C` compartimentos y `P` posiciones (`P = K` sin movimiento
+# o en el euleriano, con la posición `i` en el nodo `i`; `P = K*K` en el
+# lagrangiano, con la posición `(i,j)` en el nodo `j`). El índice de `y[c,p]`
+# en el vector aplanado es `c*P + p`. El jacobiano es la suma del movimiento
+# (lineal y constante, igual en cada compartimento), de las transiciones
+# lineales (constantes) y de las derivadas de la infección, que acoplan las
+# posiciones que están en un mismo nodo.
+
+def _jacobian(mov, dest, pairs, K, C, S, T, infectious, N, Beta, transitions):
+    '''
+    Construye el jacobiano analítico y su patrón de dispersión.
+
+    Parámetros
+    ---
+    `mov`: Matriz dispersa `P x P` del movimiento de un compartimento.
+
+    `dest`: Vector de tamaño `P` con el nodo en que se encuentra cada posición.
+
+    `pairs`: Tupla `(p, q)` con todos los pares de posiciones en un mismo nodo.
+
+    `K`: Cantidad de nodos.
+
+    `C`, `S`, `T`, `infectious`, `N`, `Beta`, `transitions`: Estructura del
+    modelo, como la devuelve `resolve`.
+
+    Retorno
+    ---
+    `jac`: Función `jac(t, y)` que devuelve una matriz CSR de tamaño `C*P x C*P`.
+
+    `jac_sparsity`: Matriz CSR con el patrón de no ceros de `jac`.
+    '''
+    P = dest.shape[0]
+    n = C * P
+    positions = np.arange(P)
+    p, q = pairs
+    N_comps = list(range(C)) if N is None else [N]
+
+    # Parte constante: movimiento en cada compartimento y transiciones lineales.
+    mov = sp.coo_matrix(mov)
+    rows = [c*P + mov.row for c in range(C)]
+    cols = [c*P + mov.col for c in range(C)]
+    const = [mov.data for _ in range(C)]
+    for src, dst, rate in transitions:
+        rate = np.asarray(rate, dtype=float)
+        rows += [src*P + positions, dst*P + positions]
+        cols += [src*P + positions, src*P + positions]
+        const += [- rate[dest], rate[dest]]
+
+    # Parte variable: derivadas de la infección.
+    var_rows, var_cols = [], []
+    if S is not None:
+        var_rows += [S*P + positions, T*P + positions]
+        var_cols += [S*P + positions, S*P + positions]
+        for c in infectious:
+            var_rows += [S*P + p, T*P + p]
+            var_cols += [c*P + q, c*P + q]
+        for c in N_comps:
+            var_rows += [S*P + p, T*P + p]
+            var_cols += [c*P + q, c*P + q]
+
+    all_rows = np.concatenate(rows + var_rows).astype(np.int64)
+    all_cols = np.concatenate(cols + var_cols).astype(np.int64)
+    const = np.concatenate(const)
+    n_const = const.shape[0]
+
+    # Se agrupan las entradas duplicadas una sola vez, de modo que cada
+    # evaluación solo acumula valores sobre una estructura CSR fija.
+    unique, inverse = np.unique(all_rows * n + all_cols, return_inverse=True)
+    indices = (unique % n).astype(np.int32)
+    indptr = np.searchsorted(unique // n, np.arange(n + 1)).astype(np.int32)
+    base = np.bincount(inverse[:n_const], weights=const, minlength=unique.shape[0])
+    var_inverse = inverse[n_const:]
+    jac_sparsity = sp.csr_matrix((np.ones(unique.shape[0]), indices, indptr), shape=(n, n))
+
+    if S is None:
+        jac_const = sp.csr_matrix((base, indices, indptr), shape=(n, n))
+        return (lambda t, y: jac_const.copy()), jac_sparsity
+
+    Beta = np.asarray(Beta, dtype=float)
+    dest_p = dest[p]
+    def jac(t, y):
+        y = y.reshape((C,P))
+        N_p = y.sum(axis=0) if N is None else y[N]
+        I_n = np.bincount(dest, weights=y[infectious].sum(axis=0), minlength=K)
+        N_n = np.bincount(dest, weights=N_p, minlength=K)
+        force = Beta * I_n / N_n
+        a = Beta[dest_p] * y[S, p] / N_n[dest_p]
+        b = a * I_n[dest_p] / N_n[dest_p]
+        values = [- force[dest], force[dest]] + [- a, a] * len(infectious) + [b, - b] * len(N_comps)
+        data = base + np.bincount(var_inverse, weights=np.concatenate(values), minlength=unique.shape[0])
+        return sp.csr_matrix((data, indices, indptr), shape=(n, n))
+    return jac, jac_sparsity
+
+def _local_structure(K):
+    '''
+    Movimiento (nulo), nodo de cada posición y pares de posiciones sin movimiento.
+    '''
+    nodes = np.arange(K)
+    return sp.csr_matrix((K, K)), nodes, (nodes, nodes)
+
+def _euler_structure(F):
+    '''
+    Movimiento, nodo de cada posición y pares de posiciones para el modelo euleriano.
+    '''
+    K = F.shape[0]
+    nodes = np.arange(K)
+    return sp.csr_matrix(euler_operator(F)), nodes, (nodes, nodes)
+
+def _lagrange_structure(Out, In):
+    '''
+    Movimiento, nodo de cada posición y pares de posiciones para el modelo lagrangiano.
+    '''
+    K = Out.shape[0]
+    i, j = np.divmod(np.arange(K*K), K)
+    off = i != j
+    ii = i * K + i
+    p = np.arange(K*K)
+    rows = np.concatenate((p[off], p[off], ii[~off], ii[off]))
+    cols = np.concatenate((ii[off], p[off], ii[~off], p[off]))
+    data = np.concatenate((Out[i, j][off], - In[i, j][off],
+                           - Out.sum(axis=1) + np.diagonal(In), In[i, j][off]))
+    nonzero = data != 0
+    mov = sp.coo_matrix((data[nonzero], (rows[nonzero], cols[nonzero])), shape=(K*K, K*K))
+    a, k, b = np.indices((K, K, K)).reshape((3, -1))
+    return mov, j, (a * K + b, k * K + b)
+
+def generate_jac(spec, movement):
+    '''
+    Genera la fábrica del jacobiano analítico de un modelo compartimental con
+    un esquema de movimiento.
+
+    Parámetros
+    ---
+    `spec`: Especificación del modelo (`ModelSpec`).
+
+    `movement`: `'none'` (nodos aislados), `'eulerian'` o `'lagrange'`.
+
+    Retorno
+    ---
+    `factory`: Función con los mismos argumentos que la fábrica de
+    `generate_fun`, que devuelve `(jac, jac_sparsity)`: `jac(t, y)` devuelve
+    una matriz CSR y `jac_sparsity` es su patrón de no ceros, para
+    `solve_ivp(..., jac=jac)` o `solve_ivp(..., jac_sparsity=jac_sparsity)`.
+    '''
+    def factory(*args):
+        mobility, params = _split_args(movement, args)
+        C, S, T, infectious, N, Beta, transitions = resolve(spec, params)
+        K = _nodes(mobility, Beta, transitions)
+        if movement == 'lagrange':
+            mov, dest, pairs = _lagrange_structure(*mobility)
+        elif movement == 'eulerian':
+            mov, dest, pairs = _euler_structure(mobility[0])
+        else:
+            mov, dest, pairs = _local_structure(K)
+        return _jacobian(mov, dest, pairs, K, C, S, T, infectious, N, Beta, transitions)
+    return factory
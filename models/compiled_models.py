@@ -0,0 +1,338 @@
+import numpy as np
+import scipy.sparse as sp
+
+from .compartments import (MOVEMENT, SEIR, SEIR_ORIGINAL_EULERIAN, SIR, SIR_LITE, SIS, SIS_LITE,
+                           _nodes, _split_args, euler_operator, resolve)
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+#############################################################
+##### NÚCLEOS COMPILADOS (UNA COMPILACIÓN POR TIPO) #########
+#############################################################
+#
+# Los núcleos son funciones de módulo compiladas con `numba` (`cache=True`),
+# que reciben todos los parámetros como arreglos. Por tanto se compilan una
+# sola vez por combinación de tipos (por ejemplo `float64`), la compilación
+# se guarda en disco (`__pycache__`, o `NUMBA_CACHE_DIR` si está definida) y
+# se reutiliza entre procesos. Las fábricas de este módulo solo enlazan los
+# parámetros; crear un modelo nuevo no provoca ninguna compilación.
+# Si `numba` no está instalado, los núcleos se ejecutan como Python puro.
+#
+# La estructura de cada modelo (ver `compartments.resolve`) se pasa con
+# enteros: `C` compartimentos, `S` y `T` origen y destino de la infección
+# (`S < 0` si no hay infección), `infectious` los compartimentos que
+# contagian, `N` el compartimento de la población total (`N < 0` si es la
+# suma de todos) y las transiciones lineales `src[r] -> dst[r]` con tasas
+# `rates[r]` por nodo.
+
+@njit(cache=True)
+def _local_kernel(y, beta, gamma, sigma, N, model):
+    # model: 0 = SIR, 1 = SIS, 2 = SEIR
+    new_y = np.zeros_like(y)
+    if model == 0:
+        infection = beta * y[0] * y[1] / N
+        new_y[0] = - infection
+        new_y[1] = infection - gamma * y[1]
+        new_y[2] = gamma * y[1]
+    elif model == 1:
+        infection = beta * y[0] * y[1] / N
+        new_y[0] = - infection + gamma * y[1]
+        new_y[1] = infection - gamma * y[1]
+    else:
+        infection = beta * y[0] * y[2] / N
+        new_y[0] = - infection
+        new_y[1] = infection - sigma * y[1]
+        new_y[2] = sigma * y[1] - gamma * y[2]
+        new_y[3] = gamma * y[2]
+    return new_y
+
+@njit(cache=True)
+def _euler_kernel(y, indptr, indices, data, Beta, rates, src, dst, C, S, T, infectious, N):
+    K = indptr.shape[0] - 1
+    y = y.reshape((C, K))
+    new_y = np.zeros_like(y)
+    for c in range(C):
+        for i in range(K):
+            acc = 0.0
+            for k in range(indptr[i], indptr[i+1]):
+                acc += data[k] * y[c, indices[k]]
+            new_y[c, i] = acc
+    for i in range(K):
+        if S >= 0:
+            if N < 0:
+                N_i = 0.0
+                for c in range(C):
+                    N_i += y[c, i]
+            else:
+                N_i = y[N, i]
+            I_i = 0.0
+            for c in infectious:
+                I_i += y[c, i]
+            infection = Beta[i] * y[S, i] * I_i / N_i
+            new_y[S, i] -= infection
+            new_y[T, i] += infection
+        for r in range(src.shape[0]):
+            flow = rates[r, i] * y[src[r], i]
+            new_y[src[r], i] -= flow
+            new_y[dst[r], i] += flow
+    return new_y.reshape(C * K)
+
+@njit(cache=True)
+def _lagrange_kernel(y, Out, In, Out_i_k, Beta, rates, src, dst, C, S, T, infectious, N):
+    K = Out.shape[0]
+    y = y.reshape((C, K, K))
+    new_y = np.zeros_like(y)
+    for c in range(C):
+        for i in range(K):
+            acc = - y[c, i, i] * Out_i_k[i]
+            for j in range(K):
+                acc += In[i, j] * y[c, i, j]
+                if i != j:
+                    new_y[c, i, j] = Out[i, j] * y[c, i, i] - In[i, j] * y[c, i, j]
+            new_y[c, i, i] = acc
+    force = np.zeros(K, dtype=y.dtype)
+    if S >= 0:
+        N_k = np.zeros(K, dtype=y.dtype)
+        for i in range(K):
+            for j in range(K):
+                for c in infectious:
+                    force[j] += y[c, i, j]
+                if N < 0:
+                    for c in range(C):
+                        N_k[j] += y[c, i, j]
+                else:
+                    N_k[j] += y[N, i, j]
+        for j in range(K):
+            force[j] = Beta[j] * force[j] / N_k[j]
+    for i in range(K):
+        for j in range(K):
+            if S >= 0:
+                infection = force[j] * y[S, i, j]
+                new_y[S, i, j] -= infection
+                new_y[T, i, j] += infection
+            for r in range(src.shape[0]):
+                flow = rates[r, j] * y[src[r], i, j]
+                new_y[src[r], i, j] -= flow
+                new_y[dst[r], i, j] += flow
+    return new_y.reshape(C * K * K)
+
+def _transitions(K, transitions):
+    '''
+    Empaqueta las transiciones lineales en los arreglos `rates`, `src` y `dst`.
+    '''
+    rates = np.zeros((len(transitions), K))
+    src = np.zeros(len(transitions), dtype=np.int64)
+    dst = np.zeros(len(transitions), dtype=np.int64)
+    for r, (s, d, rate) in enumerate(transitions):
+        rates[r] = rate
+        src[r], dst[r] = s, d
+    return rates, src, dst
+
+def _kernel_args(spec, movement, args):
+    '''
+    Enlaza los argumentos de una fábrica con los de los núcleos compilados.
+
+    Retorno
+    ---
+    Tupla `(lagrange, indptr, indices, data, Out, In, Out_i_k, Beta, rates, src,
+    dst, C, S, T, infectious, N)`. Los arreglos del esquema de movimiento que no
+    se usa tienen tamaño mínimo.
+    '''
+    mobility, params = _split_args(movement, args)
+    C, S, T, infectious, N, Beta, transitions = resolve(spec, params)
+    K = _nodes(mobility, Beta, transitions)
+    S, T = (-1, -1) if S is None else (S, T)
+    N = -1 if N is None else N
+    infectious = np.array(infectious, dtype=np.int64)
+    Beta = np.zeros(K) if Beta is None else np.ascontiguousarray(Beta, dtype=float)
+    rates, src, dst = _transitions(K, transitions)
+    empty = np.zeros(1, dtype=np.int64)
+    if movement == 'lagrange':
+        Out = np.ascontiguousarray(mobility[0], dtype=float)
+        In = np.ascontiguousarray(mobility[1], dtype=float)
+        return (True, empty, empty, np.zeros(1), Out, In, Out.sum(axis=1), Beta,
+                rates, src, dst, C, S, T, infectious, N)
+    L = sp.csr_matrix(euler_operator(mobility[0]) if mobility else (K, K))
+    none = np.zeros((1, 1))
+    return (False, L.indptr.astype(np.int64), L.indices.astype(np.int64), L.data.astype(float),
+            none, none, np.zeros(1), Beta, rates, src, dst, C, S, T, infectious, N)
+
+@njit(cache=True)
+def _rhs(y, lagrange, indptr, indices, data, Out, In, Out_i_k, Beta, rates, src, dst, C, S, T, infectious, N):
+    '''
+    Evalúa el núcleo que corresponde al esquema de movimiento (ver `_kernel_args`).
+    '''
+    if lagrange:
+        return _lagrange_kernel(y, Out, In, Out_i_k, Beta, rates, src, dst, C, S, T, infectious, N)
+    return _euler_kernel(y, indptr, indices, data, Beta, rates, src, dst, C, S, T, infectious, N)
+
+def generate_compiled_fun(spec, movement):
+    '''
+    Genera la fábrica de un modelo compartimental que evalúa el sistema con
+    los núcleos compilados.
+
+    Parámetros
+    ---
+    `spec`: Especificación del modelo (`compartments.ModelSpec`).
+
+    `movement`: `'none'`, `'eulerian'` o `'lagrange'`.
+
+    Retorno
+    ---
+    `factory`: Función con los mismos argumentos que la de
+    `compartments.generate_fun`, que devuelve `fun(t, y)`.
+    '''
+    def factory(*args):
+        (lagrange, indptr, indices, data, Out, In, Out_i_k, Beta,
+         rates, src, dst, C, S, T, infectious, N) = _kernel_args(spec, movement, args)
+        if lagrange:
+            def fun(t,y):
+                return _lagrange_kernel(np.ascontiguousarray(y), Out, In, Out_i_k, Beta,
+                                        rates, src, dst, C, S, T, infectious, N)
+            return fun
+        def fun(t,y):
+            return _euler_kernel(np.ascontiguousarray(y), indptr, indices, data, Beta,
+                                 rates, src, dst, C, S, T, infectious, N)
+        return fun
+    return factory
+
+def precompile(dtypes=(np.float64,)):
+    '''
+    Compila (o carga desde la caché en disco) todos los núcleos para los tipos
+    indicados. Conviene llamarla una vez al iniciar cada proceso trabajador,
+    para que la primera evaluación de un modelo no pague la compilación.
+
+    Parámetros
+    ---
+    `dtypes`: Tipos de punto flotante del vector `y` para los que se compila.
+    '''
+    for dtype in dtypes:
+        one = np.ones(1)
+        _local_kernel(np.ones(4, dtype=dtype), 1.0, 1.0, 1.0, 1.0, 0)
+        generate_compiled_fun(SIS_LITE, 'eulerian')(np.zeros((1,1)), one, one)(0, np.ones(2, dtype=dtype))
+        generate_compiled_fun(SIS_LITE, 'lagrange')(np.zeros((1,1)), np.zeros((1,1)), one, one)(0, np.ones(2, dtype=dtype))
+
+###############################################
+##### MODELOS DE SIR, SIS Y SEIR CLÁSICOS #####
+###############################################
+
+def fun_sir_model(beta, gamma, N):
+    '''
+    Versión compilada de `original_models.fun_sir_model`.
+    '''
+    def fun(t,y):
+        return _local_kernel(np.asarray(y, dtype=float), float(beta), float(gamma), 0.0, float(N), 0)
+    return fun
+
+def fun_sis_model(beta, gamma, N):
+    '''
+    Versión compilada de `original_models.fun_sis_model`.
+    '''
+    def fun(t,y):
+        return _local_kernel(np.asarray(y, dtype=float), float(beta), float(gamma), 0.0, float(N), 1)
+    return fun
+
+def fun_seir_model(beta, gamma, sigma, N):
+    '''
+    Versión compilada de `original_models.fun_seir_model`.
+    '''
+    def fun(t,y):
+        return _local_kernel(np.asarray(y, dtype=float), float(beta), float(gamma), float(sigma), float(N), 2)
+    return fun
+
+#######################################################
+##### MOVIMIENTO EULERIANO Y LAGRANGIANO (PUROS) ######
+#######################################################
+
+def fun_euler_mov(F):
+    '''
+    Versión compilada de `original_models.fun_euler_mov`.
+    '''
+    return generate_compiled_fun(MOVEMENT, 'eulerian')(F)
+
+def fun_lagrange_mov(O, I):
+    '''
+    Versión compilada de `original_models.fun_lagrange_mov`.
+    '''
+    return generate_compiled_fun(MOVEMENT, 'lagrange')(O, I)
+
+##########################################
+###### MODELOS CON MOVIMIENTO (SIR) ######
+##########################################
+
+def fun_sir_eulerian(F, Beta, Gamma):
+    '''
+    Versión compilada de `original_models.fun_sir_eulerian`.
+    '''
+    return generate_compiled_fun(SIR, 'eulerian')(F, Beta, Gamma)
+
+def fun_sir_eulerian_lite(F, Beta, Gamma):
+    '''
+    Versión compilada de `original_models.fun_sir_eulerian_lite`.
+    '''
+    return generate_compiled_fun(SIR_LITE, 'eulerian')(F, Beta, Gamma)
+
+def fun_sir_lagrange(Out, In, Beta, Gamma):
+    '''
+    Versión compilada de `original_models.fun_sir_lagrange`.
+    '''
+    return generate_compiled_fun(SIR, 'lagrange')(Out, In, Beta, Gamma)
+
+def fun_sir_lagrange_lite(Out, In, Beta, Gamma):
+    '''
+    Versión compilada de `original_models.fun_sir_lagrange_lite`.
+    '''
+    return generate_compiled_fun(SIR_LITE, 'lagrange')(Out, In, Beta, Gamma)
+
+##########################################
+###### MODELOS CON MOVIMIENTO (SIS) ######
+##########################################
+
+def fun_sis_eulerian(F, Beta, Gamma):
+    '''
+    Versión compilada de `original_models.fun_sis_eulerian`.
+    '''
+    return generate_compiled_fun(SIS, 'eulerian')(F, Beta, Gamma)
+
+def fun_sis_eulerian_lite(F, Beta, Gamma):
+    '''
+    Versión compilada de `original_models.fun_sis_eulerian_lite`.
+    '''
+    return generate_compiled_fun(SIS_LITE, 'eulerian')(F, Beta, Gamma)
+
+def fun_sis_lagrange(Out, In, Beta, Gamma):
+    '''
+    Versión compilada de `original_models.fun_sis_lagrange`.
+    '''
+    return generate_compiled_fun(SIS, 'lagrange')(Out, In, Beta, Gamma)
+
+def fun_sis_lagrange_lite(Out, In, Beta, Gamma):
+    '''
+    Versión compilada de `original_models.fun_sis_lagrange_lite`.
+    '''
+    return generate_compiled_fun(SIS_LITE, 'lagrange')(Out, In, Beta, Gamma)
+
+###########################################
+###### MODELOS CON MOVIMIENTO (SEIR) ######
+###########################################
+
+def fun_seir_eulerian(F, Beta, Gamma, Sigma):
+    '''
+    Versión compilada de `original_models.fun_seir_eulerian`. Igual que el
+    modelo original, la fuerza de infección usa el compartimento `1`.
+    '''
+    return generate_compiled_fun(SEIR_ORIGINAL_EULERIAN, 'eulerian')(F, Beta, Gamma, Sigma)
+
+def fun_seir_lagrange(Out, In, Beta, Gamma, Sigma):
+    '''
+    Versión compilada de `original_models.fun_seir_lagrange`.
+    '''
+    return generate_compiled_fun(SEIR, 'lagrange')(Out, In, Beta, Gamma, Sigma)
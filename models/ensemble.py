@@ -0,0 +1,392 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import OptimizeResult
+
+from .compartments import (SEIR, SEIR_ORIGINAL_EULERIAN, SIR, SIR_LITE, SIS, SIS_LITE,
+                           _nodes, _split_args, euler_operator, resolve)
+
+###################################################
+##### SISTEMAS DE ECUACIONES POR LOTES (BATCH) ####
+###################################################
+#
+# Las funciones `fun_*_batch` reciben parámetros apilados y devuelven
+# `fun(t, Y)`, donde `Y` tiene forma `B x n` (un miembro por fila, con la
+# misma estructura aplanada que los modelos de `original_models`) y `t` es un
+# escalar o un vector de tamaño `B`. Cada parámetro puede ser compartido
+# (`Beta` de tamaño `K`, `Out` de `K x K`) o propio de cada miembro
+# (`Beta` de `B x K`, `Out` de `B x K x K`). Con el argumento opcional `rows`
+# (`fun(t, Y, rows)`) las filas de `Y` son solo las de esos miembros, para
+# que `solve_ensemble` no evalúe los que ya terminaron.
+
+def _batch_rates(x, K):
+    '''
+    Lleva un vector de tasas por nodo a la forma `B x K` (o `1 x K` si es compartido).
+    '''
+    return np.asarray(x, dtype=float).reshape((-1, K))
+
+def _batch_matrices(M, K):
+    '''
+    Lleva una matriz de movimiento a la forma `B x K x K` (o `1 x K x K` si es compartida).
+    '''
+    return np.asarray(M, dtype=float).reshape((-1, K, K))
+
+def _members(x, rows):
+    '''
+    Filas `rows` de un parámetro apilado (todas si es compartido o `rows` es `None`).
+    '''
+    return x if rows is None or x is None or x.shape[0] == 1 else x[rows]
+
+def generate_batch_fun(spec, movement):
+    '''
+    Genera la fábrica del sistema por lotes de un modelo compartimental.
+
+    Parámetros
+    ---
+    `spec`: Especificación del modelo (`compartments.ModelSpec`).
+
+    `movement`: `'none'`, `'eulerian'` o `'lagrange'`.
+
+    Retorno
+    ---
+    `factory`: Función con los mismos argumentos que la de
+    `compartments.generate_fun`, pero que acepta parámetros apilados
+    y devuelve `fun(t, Y, rows=None)` con `Y` de forma `B x n` (o
+    `len(rows) x n`, con los estados de los miembros `rows`).
+    '''
+    def factory(*args):
+        mobility, params = _split_args(movement, args)
+        C, S, T, infectious, N, Beta, transitions = resolve(spec, params)
+        if movement == 'lagrange':
+            return _fun_lagrange_batch(*mobility, C, S, T, infectious, N, Beta, transitions)
+        F = mobility[0] if mobility else None
+        return _fun_euler_batch(F, C, S, T, infectious, N, Beta, transitions)
+    return factory
+
+def _fun_euler_batch(F, C, S, T, infectious, N, Beta, transitions):
+    '''
+    Construye el sistema por lotes de un modelo euleriano, o sin movimiento si `F` es `None`.
+    '''
+    K = F.shape[-1] if F is not None else _nodes((), Beta, transitions)
+    Beta = _batch_rates(Beta, K) if Beta is not None else None
+    transitions = [(src, dst, _batch_rates(rate, K)) for src, dst, rate in transitions]
+    if F is None:
+        def flux(Y, rows):
+            return np.zeros_like(Y)
+    elif np.ndim(F) == 2 or sp.issparse(F):
+        L = euler_operator(F)
+        def flux(Y, rows):
+            B = Y.shape[0]
+            return np.asarray(L @ Y.reshape((B*C, K)).T).T.reshape((B,C,K))
+    else:
+        F = _batch_matrices(F, K)
+        L_T = F - F.sum(axis=2)[:, :, None] * np.eye(K)
+        def flux(Y, rows):
+            return np.matmul(Y, _members(L_T, rows))
+    def fun(t, Y, rows=None):
+        Y = Y.reshape((-1,C,K))
+        new_Y = flux(Y, rows)
+        if S is not None:
+            N_i = Y.sum(axis=1) if N is None else Y[:, N]
+            infection = _members(Beta, rows) * Y[:, infectious].sum(axis=1) / N_i * Y[:, S]
+            new_Y[:, S] -= infection
+            new_Y[:, T] += infection
+        for src, dst, rate in transitions:
+            flow = _members(rate, rows) * Y[:, src]
+            new_Y[:, src] -= flow
+            new_Y[:, dst] += flow
+        return new_Y.reshape((Y.shape[0], C*K))
+    fun.rows = True
+    return fun
+
+def _fun_lagrange_batch(Out, In, C, S, T, infectious, N, Beta, transitions):
+    '''
+    Construye el sistema por lotes de un modelo con movimiento lagrangiano.
+    '''
+    K = Out.shape[-1]
+    Out = _batch_matrices(Out, K)[:, None]
+    In = _batch_matrices(In, K)[:, None]
+    Out_i_k = Out.sum(axis=3)
+    Beta = _batch_rates(Beta, K) if Beta is not None else None
+    transitions = [(src, dst, _batch_rates(rate, K)[:, None, :]) for src, dst, rate in transitions]
+    diag = np.arange(K)
+    def fun(t, Y, rows=None):
+        Y = Y.reshape((-1,C,K,K))
+        y_ii = Y[:, :, diag, diag]
+        back = _members(In, rows) * Y
+        new_Y = _members(Out, rows) * y_ii[..., None] - back
+        new_Y[:, :, diag, diag] = - y_ii * _members(Out_i_k, rows) + back.sum(axis=3)
+        if S is not None:
+            N_ij = Y.sum(axis=1) if N is None else Y[:, N]
+            force = _members(Beta, rows) * Y[:, infectious].sum(axis=(1,2)) / N_ij.sum(axis=1)
+            infection = force[:, None, :] * Y[:, S]
+            new_Y[:, S] -= infection
+            new_Y[:, T] += infection
+        for src, dst, rate in transitions:
+            flow = _members(rate, rows) * Y[:, src]
+            new_Y[:, src] -= flow
+            new_Y[:, dst] += flow
+        return new_Y.reshape((Y.shape[0], C*K*K))
+    fun.rows = True
+    return fun
+
+def fun_sir_eulerian_batch(F, Beta, Gamma):
+    '''
+    Versión por lotes de `fun_sir_eulerian`.
+
+    Parámetros
+    ---
+    `F`: Matriz de movimiento `K x K` compartida, o `B x K x K` por miembro.
+
+    `Beta`, `Gamma`: Vectores de tamaño `K` compartidos, o arreglos `B x K`.
+
+    Retorno
+    ---
+    `fun`: Función `fun(t, Y)` con `Y` de forma `B x 4*K`.
+    '''
+    return generate_batch_fun(SIR, 'eulerian')(F, Beta, Gamma)
+
+def fun_sir_eulerian_lite_batch(F, Beta, Gamma):
+    '''
+    Versión por lotes de `fun_sir_eulerian_lite`. `Y` tiene forma `B x 3*K`.
+    '''
+    return generate_batch_fun(SIR_LITE, 'eulerian')(F, Beta, Gamma)
+
+def fun_sis_eulerian_batch(F, Beta, Gamma):
+    '''
+    Versión por lotes de `fun_sis_eulerian`. `Y` tiene forma `B x 3*K`.
+    '''
+    return generate_batch_fun(SIS, 'eulerian')(F, Beta, Gamma)
+
+def fun_sis_eulerian_lite_batch(F, Beta, Gamma):
+    '''
+    Versión por lotes de `fun_sis_eulerian_lite`. `Y` tiene forma `B x 2*K`.
+    '''
+    return generate_batch_fun(SIS_LITE, 'eulerian')(F, Beta, Gamma)
+
+def fun_seir_eulerian_batch(F, Beta, Gamma, Sigma):
+    '''
+    Versión por lotes de `fun_seir_eulerian`. `Y` tiene forma `B x 5*K`.
+    Igual que el modelo original, la fuerza de infección usa el compartimento `1`.
+    '''
+    return generate_batch_fun(SEIR_ORIGINAL_EULERIAN, 'eulerian')(F, Beta, Gamma, Sigma)
+
+def fun_sir_lagrange_batch(Out, In, Beta, Gamma):
+    '''
+    Versión por lotes de `fun_sir_lagrange`.
+
+    Parámetros
+    ---
+    `Out`, `In`: Matrices de movimiento `K x K` compartidas, o `B x K x K` por miembro.
+
+    `Beta`, `Gamma`: Vectores de tamaño `K` compartidos, o arreglos `B x K`.
+
+    Retorno
+    ---
+    `fun`: Función `fun(t, Y)` con `Y` de forma `B x 4*K*K`.
+    '''
+    return generate_batch_fun(SIR, 'lagrange')(Out, In, Beta, Gamma)
+
+def fun_sir_lagrange_lite_batch(Out, In, Beta, Gamma):
+    '''
+    Versión por lotes de `fun_sir_lagrange_lite`. `Y` tiene forma `B x 3*K*K`.
+    '''
+    return generate_batch_fun(SIR_LITE, 'lagrange')(Out, In, Beta, Gamma)
+
+def fun_sis_lagrange_batch(Out, In, Beta, Gamma):
+    '''
+    Versión por lotes de `fun_sis_lagrange`. `Y` tiene forma `B x 3*K*K`.
+    '''
+    return generate_batch_fun(SIS, 'lagrange')(Out, In, Beta, Gamma)
+
+def fun_sis_lagrange_lite_batch(Out, In, Beta, Gamma):
+    '''
+    Versión por lotes de `fun_sis_lagrange_lite`. `Y` tiene forma `B x 2*K*K`.
+    '''
+    return generate_batch_fun(SIS_LITE, 'lagrange')(Out, In, Beta, Gamma)
+
+def fun_seir_lagrange_batch(Out, In, Beta, Gamma, Sigma):
+    '''
+    Versión por lotes de `fun_seir_lagrange`. `Y` tiene forma `B x 5*K*K`.
+    '''
+    return generate_batch_fun(SEIR, 'lagrange')(Out, In, Beta, Gamma, Sigma)
+
+#################################################
+##### INTEGRADOR DORMAND-PRINCE POR LOTES #######
+#################################################
+
+# Coeficientes de Dormand-Prince 5(4), los mismos que usa `RK45` de scipy.
+_C = np.array([0, 1/5, 3/10, 4/5, 8/9, 1])
+_A = np.array([
+    [0, 0, 0, 0, 0],
+    [1/5, 0, 0, 0, 0],
+    [3/40, 9/40, 0, 0, 0],
+    [44/45, -56/15, 32/9, 0, 0],
+    [19372/6561, -25360/2187, 64448/6561, -212/729, 0],
+    [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656]
+])
+_B = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84])
+_E = np.array([-71/57600, 0, 71/16695, -71/1920, 17253/339200, -22/525, 1/40])
+# Interpolante continuo de cuarto orden para la salida densa.
+_P = np.array([
+    [1, -8048581381/2820520608, 8663915743/2820520608, -12715105075/11282082432],
+    [0, 0, 0, 0],
+    [0, 131558114200/32700410799, -68118460800/10900136933, 87487479700/32700410799],
+    [0, -1754552775/470086768, 14199869525/1410260304, -10690763975/1880347072],
+    [0, 127303824393/49829197408, -318862633887/49829197408, 701980252875/199316789632],
+    [0, -282668133/205662961, 2019193451/616988883, -1453857185/822651844],
+    [0, 40617522/29380423, -110615467/29380423, 69997945/29380423]
+])
+_SAFETY = 0.9
+_MIN_FACTOR = 0.2
+_MAX_FACTOR = 10
+
+def _rms(x):
+    return np.sqrt((x ** 2).mean(axis=1))
+
+def _initial_step(fun, t0, Y0, F0, rtol, atol):
+    '''
+    Paso inicial por miembro, con el mismo criterio que `solve_ivp`.
+    '''
+    scale = atol + np.abs(Y0) * rtol
+    d0 = _rms(Y0 / scale)
+    d1 = _rms(F0 / scale)
+    h0 = np.where((d0 < 1e-5) | (d1 < 1e-5), 1e-6, 0.01 * d0 / np.maximum(d1, 1e-300))
+    Y1 = Y0 + h0[:, None] * F0
+    F1 = fun(t0 + h0, Y1)
+    d2 = _rms((F1 - F0) / scale) / h0
+    d = np.maximum(d1, d2)
+    h1 = np.where(d <= 1e-15, np.maximum(1e-6, h0 * 1e-3), (0.01 / np.maximum(d, 1e-300)) ** (1/5))
+    return np.minimum(100 * h0, h1)
+
+def solve_ensemble(fun, t_span, Y0, t_eval=None, error_control='member',
+                   rtol=1e-3, atol=1e-6, max_step=np.inf):
+    '''
+    Integra simultáneamente los `B` miembros de un sistema por lotes con el
+    método explícito de Dormand-Prince 5(4) y paso adaptativo.
+
+    Parámetros
+    ---
+    `fun`: Función `fun(t, Y)` por lotes (ver `fun_*_batch`), con `Y` de forma `B x n`.
+    Si tiene el atributo `rows` (como las de `generate_batch_fun`) se llama
+    `fun(t, Y, rows)` solo con los miembros que no terminaron; si no, se
+    evalúa el lote completo.
+
+    `t_span`: Tupla `(t0, tf)` con el intervalo de integración.
+
+    `Y0`: Estados iniciales apilados, de forma `B x n`.
+
+    `t_eval`: Tiempos crecientes dentro de `t_span` en los que se guarda la
+    solución. Por defecto `(t0, tf)`.
+
+    `error_control`: `'member'` para que cada miembro tenga su propio paso
+    y control del error, o `'shared'` para un único paso común, aceptado
+    solo cuando el error de todos los miembros es aceptable.
+
+    `rtol`, `atol`: Tolerancias relativa y absoluta, como en `solve_ivp`.
+
+    `max_step`: Tamaño máximo del paso.
+
+    Retorno
+    ---
+    `sol`: Objeto `OptimizeResult` con los campos `t` (los tiempos de `t_eval`),
+    `y` (arreglo `B x n x T` con las trayectorias; `nan` en los tiempos que un
+    miembro fallido no alcanzó), `success` (vector de tamaño `B`), `nfev` (cantidad de evaluaciones por lotes de `fun`) y `nstep`
+    (pasos aceptados por miembro).
+    '''
+    if error_control not in ('member', 'shared'):
+        raise ValueError("`error_control` debe ser 'member' o 'shared'.")
+    t0, tf = map(float, t_span)
+    if tf <= t0:
+        raise ValueError('`t_span` debe ser creciente: solo se integra hacia adelante.')
+    Y = np.array(Y0, dtype=float)
+    B, n = Y.shape
+    t_eval = np.array([t0, tf]) if t_eval is None else np.asarray(t_eval, dtype=float)
+    if np.any(t_eval < t0) or np.any(t_eval > tf):
+        raise ValueError('Los valores de `t_eval` no están dentro de `t_span`.')
+    if np.any(np.diff(t_eval) < 0):
+        raise ValueError('`t_eval` debe estar ordenado de forma creciente.')
+    shared = error_control == 'shared'
+
+    # Las salidas que no se alcanzan (miembros que fallan) quedan en `nan`.
+    out = np.full((B, n, t_eval.shape[0]), np.nan)
+    next_eval = np.full(B, np.searchsorted(t_eval, t0, side='right'))
+    out[:, :, t_eval == t0] = Y[:, :, None]
+
+    t = np.full(B, t0)
+    F = fun(t, Y)
+    h = np.minimum(_initial_step(fun, t, Y, F, rtol, atol), max_step)
+    nfev = 2
+    if shared:
+        h[:] = h.min()
+    done = np.zeros(B, dtype=bool)
+    success = np.ones(B, dtype=bool)
+    rejected = np.zeros(B, dtype=bool)
+    nstep = np.zeros(B, dtype=int)
+
+    rows = getattr(fun, 'rows', False)
+    def stage(a, t_a, Y_a):
+        # Sistema de los miembros activos `a`.
+        if a.shape[0] == B:
+            return fun(t_a, Y_a)
+        if rows:
+            return fun(t_a, Y_a, a)
+        t_all, Y_all = t.copy(), Y.copy()
+        t_all[a], Y_all[a] = t_a, Y_a
+        return fun(t_all, Y_all)[a]
+
+    while not done.all():
+        # Solo se avanzan los miembros activos `a`; las variables `*_a` son sus filas.
+        a = np.flatnonzero(~done)
+        t_a, Y_a = t[a], Y[a]
+        h_a = np.minimum(h[a], tf - t_a)
+        hc = h_a[:, None]
+        Ks = np.empty((7, a.shape[0], n))
+        Ks[0] = F[a]
+        for s in range(1, 6):
+            Ks[s] = stage(a, t_a + _C[s] * h_a, Y_a + hc * np.tensordot(_A[s, :s], Ks[:s], axes=1))
+        Y_new = Y_a + hc * np.tensordot(_B, Ks[:6], axes=1)
+        Ks[6] = stage(a, t_a + h_a, Y_new)
+        nfev += 6
+
+        scale = atol + np.maximum(np.abs(Y_a), np.abs(Y_new)) * rtol
+        err = _rms(hc * np.tensordot(_E, Ks, axes=1) / scale)
+        err = np.where(np.isfinite(err), err, np.inf)
+        if shared:
+            err[:] = err.max()
+        accept = err <= 1
+
+        with np.errstate(divide='ignore'):
+            factor = np.where(err == 0, _MAX_FACTOR, _SAFETY * err ** (-1/5))
+        factor = np.where(accept, np.minimum(_MAX_FACTOR, factor), np.maximum(_MIN_FACTOR, factor))
+        factor = np.where(accept & rejected[a], np.minimum(1.0, factor), factor)
+        rejected[a] = ~accept
+
+        # Salida densa en los tiempos de `t_eval` que cubre cada paso aceptado.
+        if accept.any():
+            t_new = t_a + h_a
+            Q = np.einsum('sbn,sk->bnk', Ks, _P)
+            while True:
+                idx = np.minimum(next_eval[a], t_eval.shape[0] - 1)
+                pending = accept & (next_eval[a] < t_eval.shape[0]) & (t_eval[idx] <= t_new)
+                if not pending.any():
+                    break
+                b = np.nonzero(pending)[0]
+                x = (t_eval[idx[b]] - t_a[b]) / h_a[b]
+                powers = np.cumprod(np.repeat(x[:, None], 4, axis=1), axis=1)
+                out[a[b], :, idx[b]] = Y_a[b] + h_a[b, None] * np.einsum('bnk,bk->bn', Q[b], powers)
+                next_eval[a[b]] += 1
+
+        t[a] = np.where(accept, t_a + h_a, t_a)
+        Y[a[accept]] = Y_new[accept]
+        F[a[accept]] = Ks[6][accept]
+        nstep[a] += accept
+        h[a] = np.minimum(h_a * factor, max_step)
+        if shared:
+            h[a] = h[a].min()
+
+        finished = t[a] >= tf
+        too_small = ~finished & (h[a] < 10 * np.abs(np.nextafter(t[a], np.inf) - t[a]))
+        success[a[too_small]] = False
+        done[a[finished | too_small]] = True
+
+    return OptimizeResult(t=t_eval, y=out, success=success, nfev=nfev, nstep=nstep)
@@ -0,0 +1,313 @@
+import json
+import time
+import tracemalloc
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.integrate import OdeSolution
+from scipy.optimize import OptimizeResult
+
+from .streaming import METHODS, SUCCESS
+
+#####################################################
+##### INSTRUMENTACIÓN DE MODELOS E INTEGRADORES #####
+#####################################################
+#
+# Medición opcional de dónde se va el tiempo de una corrida:
+#   - `instrument` envuelve la función `fun(t, y)` que devuelve una fábrica
+#     (por ejemplo las de `original_models`) y su jacobiano, y cuenta las
+#     evaluaciones, su tiempo (`time.perf_counter`) y los bytes de los
+#     arreglos que devuelven. `instrumented` hace lo mismo con la fábrica.
+#   - `solve_instrumented` avanza el integrador paso a paso (como
+#     `solve_ivp`) y registra los pasos aceptados y rechazados, el tiempo de
+#     los pasos y el de la interpolación de la salida. En los métodos
+#     implícitos (Radau, BDF) las evaluaciones de `fun` con que el integrador
+#     aproxima el jacobiano por diferencias finitas se cuentan como tiempo del
+#     jacobiano y no del sistema.
+# Todo se acumula en un `RunStats`, que se exporta como JSON. Sin un
+# `RunStats` (`stats=None`) `instrument` e `instrumented` devuelven la misma
+# función o fábrica que reciben, así que la instrumentación desactivada no
+# agrega ningún costo.
+
+# Evaluaciones de `fun` por intento de paso de los métodos de Runge-Kutta
+# explícitos (`n_stages`), con las que se cuentan los pasos rechazados.
+_EXPLICIT = ('RK23', 'RK45', 'DOP853')
+
+def _nbytes(a):
+    if sp.issparse(a):
+        a = a.tocsr() if a.format not in ('csr', 'csc') else a
+        return a.data.nbytes + a.indices.nbytes + a.indptr.nbytes
+    return np.asarray(a).nbytes
+
+class RunStats:
+    '''
+    Estadísticas de una corrida.
+
+    Parámetros
+    ---
+    `metadata`: Datos que identifican la corrida (por ejemplo `model='fun_sir_lagrange'`,
+    `K=10`), que se exportan junto con las estadísticas.
+
+    Atributos
+    ---
+    - `nfev`, `rhs_time`, `rhs_bytes`: evaluaciones del sistema, su tiempo total
+      (segundos) y los bytes de los arreglos devueltos.
+    - `njev`, `jac_time`, `jac_bytes`: lo mismo para el jacobiano (analítico o por
+      diferencias finitas).
+    - `nlu`: factorizaciones LU del integrador.
+    - `naccepted`, `nrejected`: pasos aceptados y rechazados. Los rechazados solo
+      se cuentan en los métodos explícitos (`None` en los demás).
+    - `step_time`: tiempo dentro de los pasos del integrador (incluye el del sistema y
+      el del jacobiano).
+    - `post_time`: tiempo de la salida densa y la interpolación en `t_eval`.
+    - `output_bytes`: bytes de la trayectoria devuelta.
+    - `peak_bytes`: pico de memoria reservada durante la corrida (`tracemalloc`), o
+      `None` si no se midió.
+    - `wall_time`: tiempo total de la corrida.
+    '''
+    COUNTERS = ('nfev', 'rhs_time', 'rhs_bytes', 'njev', 'jac_time', 'jac_bytes', 'nlu', 'naccepted',
+                'nrejected', 'step_time', 'post_time', 'output_bytes', 'peak_bytes', 'wall_time')
+
+    def __init__(self, **metadata):
+        self.metadata = metadata
+        self.nfev = self.njev = self.nlu = self.naccepted = 0
+        self.rhs_bytes = self.jac_bytes = self.output_bytes = 0
+        self.rhs_time = self.jac_time = self.step_time = self.post_time = self.wall_time = 0.0
+        self.nrejected = None
+        self.peak_bytes = None
+
+    @property
+    def overhead_time(self):
+        '''
+        Tiempo de los pasos que no se usó en el sistema ni en el jacobiano
+        (álgebra lineal y control del paso del integrador).
+        '''
+        return max(0.0, self.step_time - self.rhs_time - self.jac_time)
+
+    def merge(self, other):
+        '''
+        Suma a esta corrida los contadores de `other` (por ejemplo para
+        acumular todas las soluciones de una calibración). El pico de memoria
+        es el máximo de ambos.
+        '''
+        for name in self.COUNTERS:
+            a, b = getattr(self, name), getattr(other, name)
+            if name == 'peak_bytes':
+                value = None if a is None and b is None else max(a or 0, b or 0)
+            else:
+                value = None if a is None and b is None else (a or 0) + (b or 0)
+            setattr(self, name, value)
+        return self
+
+    def as_dict(self):
+        result = {'metadata': dict(self.metadata)}
+        result.update({name: getattr(self, name) for name in self.COUNTERS})
+        result['overhead_time'] = self.overhead_time
+        return result
+
+    def to_json(self, path=None, **kwargs):
+        '''
+        Exporta las estadísticas como JSON. Si se da `path` se escriben en ese
+        archivo; si no, se devuelve el texto. `kwargs` se pasan a `json.dumps`.
+        '''
+        kwargs.setdefault('indent', 2)
+        text = json.dumps(self.as_dict(), default=lambda o: o.item() if hasattr(o, 'item') else str(o),
+                          **kwargs)
+        if path is None:
+            return text
+        with open(path, 'w') as file:
+            file.write(text)
+        return path
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in ('nfev', 'njev', 'naccepted',
+                                                                           'nrejected', 'wall_time'))
+        return f'RunStats({fields})'
+
+def instrument(fun, stats=None, jac=False):
+    '''
+    Envuelve una función `fun(t, y)` para que registre sus evaluaciones en `stats`.
+
+    Parámetros
+    ---
+    `fun`: Sistema de ecuaciones (o jacobiano) de un modelo.
+
+    `stats`: `RunStats` donde se acumulan las evaluaciones. Si es `None`, o si
+    `fun` ya registra sus evaluaciones en `stats`, se devuelve `fun` sin cambios.
+
+    `jac`: Si es `True` las evaluaciones se cuentan como del jacobiano.
+    '''
+    if stats is None or getattr(fun, 'stats', None) is stats:
+        return fun
+    count, seconds, size = ('njev', 'jac_time', 'jac_bytes') if jac else ('nfev', 'rhs_time', 'rhs_bytes')
+    clock = time.perf_counter
+    def wrapper(t, y):
+        start = clock()
+        result = fun(t, y)
+        elapsed = clock() - start
+        setattr(stats, count, getattr(stats, count) + 1)
+        setattr(stats, seconds, getattr(stats, seconds) + elapsed)
+        setattr(stats, size, getattr(stats, size) + _nbytes(result))
+        return result
+    wrapper.__wrapped__ = fun
+    wrapper.stats = stats
+    return wrapper
+
+def instrumented(factory, stats=None):
+    '''
+    Envuelve una fábrica de modelos (por ejemplo `original_models.fun_sir_lagrange`)
+    para que las funciones que devuelve registren sus evaluaciones en `stats`.
+    Si `stats` es `None` se devuelve `factory` sin cambios.
+    '''
+    if stats is None:
+        return factory
+    def wrapper(*args, **kwargs):
+        return instrument(factory(*args, **kwargs), stats)
+    wrapper.__wrapped__ = factory
+    return wrapper
+
+def _as_jacobian(jac, stats):
+    '''
+    Envuelve una evaluación del jacobiano del integrador para que se registre
+    en `stats` como del jacobiano, incluidas las evaluaciones de `fun` que
+    haga (las diferencias finitas), que se descuentan de las del sistema.
+    '''
+    clock = time.perf_counter
+    def wrapper(*args):
+        nfev, rhs_time, rhs_bytes = stats.nfev, stats.rhs_time, stats.rhs_bytes
+        start = clock()
+        result = jac(*args)
+        stats.jac_time += clock() - start
+        stats.nfev, stats.rhs_time, stats.rhs_bytes = nfev, rhs_time, rhs_bytes
+        stats.njev += 1
+        stats.jac_bytes += _nbytes(result[1] if isinstance(result, tuple) else result)
+        return result
+    wrapper.__wrapped__ = jac
+    return wrapper
+
+def _split_jacobian(method, stats):
+    '''
+    Subclase de un método implícito de `scipy` (Radau, BDF) que registra en
+    `stats` cada evaluación del jacobiano, también la inicial que se hace al
+    construir el integrador.
+    '''
+    class Solver(method):
+        def _validate_jac(self, jac, sparsity):
+            if jac is not None and not callable(jac):
+                return super()._validate_jac(jac, sparsity)
+            jac_wrapped, J = _as_jacobian(super()._validate_jac, stats)(jac, sparsity)
+            return _as_jacobian(jac_wrapped, stats), J
+    Solver.__name__ = Solver.__qualname__ = method.__name__
+    return Solver
+
+def solve_instrumented(fun, t_span, y0, t_eval=None, method='RK45', dense_output=False, stats=None,
+                       memory=False, **options):
+    '''
+    Resuelve un modelo como `solve_ivp` y registra las estadísticas de la corrida.
+
+    Parámetros
+    ---
+    `fun`, `t_span`, `y0`, `t_eval`, `dense_output`, `options`: Como en
+    `solve_ivp` (sin eventos). Si `options` tiene un `jac` invocable también se
+    instrumenta. En Radau y BDF sin `jac` el tiempo de las diferencias finitas
+    se registra como del jacobiano; en LSODA, que las calcula internamente,
+    se cuentan como evaluaciones del sistema y `njev` es el del integrador.
+
+    `method`: Nombre de un método de `solve_ivp` o subclase de `OdeSolver`.
+
+    `stats`: `RunStats` donde se acumulan las estadísticas; por defecto uno nuevo.
+
+    `memory`: Si es `True` se mide el pico de memoria con `tracemalloc`, que
+    hace la corrida bastante más lenta.
+
+    Retorno
+    ---
+    `OptimizeResult` con los campos de `solve_ivp` (`t`, `y`, `sol`, `nfev`,
+    `njev`, `nlu`, `status`, `message`, `success`) y `stats`.
+    '''
+    stats = RunStats() if stats is None else stats
+    clock = time.perf_counter
+    wall = clock()
+    tracing = memory and not tracemalloc.is_tracing()
+    if memory:
+        if tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+
+    name = method if isinstance(method, str) else getattr(method, '__name__', None)
+    if method in METHODS:
+        method = METHODS[method]
+    njev = stats.njev
+    if hasattr(method, '_validate_jac'):
+        method = _split_jacobian(method, stats)
+    elif callable(options.get('jac')):
+        options['jac'] = instrument(options['jac'], stats, jac=True)
+    t0, t_bound = map(float, t_span)
+    y0 = np.asarray(y0, dtype=float)
+    solver = method(instrument(fun, stats), t0, y0, t_bound, **options)
+    stages = getattr(solver, 'n_stages', None) if name in _EXPLICIT else None
+    if stages is not None:
+        stats.nrejected = stats.nrejected or 0
+    if t_eval is not None:
+        t_eval = np.asarray(t_eval, dtype=float)
+        ts, ys, k = [], [], 0
+        if len(t_eval) and t_eval[0] == t0:
+            ts.append(t_eval[:1])
+            ys.append(y0[:, None])
+            k = 1
+    else:
+        ts, ys = [np.array([t0])], [y0[:, None]]
+    sol_ts, interpolants = [t0], []
+
+    status = None
+    while status is None:
+        nfev = solver.nfev
+        start = clock()
+        message = solver.step()
+        stats.step_time += clock() - start
+        if solver.status == 'failed':
+            status = -1
+            break
+        if solver.status == 'finished':
+            status = 0
+            message = SUCCESS
+        stats.naccepted += 1
+        if stages is not None:
+            stats.nrejected += (solver.nfev - nfev) // stages - 1
+
+        start = clock()
+        if t_eval is None:
+            ts.append(np.array([solver.t]))
+            ys.append(solver.y[:, None])
+        else:
+            j = np.searchsorted(t_eval, solver.t, side='right')
+            if j > k or dense_output:
+                sol = solver.dense_output()
+            if j > k:
+                ts.append(t_eval[k:j])
+                ys.append(sol(t_eval[k:j]))
+                k = j
+        if dense_output:
+            sol = sol if t_eval is not None else solver.dense_output()
+            sol_ts.append(solver.t)
+            interpolants.append(sol)
+        stats.post_time += clock() - start
+
+    start = clock()
+    t = np.concatenate(ts) if ts else np.empty(0)
+    y = np.concatenate(ys, axis=1) if ys else np.empty((y0.shape[0], 0))
+    dense = OdeSolution(np.array(sol_ts), interpolants) if dense_output and interpolants else None
+    stats.post_time += clock() - start
+    stats.output_bytes += t.nbytes + y.nbytes
+    # Jacobianos que el integrador evaluó sin pasar por `fun` ni `jac` (LSODA).
+    stats.njev += max(0, solver.njev - (stats.njev - njev))
+    stats.nlu += solver.nlu
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1] - base
+        stats.peak_bytes = max(stats.peak_bytes or 0, peak)
+        if tracing:
+            tracemalloc.stop()
+    stats.wall_time += clock() - wall
+    return OptimizeResult(t=t, y=y, sol=dense, nfev=solver.nfev, njev=solver.njev, nlu=solver.nlu,
+                          status=status, message=message, success=status >= 0, stats=stats)
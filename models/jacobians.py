@@ -0,0 +1,233 @@
+from .compartments import (SEIR, SEIR_ORIGINAL_EULERIAN, SIR, SIR_LITE, SIS, SIS_LITE,
+                           generate_jac)
+
+# Las fábricas de este módulo son envolturas sobre `compartments.generate_jac`,
+# que construye el jacobiano analítico a partir de la especificación de cada modelo.
+
+###################################################
+###### JACOBIANOS DEL MODELO SIR CON MOVIMIENTO ###
+###################################################
+
+def jac_sir_eulerian(F, Beta, Gamma):
+    '''
+    Genera el jacobiano analítico de `fun_sir_eulerian`.
+
+    Parámetros
+    ---
+    `F`: Matriz de movimiento de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `jac`: Función `jac(t, y)` que devuelve una matriz CSR de tamaño `4*K x 4*K`.
+    Se le puede pasar a `solve_ivp` como `jac=jac` con los métodos `BDF`, `Radau` o `LSODA`.
+
+    `jac_sparsity`: Patrón de no ceros del jacobiano, para `solve_ivp(..., jac_sparsity=...)`.
+    '''
+    return generate_jac(SIR, 'eulerian')(F, Beta, Gamma)
+
+def jac_sir_eulerian_lite(F, Beta, Gamma):
+    '''
+    Genera el jacobiano analítico de `fun_sir_eulerian_lite`.
+
+    Parámetros
+    ---
+    `F`: Matriz de movimiento de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `jac`: Función `jac(t, y)` que devuelve una matriz CSR de tamaño `3*K x 3*K`.
+
+    `jac_sparsity`: Patrón de no ceros del jacobiano.
+    '''
+    return generate_jac(SIR_LITE, 'eulerian')(F, Beta, Gamma)
+
+def jac_sir_lagrange(Out, In, Beta, Gamma):
+    '''
+    Genera el jacobiano analítico de `fun_sir_lagrange`.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `jac`: Función `jac(t, y)` que devuelve una matriz CSR de tamaño `4*K*K x 4*K*K`.
+
+    `jac_sparsity`: Patrón de no ceros del jacobiano.
+    '''
+    return generate_jac(SIR, 'lagrange')(Out, In, Beta, Gamma)
+
+def jac_sir_lagrange_lite(Out, In, Beta, Gamma):
+    '''
+    Genera el jacobiano analítico de `fun_sir_lagrange_lite`.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `jac`: Función `jac(t, y)` que devuelve una matriz CSR de tamaño `3*K*K x 3*K*K`.
+
+    `jac_sparsity`: Patrón de no ceros del jacobiano.
+    '''
+    return generate_jac(SIR_LITE, 'lagrange')(Out, In, Beta, Gamma)
+
+###################################################
+###### JACOBIANOS DEL MODELO SIS CON MOVIMIENTO ###
+###################################################
+
+def jac_sis_eulerian(F, Beta, Gamma):
+    '''
+    Genera el jacobiano analítico de `fun_sis_eulerian`.
+
+    Parámetros
+    ---
+    `F`: Matriz de movimiento de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `jac`: Función `jac(t, y)` que devuelve una matriz CSR de tamaño `3*K x 3*K`.
+
+    `jac_sparsity`: Patrón de no ceros del jacobiano.
+    '''
+    return generate_jac(SIS, 'eulerian')(F, Beta, Gamma)
+
+def jac_sis_eulerian_lite(F, Beta, Gamma):
+    '''
+    Genera el jacobiano analítico de `fun_sis_eulerian_lite`.
+
+    Parámetros
+    ---
+    `F`: Matriz de movimiento de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `jac`: Función `jac(t, y)` que devuelve una matriz CSR de tamaño `2*K x 2*K`.
+
+    `jac_sparsity`: Patrón de no ceros del jacobiano.
+    '''
+    return generate_jac(SIS_LITE, 'eulerian')(F, Beta, Gamma)
+
+def jac_sis_lagrange(Out, In, Beta, Gamma):
+    '''
+    Genera el jacobiano analítico de `fun_sis_lagrange`.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `jac`: Función `jac(t, y)` que devuelve una matriz CSR de tamaño `3*K*K x 3*K*K`.
+
+    `jac_sparsity`: Patrón de no ceros del jacobiano.
+    '''
+    return generate_jac(SIS, 'lagrange')(Out, In, Beta, Gamma)
+
+def jac_sis_lagrange_lite(Out, In, Beta, Gamma):
+    '''
+    Genera el jacobiano analítico de `fun_sis_lagrange_lite`.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `jac`: Función `jac(t, y)` que devuelve una matriz CSR de tamaño `2*K*K x 2*K*K`.
+
+    `jac_sparsity`: Patrón de no ceros del jacobiano.
+    '''
+    return generate_jac(SIS_LITE, 'lagrange')(Out, In, Beta, Gamma)
+
+####################################################
+###### JACOBIANOS DEL MODELO SEIR CON MOVIMIENTO ###
+####################################################
+
+def jac_seir_eulerian(F, Beta, Gamma, Sigma):
+    '''
+    Genera el jacobiano analítico de `fun_seir_eulerian`. Igual que el modelo,
+    la fuerza de infección usa el compartimento `y[1]`.
+
+    Parámetros
+    ---
+    `F`: Matriz de movimiento de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Sigma`: Tasa de Incubación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `jac`: Función `jac(t, y)` que devuelve una matriz CSR de tamaño `5*K x 5*K`.
+
+    `jac_sparsity`: Patrón de no ceros del jacobiano.
+    '''
+    return generate_jac(SEIR_ORIGINAL_EULERIAN, 'eulerian')(F, Beta, Gamma, Sigma)
+
+def jac_seir_lagrange(Out, In, Beta, Gamma, Sigma):
+    '''
+    Genera el jacobiano analítico de `fun_seir_lagrange`.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Sigma`: Tasa de Incubación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `jac`: Función `jac(t, y)` que devuelve una matriz CSR de tamaño `5*K*K x 5*K*K`.
+
+    `jac_sparsity`: Patrón de no ceros del jacobiano.
+    '''
+    return generate_jac(SEIR, 'lagrange')(Out, In, Beta, Gamma, Sigma)
@@ -0,0 +1,219 @@
+import numpy as np
+
+from .compartments import SEIR, SEIR_ORIGINAL_EULERIAN, SIR, SIR_LITE, SIS, SIS_LITE
+from .compiled_models import NUMBA_AVAILABLE, _kernel_args, njit
+
+if NUMBA_AVAILABLE:
+    from numba import config, get_num_threads, prange, set_num_threads
+    MAX_THREADS = config.NUMBA_NUM_THREADS
+else:
+    prange = range
+    MAX_THREADS = 1
+    def get_num_threads():
+        return 1
+    def set_num_threads(n):
+        pass
+
+#############################################################
+##### NÚCLEOS PARALELOS (VARIOS HILOS) ######################
+#############################################################
+#
+# Versiones de los núcleos de `compiled_models` que reparten el trabajo entre
+# hilos (`numba`, `parallel=True`). El estado se divide por nodo de residencia
+# `i`: cada hilo calcula el movimiento, la infección y las transiciones de sus
+# filas. Las sumas por nodo de destino (`I_k_i`, `N_k_i`) del lagrangiano se
+# calculan antes, en dos pasadas: sumas parciales por bloques fijos de
+# `REDUCTION_BLOCK` filas, en paralelo, y luego la suma de los bloques en un
+# orden fijo. Como los bloques no dependen de la cantidad de hilos, el
+# resultado es idéntico (bit a bit) con cualquier cantidad de hilos.
+#
+# La cantidad de hilos de cada modelo se elige al crearlo (`threads`) y no
+# puede superar `MAX_THREADS` (la variable de entorno `NUMBA_NUM_THREADS`).
+
+REDUCTION_BLOCK = 64
+
+@njit(parallel=True, cache=True)
+def _euler_kernel_parallel(y, indptr, indices, data, Beta, rates, src, dst, C, S, T, infectious, N):
+    K = indptr.shape[0] - 1
+    y = y.reshape((C, K))
+    new_y = np.empty_like(y)
+    for i in prange(K):
+        for c in range(C):
+            acc = 0.0
+            for k in range(indptr[i], indptr[i+1]):
+                acc += data[k] * y[c, indices[k]]
+            new_y[c, i] = acc
+        if S >= 0:
+            if N < 0:
+                N_i = 0.0
+                for c in range(C):
+                    N_i += y[c, i]
+            else:
+                N_i = y[N, i]
+            I_i = 0.0
+            for c in infectious:
+                I_i += y[c, i]
+            infection = Beta[i] * y[S, i] * I_i / N_i
+            new_y[S, i] -= infection
+            new_y[T, i] += infection
+        for r in range(src.shape[0]):
+            flow = rates[r, i] * y[src[r], i]
+            new_y[src[r], i] -= flow
+            new_y[dst[r], i] += flow
+    return new_y.reshape(C * K)
+
+@njit(parallel=True, cache=True)
+def _lagrange_kernel_parallel(y, Out, In, Out_i_k, Beta, rates, src, dst, C, S, T, infectious, N):
+    K = Out.shape[0]
+    y = y.reshape((C, K, K))
+    new_y = np.empty_like(y)
+    force = np.zeros(K, dtype=y.dtype)
+    if S >= 0:
+        blocks = (K + REDUCTION_BLOCK - 1) // REDUCTION_BLOCK
+        partial = np.zeros((blocks, 2, K), dtype=y.dtype)
+        for b in prange(blocks):
+            for i in range(b * REDUCTION_BLOCK, min(K, (b + 1) * REDUCTION_BLOCK)):
+                for j in range(K):
+                    for c in infectious:
+                        partial[b, 0, j] += y[c, i, j]
+                    if N < 0:
+                        for c in range(C):
+                            partial[b, 1, j] += y[c, i, j]
+                    else:
+                        partial[b, 1, j] += y[N, i, j]
+        for j in prange(K):
+            I_j = 0.0
+            N_j = 0.0
+            for b in range(blocks):
+                I_j += partial[b, 0, j]
+                N_j += partial[b, 1, j]
+            force[j] = Beta[j] * I_j / N_j
+    for i in prange(K):
+        for c in range(C):
+            acc = - y[c, i, i] * Out_i_k[i]
+            for j in range(K):
+                acc += In[i, j] * y[c, i, j]
+                if i != j:
+                    new_y[c, i, j] = Out[i, j] * y[c, i, i] - In[i, j] * y[c, i, j]
+            new_y[c, i, i] = acc
+        for j in range(K):
+            if S >= 0:
+                infection = force[j] * y[S, i, j]
+                new_y[S, i, j] -= infection
+                new_y[T, i, j] += infection
+            for r in range(src.shape[0]):
+                flow = rates[r, j] * y[src[r], i, j]
+                new_y[src[r], i, j] -= flow
+                new_y[dst[r], i, j] += flow
+    return new_y.reshape(C * K * K)
+
+def generate_parallel_fun(spec, movement):
+    '''
+    Genera la fábrica de un modelo compartimental que evalúa el sistema con
+    varios hilos.
+
+    Parámetros
+    ---
+    `spec`: Especificación del modelo (`compartments.ModelSpec`).
+
+    `movement`: `'none'`, `'eulerian'` o `'lagrange'`.
+
+    Retorno
+    ---
+    `factory`: Función con los mismos argumentos que la de
+    `compartments.generate_fun` y el argumento por nombre `threads` (por
+    defecto, la cantidad de hilos actual de `numba`), que devuelve `fun(t, y)`.
+    '''
+    def factory(*args, threads=None):
+        threads = get_num_threads() if threads is None else int(threads)
+        if not 1 <= threads <= MAX_THREADS:
+            raise ValueError(f'`threads` debe estar entre 1 y {MAX_THREADS} (NUMBA_NUM_THREADS).')
+        (lagrange, indptr, indices, data, Out, In, Out_i_k, Beta,
+         rates, src, dst, C, S, T, infectious, N) = _kernel_args(spec, movement, args)
+        def fun(t,y):
+            # La cantidad de hilos de `numba` es propia de cada hilo de Python.
+            previous = get_num_threads()
+            set_num_threads(threads)
+            try:
+                if lagrange:
+                    return _lagrange_kernel_parallel(np.ascontiguousarray(y), Out, In, Out_i_k, Beta,
+                                                     rates, src, dst, C, S, T, infectious, N)
+                return _euler_kernel_parallel(np.ascontiguousarray(y), indptr, indices, data, Beta,
+                                              rates, src, dst, C, S, T, infectious, N)
+            finally:
+                set_num_threads(previous)
+        return fun
+    return factory
+
+##########################################
+###### MODELOS CON MOVIMIENTO (SIR) ######
+##########################################
+
+def fun_sir_eulerian(F, Beta, Gamma, threads=None):
+    '''
+    Versión paralela de `original_models.fun_sir_eulerian`, con `threads` hilos.
+    '''
+    return generate_parallel_fun(SIR, 'eulerian')(F, Beta, Gamma, threads=threads)
+
+def fun_sir_eulerian_lite(F, Beta, Gamma, threads=None):
+    '''
+    Versión paralela de `original_models.fun_sir_eulerian_lite`, con `threads` hilos.
+    '''
+    return generate_parallel_fun(SIR_LITE, 'eulerian')(F, Beta, Gamma, threads=threads)
+
+def fun_sir_lagrange(Out, In, Beta, Gamma, threads=None):
+    '''
+    Versión paralela de `original_models.fun_sir_lagrange`, con `threads` hilos.
+    '''
+    return generate_parallel_fun(SIR, 'lagrange')(Out, In, Beta, Gamma, threads=threads)
+
+def fun_sir_lagrange_lite(Out, In, Beta, Gamma, threads=None):
+    '''
+    Versión paralela de `original_models.fun_sir_lagrange_lite`, con `threads` hilos.
+    '''
+    return generate_parallel_fun(SIR_LITE, 'lagrange')(Out, In, Beta, Gamma, threads=threads)
+
+##########################################
+###### MODELOS CON MOVIMIENTO (SIS) ######
+##########################################
+
+def fun_sis_eulerian(F, Beta, Gamma, threads=None):
+    '''
+    Versión paralela de `original_models.fun_sis_eulerian`, con `threads` hilos.
+    '''
+    return generate_parallel_fun(SIS, 'eulerian')(F, Beta, Gamma, threads=threads)
+
+def fun_sis_eulerian_lite(F, Beta, Gamma, threads=None):
+    '''
+    Versión paralela de `original_models.fun_sis_eulerian_lite`, con `threads` hilos.
+    '''
+    return generate_parallel_fun(SIS_LITE, 'eulerian')(F, Beta, Gamma, threads=threads)
+
+def fun_sis_lagrange(Out, In, Beta, Gamma, threads=None):
+    '''
+    Versión paralela de `original_models.fun_sis_lagrange`, con `threads` hilos.
+    '''
+    return generate_parallel_fun(SIS, 'lagrange')(Out, In, Beta, Gamma, threads=threads)
+
+def fun_sis_lagrange_lite(Out, In, Beta, Gamma, threads=None):
+    '''
+    Versión paralela de `original_models.fun_sis_lagrange_lite`, con `threads` hilos.
+    '''
+    return generate_parallel_fun(SIS_LITE, 'lagrange')(Out, In, Beta, Gamma, threads=threads)
+
+###########################################
+###### MODELOS CON MOVIMIENTO (SEIR) ######
+###########################################
+
+def fun_seir_eulerian(F, Beta, Gamma, Sigma, threads=None):
+    '''
+    Versión paralela de `original_models.fun_seir_eulerian`, con `threads` hilos.
+    Igual que el modelo original, la fuerza de infección usa el compartimento `1`.
+    '''
+    return generate_parallel_fun(SEIR_ORIGINAL_EULERIAN, 'eulerian')(F, Beta, Gamma, Sigma, threads=threads)
+
+def fun_seir_lagrange(Out, In, Beta, Gamma, Sigma, threads=None):
+    '''
+    Versión paralela de `original_models.fun_seir_lagrange`, con `threads` hilos.
+    '''
+    return generate_parallel_fun(SEIR, 'lagrange')(Out, In, Beta, Gamma, Sigma, threads=threads)
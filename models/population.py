@@ -0,0 +1,297 @@
+from collections import namedtuple
+
+import numpy as np
+import scipy.sparse as sp
+
+from .compartments import SEIR, SIR, SIS, _lagrange_movement, resolve
+
+#####################################################
+##### POBLACIÓN EXACTA EN EL MOVIMIENTO LAGRANGIANO #
+#####################################################
+#
+# En los modelos lagrangianos la población `N[i,j]` (residentes de `i` que se
+# encuentran en `j`) no depende de la epidemia: para cada nodo de residencia
+# `i` es un sistema lineal con forma de estrella,
+#
+#   N[i,j]' = Out[i,j] * N[i,i] - In[i,j] * N[i,j]          (j != i)
+#   N[i,i]' = - sum_j Out[i,j] * N[i,i] + sum_j In[i,j] * N[i,j]
+#
+# cuya solución es una suma de exponenciales. Al construir el modelo se
+# diagonaliza la matriz de cada estrella y se guardan los coeficientes de
+# cada modo, de modo que `N(t)` se evalúa de forma exacta en cualquier tiempo
+# sin integrarla. El costo de cada evaluación exacta es proporcional a la suma
+# de los cuadrados de los tamaños de las estrellas (`K**3` con movimiento
+# denso), mayor que el de integrar `N`. Por eso el modelo sin `N` usa una
+# tabla de la población presente en cada nodo: interpolación cúbica de
+# Hermite con los valores y las derivadas exactas, en nodos elegidos con un
+# control del error y agregados a medida que el integrador avanza. Cuando
+# todos los modos que decaen son menores que la tolerancia la población ya
+# es la estacionaria. Cada evaluación de la tabla cuesta `O(K)`.
+
+PopulationSolution = namedtuple('PopulationSolution', ['positions', 'present'])
+
+# Número de condición máximo aceptado para los vectores propios de una estrella.
+MAX_CONDITION = 1e10
+
+# Tolerancia relativa de la tabla de la población presente.
+TABLE_RTOL = 1e-8
+
+def lagrange_population(Out, In, N0, t0=0.0):
+    '''
+    Solución exacta de la población en el movimiento lagrangiano.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `N0`: Población inicial. Matriz `K x K` (o vector de tamaño `K`, con toda la
+    población en su nodo de residencia).
+
+    `t0`: Tiempo inicial.
+
+    Retorno
+    ---
+    `PopulationSolution` con dos funciones: `positions(t)` devuelve `N[i,j]`
+    aplanada (vector de tamaño `K*K`, o arreglo `K*K x len(t)` si `t` es un
+    vector) y `present(t)` devuelve la población que se encuentra en cada nodo,
+    `sum_i N[i,j]` (tamaño `K`, o `K x len(t)`).
+    '''
+    return _solution(*_population_modes(Out, In, N0), t0)
+
+def _solution(W_pos, W_dest, rates, t0):
+    def evaluate(W, t):
+        t = np.asarray(t, dtype=float)
+        E = np.exp(np.multiply.outer(rates, t - t0))
+        return np.real(W @ E)
+
+    return PopulationSolution(lambda t: evaluate(W_pos, t), lambda t: evaluate(W_dest, t))
+
+def _population_modes(Out, In, N0):
+    '''
+    Coeficientes de los modos de la población: `N(t) = W_pos @ exp(rates * t)`
+    y población presente `W_dest @ exp(rates * t)`, con `t` medido desde el
+    tiempo inicial.
+    '''
+    Out = np.asarray(Out, dtype=float)
+    In = np.asarray(In, dtype=float)
+    K = Out.shape[0]
+    N0 = np.asarray(N0, dtype=float)
+    if N0.ndim == 1:
+        N0 = np.diag(N0)
+    rows, dest, cols, coef, rates = [], [], [], [], []
+    modes = 0
+    for i in range(K):
+        leaves = np.flatnonzero(((Out[i] != 0) | (In[i] != 0) | (N0[i] != 0)) & (np.arange(K) != i))
+        nodes = np.concatenate(([i], leaves))
+        m = nodes.shape[0]
+        A = np.zeros((m, m))
+        A[0, 0] = - Out[i].sum()
+        A[0, 1:] = In[i, leaves]
+        A[1:, 0] = Out[i, leaves]
+        A[np.arange(1, m), np.arange(1, m)] = - In[i, leaves]
+        w, V = np.linalg.eig(A)
+        if np.linalg.cond(V) > MAX_CONDITION:
+            raise ValueError(f'La población del nodo {i} no es diagonalizable de forma estable.')
+        c = np.linalg.solve(V, N0[i, nodes])
+        W = V * c
+        r, q = np.indices((m, m))
+        rows.append((i * K + nodes[r]).ravel())
+        dest.append(nodes[r].ravel())
+        cols.append((modes + q).ravel())
+        coef.append(W.ravel())
+        rates.append(w)
+        modes += m
+    rows, dest, cols = (np.concatenate(a) for a in (rows, dest, cols))
+    coef = np.real_if_close(np.concatenate(coef), tol=1e6)
+    rates = np.real_if_close(np.concatenate(rates), tol=1e6)
+    W_pos = sp.csr_matrix((coef, (rows, cols)), shape=(K*K, modes))
+    W_dest = sp.csr_matrix((coef, (dest, cols)), shape=(K, modes))
+    return W_pos, W_dest, rates
+
+class _PresentTable:
+    '''
+    Tabla de la población presente en cada nodo (ver el comentario del módulo).
+    `table(t)` devuelve el vector de tamaño `K` para un tiempo escalar `t`.
+    '''
+    def __init__(self, W, rates, t0, rtol=TABLE_RTOL):
+        self.W, self.rates, self.t0 = W, rates, t0
+        value, derivative = self._exact(t0)
+        self.tol = rtol * max(np.abs(value).max(), np.finfo(float).tiny)
+        decaying = np.real(rates) < - 1e-12 * max(np.abs(rates).max(), 1.0)
+        weights = np.asarray(abs(W).sum(axis=0)).ravel()
+        if decaying.any():
+            slowest = - np.real(rates[decaying]).max()
+            largest = max(weights[decaying].max(), self.tol)
+            self.t_flat = t0 + np.log(largest / (1e-3 * self.tol)) / slowest
+        else:
+            self.t_flat = t0
+        # Los modos que no decaen tienen tasa nula.
+        self.steady = np.real(W @ (~decaying).astype(float))
+        self.ts = [t0]
+        self.ys, self.ds = [value], [derivative]
+        self.h = 0.1 / max(np.abs(rates).max(), 1e-12)
+        self._arrays()
+
+    def _exact(self, t, h=None):
+        '''
+        Población presente y su derivada en `t` (y, si se da `h`, también la
+        población en `t - h/2`), con un solo producto por la matriz de modos.
+        '''
+        E = np.exp(self.rates * (t - self.t0))
+        columns = [E, self.rates * E]
+        if h is not None:
+            columns.append(np.exp(self.rates * (t - h / 2 - self.t0)))
+        return tuple(np.real(self.W @ np.column_stack(columns)).T)
+
+    def _arrays(self):
+        self.T, self.Y, self.D = np.array(self.ts), np.array(self.ys), np.array(self.ds)
+
+    @staticmethod
+    def _hermite(s, h, y0, d0, y1, d1):
+        s2, s3 = s * s, s * s * s
+        return ((2*s3 - 3*s2 + 1) * y0 + (s3 - 2*s2 + s) * h * d0
+                + (- 2*s3 + 3*s2) * y1 + (s3 - s2) * h * d1)
+
+    def _extend(self, t):
+        end = min(t, self.t_flat)
+        while self.ts[-1] < end:
+            a, y0, d0 = self.ts[-1], self.ys[-1], self.ds[-1]
+            h = min(self.h, self.t_flat - a)
+            y1, d1, mid = self._exact(a + h, h)
+            err = np.abs(self._hermite(0.5, h, y0, d0, y1, d1) - mid).max()
+            if err <= self.tol:
+                self.ts.append(a + h)
+                self.ys.append(y1)
+                self.ds.append(d1)
+            self.h = h * min(4.0, max(0.2, 0.9 * (self.tol / max(err, 1e-300)) ** 0.25))
+        self._arrays()
+
+    def __call__(self, t):
+        if t >= self.t_flat:
+            return self.steady
+        if t < self.t0:
+            return self._exact(t)[0]
+        if t > self.T[-1]:
+            self._extend(t)
+        k = min(np.searchsorted(self.T, t, side='right') - 1, self.T.shape[0] - 2)
+        if k < 0:
+            return self.Y[0]
+        h = self.T[k+1] - self.T[k]
+        return self._hermite((t - self.T[k]) / h, h, self.Y[k], self.D[k], self.Y[k+1], self.D[k+1])
+
+def generate_fun_closed_population(spec):
+    '''
+    Genera la fábrica de un modelo lagrangiano sin el compartimento de la
+    población: los denominadores `N_k_i` se obtienen de `lagrange_population`.
+    El estado tiene los compartimentos de `spec` salvo `spec.population`, en
+    el mismo orden (la misma estructura que la variante `_lite`).
+
+    Parámetros
+    ---
+    `spec`: Especificación de un modelo con compartimento de población (`ModelSpec`).
+
+    Retorno
+    ---
+    `factory`: Función `factory(Out, In, *params, N0, t0=0.0)`, con las tasas en
+    el orden de `spec.parameters` y la población inicial `N0` (como en
+    `lagrange_population`), que devuelve `fun(t, y)`. La población presente en
+    cada nodo se toma de una tabla con tolerancia relativa `TABLE_RTOL`. La
+    función tiene el atributo `population` con la `PopulationSolution` exacta.
+    '''
+    if spec.population is None or spec.infection is None:
+        raise ValueError('El modelo debe tener infección y un compartimento de población.')
+    reduced = spec._replace(compartments=tuple(c for c in spec.compartments if c != spec.population),
+                            population=None)
+    def factory(Out, In, *params, N0, t0=0.0):
+        C, S, T, infectious, _, Beta, transitions = resolve(reduced, params)
+        K = Out.shape[0]
+        Out_i_k = Out.sum(axis=1)
+        W_pos, W_dest, rates = _population_modes(Out, In, N0)
+        population = _solution(W_pos, W_dest, rates, t0)
+        present = _PresentTable(W_dest, rates, t0)
+        shape = (C,K,K)
+        n = C*K*K
+        def fun(t,y):
+            y = y.reshape(shape)
+            new_y = _lagrange_movement(y, Out, In, Out_i_k)
+            I_p = y[infectious[0]] if len(infectious) == 1 else y[infectious].sum(axis=0)
+            infection = Beta * I_p.sum(axis=0) / present(t) * y[S]
+            new_y[S] -= infection
+            new_y[T] += infection
+            for src, dst, rate in transitions:
+                flow = rate * y[src]
+                new_y[src] -= flow
+                new_y[dst] += flow
+            return new_y.reshape((n,))
+        fun.population = population
+        return fun
+    return factory
+
+def expand_population(y, t, population, spec):
+    '''
+    Agrega el compartimento de la población a la salida de un modelo generado
+    con `generate_fun_closed_population`, para compararla con el modelo completo.
+
+    Parámetros
+    ---
+    `y`: Estado reducido (vector, o arreglo con una columna por tiempo, como `sol.y`).
+
+    `t`: Tiempo, o vector de tiempos (como `sol.t`).
+
+    `population`: `PopulationSolution` del modelo (`fun.population`).
+
+    `spec`: Especificación del modelo completo.
+
+    Retorno
+    ---
+    Estado con la estructura del modelo completo.
+    '''
+    y = np.asarray(y, dtype=float)
+    N = population.positions(t)
+    C = len(spec.compartments)
+    P = N.shape[0]
+    extra = y.shape[1:]
+    full = np.empty((C, P) + extra)
+    others = [c for c, name in enumerate(spec.compartments) if name != spec.population]
+    full[others] = y.reshape((C - 1, P) + extra)
+    full[spec.compartments.index(spec.population)] = N
+    return full.reshape((C * P,) + extra)
+
+#####################################################
+##### MODELOS CON POBLACIÓN EXACTA ##################
+#####################################################
+
+def fun_sir_lagrange_closed(Out, In, Beta, Gamma, N0):
+    '''
+    Variante de `fun_sir_lagrange` sin el compartimento `N`, que se calcula de
+    forma exacta. El estado tiene tamaño `3*K*K` (`S`, `I`, `R`).
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `N0`: Población inicial `N[i,j]` en `t = 0` (matriz `K x K`, o vector de tamaño `K`).
+    '''
+    return generate_fun_closed_population(SIR)(Out, In, Beta, Gamma, N0=N0)
+
+def fun_sis_lagrange_closed(Out, In, Beta, Gamma, N0):
+    '''
+    Variante de `fun_sis_lagrange` sin el compartimento `N`, que se calcula de
+    forma exacta. El estado tiene tamaño `2*K*K` (`S`, `I`).
+    '''
+    return generate_fun_closed_population(SIS)(Out, In, Beta, Gamma, N0=N0)
+
+def fun_seir_lagrange_closed(Out, In, Beta, Gamma, Sigma, N0):
+    '''
+    Variante de `fun_seir_lagrange` sin el compartimento `N`, que se calcula de
+    forma exacta. El estado tiene tamaño `4*K*K` (`S`, `E`, `I`, `R`).
+    '''
+    return generate_fun_closed_population(SEIR)(Out, In, Beta, Gamma, Sigma, N0=N0)
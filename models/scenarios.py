@@ -0,0 +1,322 @@
+import datetime
+import json
+import os
+import tempfile
+
+import numpy as np
+
+#################################################
+##### ALMACÉN DE ESCENARIOS #####################
+#################################################
+#
+# `ScenarioStore` guarda los parámetros de muchos escenarios (`Out`, `In`, `F`,
+# `Beta`, `Gamma`, `Sigma`, `y0`, ...) en una carpeta, como arreglos binarios
+# contiguos agrupados por cantidad de nodos `K`:
+#
+#     metadata.json      versión del formato, revisión y campos de cada grupo
+#     index.bin          por cada escenario, su grupo `K` y su fila en el grupo
+#     K<K>/<campo>.bin   el campo de todos los escenarios del grupo, fila a fila
+#
+# Los archivos se leen con `np.memmap`, de modo que acceder a un escenario (o
+# a un grupo completo) no carga ni deserializa nada más. Agregar escenarios
+# escribe al final de los archivos binarios y luego reemplaza
+# `metadata.json`, que tiene la cantidad de filas válidas: una escritura
+# interrumpida deja bytes de más que se ignoran y se sobrescriben en la
+# siguiente. Se admite un solo proceso escribiendo a la vez.
+
+FORMAT = 'scenario-store'
+FORMAT_VERSION = 1
+
+# Campos de los que se obtiene `K` (su primera dimensión) si no se indica.
+NODE_FIELDS = ('Out', 'In', 'F', 'Beta', 'Gamma', 'Sigma')
+
+_INDEX_DTYPE = np.dtype([('K', '<i8'), ('row', '<i8')])
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+class ScenarioStore:
+    '''
+    Almacén de escenarios en disco con acceso por mapeo de memoria.
+
+    Parámetros
+    ---
+    `directory`: Carpeta del almacén.
+
+    `mode`: `'r'` (solo lectura) o `'a'` (lectura y escritura; crea el almacén
+    si no existe).
+
+    `attrs`: Metadatos del usuario que se guardan al crear el almacén (por
+    ejemplo el modelo o la semilla con que se generaron los escenarios).
+    '''
+    def __init__(self, directory, mode='r', **attrs):
+        if mode not in ('r', 'a'):
+            raise ValueError("`mode` debe ser 'r' o 'a'.")
+        self.directory = directory
+        self.mode = mode
+        self._maps = {}
+        path = os.path.join(directory, 'metadata.json')
+        if not os.path.exists(path):
+            if mode == 'r':
+                raise FileNotFoundError(f'No existe el almacén {directory}.')
+            os.makedirs(directory, exist_ok=True)
+            self.metadata = {'format': FORMAT, 'version': FORMAT_VERSION, 'revision': 0,
+                             'created': _now(), 'modified': _now(), 'count': 0,
+                             'groups': {}, 'attrs': attrs}
+            self._write_metadata()
+        else:
+            with open(path) as f:
+                self.metadata = json.load(f)
+            if self.metadata.get('format') != FORMAT:
+                raise ValueError(f'{directory} no es un almacén de escenarios.')
+            if self.metadata['version'] > FORMAT_VERSION:
+                raise ValueError(f'El almacén usa la versión {self.metadata["version"]} del formato, '
+                                 f'posterior a la soportada ({FORMAT_VERSION}).')
+            if attrs:
+                self.set_attrs(**attrs)
+
+    ##### Consulta #####
+
+    def __len__(self):
+        return self.metadata['count']
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __getitem__(self, i):
+        return self.get(i)
+
+    @property
+    def attrs(self):
+        return dict(self.metadata['attrs'])
+
+    @property
+    def version(self):
+        return self.metadata['version']
+
+    @property
+    def revision(self):
+        '''
+        Cantidad de modificaciones del almacén desde que se creó.
+        '''
+        return self.metadata['revision']
+
+    def sizes(self):
+        '''
+        Diccionario `K -> cantidad de escenarios`.
+        '''
+        groups = self.metadata['groups']
+        return {K: groups[str(K)]['count'] for K in sorted(map(int, groups))}
+
+    def fields(self, K):
+        '''
+        Diccionario `campo -> (tipo, forma de una fila)` del grupo `K`.
+        '''
+        group = self.metadata['groups'][str(K)]
+        return {name: (np.dtype(f['dtype']), tuple(f['shape'])) for name, f in group['fields'].items()}
+
+    def index(self):
+        '''
+        Índice de solo lectura con los campos `K` y `row` de cada escenario.
+        '''
+        return self._map('index', _INDEX_DTYPE, (), len(self))
+
+    def ids(self, K=None):
+        '''
+        Identificadores de los escenarios (todos, o los del grupo `K`), en
+        orden de inserción.
+        '''
+        index = self.index()
+        if K is None:
+            return np.arange(len(self))
+        return np.flatnonzero(index['K'] == K)
+
+    def group(self, K):
+        '''
+        Diccionario `campo -> arreglo` (mapeado, de solo lectura) con los
+        escenarios del grupo `K`, uno por fila, en el orden de `ids(K)`.
+        '''
+        group = self.metadata['groups'][str(K)]
+        return {name: self._map((K, name), np.dtype(f['dtype']), tuple(f['shape']), group['count'])
+                for name, f in group['fields'].items()}
+
+    def get(self, i, fields=None):
+        '''
+        Diccionario `campo -> arreglo` del escenario `i`. Los arreglos son
+        vistas de solo lectura del archivo mapeado.
+        '''
+        if not -len(self) <= i < len(self):
+            raise IndexError(f'No existe el escenario {i}.')
+        K, row = self.index()[i]
+        group = self.group(int(K))
+        return {name: group[name][row] for name in (fields or group)}
+
+    def args(self, i, fields):
+        '''
+        Tupla con los campos `fields` del escenario `i`, en ese orden, para
+        pasarla a una fábrica, por ejemplo
+        `fun_sir_lagrange(*store.args(i, ('Out', 'In', 'Beta', 'Gamma')))`.
+        '''
+        scenario = self.get(i, fields)
+        return tuple(scenario[name] for name in fields)
+
+    ##### Escritura #####
+
+    def set_attrs(self, **attrs):
+        '''
+        Actualiza los metadatos del usuario.
+        '''
+        self._check_writable()
+        self.metadata['attrs'].update(attrs)
+        self._commit()
+
+    def append(self, K=None, **fields):
+        '''
+        Agrega un escenario y devuelve su identificador.
+
+        Parámetros
+        ---
+        `K`: Cantidad de nodos. Por defecto, la primera dimensión del primer
+        campo de `NODE_FIELDS` presente.
+
+        `fields`: Arreglos del escenario. Todos los escenarios de un grupo
+        deben tener los mismos campos, con la misma forma y tipos que se
+        puedan convertir al del grupo sin cambiar de clase (`'same_kind'`).
+        '''
+        fields = {name: np.asarray(value)[None] for name, value in fields.items()}
+        return int(self.extend(fields, K)[0])
+
+    def extend(self, fields, K=None):
+        '''
+        Agrega varios escenarios del mismo grupo `K`.
+
+        Parámetros
+        ---
+        `fields`: Diccionario `campo -> arreglo` con los escenarios apilados en
+        la primera dimensión.
+
+        `K`: Como en `append`.
+
+        Retorno
+        ---
+        Identificadores de los escenarios agregados.
+        '''
+        self._check_writable()
+        fields = {name: np.asarray(value) for name, value in fields.items()}
+        if not fields:
+            raise ValueError('Un escenario necesita al menos un campo.')
+        for name in fields:
+            if not name.isidentifier():
+                raise ValueError(f'Nombre de campo inválido: {name!r}.')
+        counts = {value.shape[0] for value in fields.values()}
+        if len(counts) != 1:
+            raise ValueError('Todos los campos deben tener la misma cantidad de escenarios.')
+        B = counts.pop()
+        if K is None:
+            K = next((fields[name].shape[1] for name in NODE_FIELDS if name in fields
+                      and fields[name].ndim > 1), None)
+            if K is None:
+                raise ValueError(f'No se puede deducir `K`: falta `K` o alguno de los campos {NODE_FIELDS}.')
+        K = int(K)
+        group = self.metadata['groups'].get(str(K))
+        if group is None:
+            group = {'count': 0, 'fields': {name: {'dtype': value.dtype.str, 'shape': list(value.shape[1:])}
+                                            for name, value in fields.items()}}
+        if set(fields) != set(group['fields']):
+            raise ValueError(f'El grupo K={K} tiene los campos {sorted(group["fields"])}.')
+        for name, value in fields.items():
+            if list(value.shape[1:]) != group['fields'][name]['shape']:
+                raise ValueError(f'El campo `{name}` del grupo K={K} tiene forma '
+                                 f'{tuple(group["fields"][name]["shape"])}.')
+            dtype = np.dtype(group['fields'][name]['dtype'])
+            if not np.can_cast(value.dtype, dtype, 'same_kind'):
+                raise ValueError(f'El campo `{name}` del grupo K={K} es de tipo {dtype} y no se '
+                                 f'puede convertir desde {value.dtype}.')
+
+        os.makedirs(os.path.join(self.directory, f'K{K}'), exist_ok=True)
+        rows = group['count'] + np.arange(B)
+        for name, value in fields.items():
+            dtype = np.dtype(group['fields'][name]['dtype'])
+            self._write(self._path((K, name)), group['count'] * dtype.itemsize * _size(value.shape[1:]),
+                        np.ascontiguousarray(value, dtype=dtype))
+        index = np.empty(B, dtype=_INDEX_DTYPE)
+        index['K'], index['row'] = K, rows
+        self._write(self._path('index'), len(self) * _INDEX_DTYPE.itemsize, index)
+
+        group['count'] += B
+        self.metadata['groups'][str(K)] = group
+        ids = len(self) + np.arange(B)
+        self.metadata['count'] += B
+        self._commit()
+        return ids
+
+    ##### Archivos #####
+
+    def _check_writable(self):
+        if self.mode != 'a':
+            raise PermissionError("El almacén se abrió en modo de solo lectura ('r').")
+
+    def _path(self, key):
+        if key == 'index':
+            return os.path.join(self.directory, 'index.bin')
+        K, name = key
+        return os.path.join(self.directory, f'K{K}', f'{name}.bin')
+
+    def _map(self, key, dtype, shape, count):
+        if count == 0:
+            return np.empty((0,) + shape, dtype=dtype)
+        cached = self._maps.get(key)
+        if cached is None or cached.shape[0] != count:
+            cached = np.memmap(self._path(key), dtype=dtype, mode='r', shape=(count,) + shape)
+            self._maps[key] = cached
+        return cached
+
+    def _write(self, path, offset, array):
+        # Se escribe a partir de las filas válidas (descartando lo que haya
+        # dejado una escritura interrumpida).
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            f.truncate(offset)
+            f.seek(offset)
+            f.write(array.tobytes())
+
+    def _commit(self):
+        self.metadata['revision'] += 1
+        self.metadata['modified'] = _now()
+        self._write_metadata()
+
+    def _write_metadata(self):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.metadata, f, indent=2)
+        os.replace(tmp, os.path.join(self.directory, 'metadata.json'))
+
+def _size(shape):
+    return int(np.prod(shape, dtype=np.int64))
+
+def from_npz(path, directory, fields, key=None, **attrs):
+    '''
+    Convierte un archivo `.npz` con un diccionario `K -> lista de tuplas de
+    parámetros` (como `params_dataset.npz` de experiment_02) en un
+    `ScenarioStore`. Es la única lectura que necesita `allow_pickle=True`.
+
+    Parámetros
+    ---
+    `path`: Archivo `.npz`.
+
+    `directory`: Carpeta del almacén (se crea, o se agregan los escenarios).
+
+    `fields`: Nombres de los elementos de cada tupla, por ejemplo
+    `('Out', 'In', 'Beta', 'Gamma')`.
+
+    `key`: Nombre del arreglo dentro del `.npz` (por defecto, el único).
+
+    `attrs`: Metadatos del usuario del almacén.
+    '''
+    with np.load(path, allow_pickle=True) as data:
+        key = data.files[0] if key is None else key
+        dataset = data[key].reshape(-1)[0]
+    store = ScenarioStore(directory, mode='a', source=os.path.basename(path), **attrs)
+    for K, scenarios in dataset.items():
+        stacked = {name: np.stack([s[f] for s in scenarios]) for f, name in enumerate(fields)}
+        store.extend(stacked, K)
+    return store
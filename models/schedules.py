@@ -0,0 +1,157 @@
+import numpy as np
+from scipy.integrate import OdeSolution, solve_ivp
+from scipy.optimize import OptimizeResult
+
+#####################################################
+##### MOVILIDAD VARIABLE EN EL TIEMPO ###############
+#####################################################
+#
+# Un `MobilitySchedule` describe matrices de movimiento constantes por tramos
+# (por ejemplo días laborables y fines de semana, o el antes y el después de
+# una intervención), opcionalmente periódicas. `solve_scheduled` construye el
+# modelo de cada tramo distinto una sola vez con la fábrica (que calcula las
+# sumas por filas y los operadores de movimiento de ese tramo) y reinicia el
+# integrador en cada cambio de tramo, de modo que el sistema de ecuaciones no
+# busca ni reconstruye nada en cada evaluación.
+
+class MobilitySchedule:
+    '''
+    Movilidad constante por tramos.
+
+    Parámetros
+    ---
+    `starts`: Tiempos de inicio de los tramos, crecientes. Antes del primero se
+    usa el primer tramo y el último dura hasta el infinito (o hasta el final
+    del período).
+
+    `mobility`: Matrices de movimiento de cada tramo: una tupla `(Out, In)`
+    (lagrangiano) o `(F,)` (euleriano) por tramo; en el euleriano también se
+    puede dar directamente `F`.
+
+    `period`: Si no es `None`, el calendario se repite con ese período y
+    `starts` debe empezar en `0` y estar dentro de `[0, period)`.
+    '''
+    def __init__(self, starts, mobility, period=None):
+        starts = np.asarray(starts, dtype=float)
+        if len(starts) != len(mobility) or len(starts) == 0:
+            raise ValueError('Se necesita un tiempo de inicio por cada tramo.')
+        if np.any(np.diff(starts) <= 0):
+            raise ValueError('Los tiempos de inicio deben ser crecientes.')
+        if period is not None and (starts[0] != 0 or starts[-1] >= period):
+            raise ValueError('En un calendario periódico los inicios deben estar en [0, period) y empezar en 0.')
+        self.starts = starts
+        self.mobility = [tuple(m) if isinstance(m, (tuple, list)) else (m,) for m in mobility]
+        self.period = period
+
+    def segments(self, t0, tf):
+        '''
+        Tramos que cubren `[t0, tf]`.
+
+        Retorno
+        ---
+        Lista de tuplas `(a, b, k)`: el tramo `k` está activo en `[a, b]`.
+        Tramos consecutivos con el mismo índice se unen.
+        '''
+        if self.period is None:
+            edges = [(float(s), k) for k, s in enumerate(self.starts) if t0 < s < tf]
+            first = max(0, np.searchsorted(self.starts, t0, side='right') - 1)
+        else:
+            P = self.period
+            edges = [(float(n * P + s), k) for n in range(int(np.floor(t0 / P)), int(np.ceil(tf / P)) + 1)
+                     for k, s in enumerate(self.starts) if t0 < n * P + s < tf]
+            first = np.searchsorted(self.starts, t0 % P, side='right') - 1
+        result = []
+        a, k = t0, int(first)
+        for b, next_k in edges:
+            if next_k != k:
+                result.append((a, b, k))
+                a, k = b, next_k
+        result.append((a, tf, k))
+        return result
+
+def weekly(weekday, weekend, weekend_start=5.0):
+    '''
+    Calendario semanal (período `7`): `weekday` desde el tiempo `0` hasta
+    `weekend_start` y `weekend` el resto de la semana. Cada argumento es como
+    un elemento de `mobility` en `MobilitySchedule`.
+    '''
+    return MobilitySchedule([0.0, weekend_start], [weekday, weekend], period=7.0)
+
+def solve_scheduled(factory, schedule, params, y0, t_span, t_eval=None, dense_output=False,
+                    method='RK45', **options):
+    '''
+    Resuelve un modelo con movilidad variable, reiniciando la integración en
+    cada cambio de tramo.
+
+    Parámetros
+    ---
+    `factory`: Fábrica que recibe las matrices de movimiento seguidas de las
+    tasas (por ejemplo `original_models.fun_sir_lagrange` o
+    `compartments.generate_fun(SIR, 'lagrange')`).
+
+    `schedule`: `MobilitySchedule`.
+
+    `params`: Tasas del modelo (tupla), en el orden de la fábrica.
+
+    `y0`, `t_span`, `t_eval`, `dense_output`, `method`, `options`: Como en
+    `solve_ivp`. Los eventos se buscan en cada tramo y un evento terminal
+    detiene la integración.
+
+    Retorno
+    ---
+    `OptimizeResult` con los campos de `solve_ivp` (`t`, `y`, `sol`,
+    `t_events`, `y_events`, `nfev`, `njev`, `nlu`, `status`, `message`,
+    `success`) y `segments`, la lista de tramos `(a, b, k)` integrados.
+    '''
+    t0, tf = map(float, t_span)
+    funs = {}
+    y = np.asarray(y0, dtype=float)
+    ts, ys, sol_ts, interpolants = [], [], [], []
+    t_events = y_events = None
+    nfev = njev = nlu = 0
+    done = []
+    for a, b, k in schedule.segments(t0, tf):
+        if k not in funs:
+            funs[k] = factory(*schedule.mobility[k], *params)
+        seg_eval = None
+        if t_eval is not None:
+            t_eval = np.asarray(t_eval, dtype=float)
+            # Cada tiempo de salida pertenece a un único tramo (los extremos
+            # interiores, al que comienza en ellos). El final del tramo se
+            # agrega siempre para obtener el estado inicial del siguiente.
+            mask = (t_eval >= a) & ((t_eval < b) | ((b == tf) & (t_eval <= b)))
+            seg_eval = t_eval[mask]
+            if not len(seg_eval) or seg_eval[-1] != b:
+                seg_eval = np.append(seg_eval, b)
+        sol = solve_ivp(funs[k], (a, b), y, method=method, t_eval=seg_eval,
+                        dense_output=dense_output, **options)
+        done.append((a, b, k))
+        nfev, njev, nlu = nfev + sol.nfev, njev + sol.njev, nlu + sol.nlu
+        if t_eval is None:
+            # El estado inicial de cada tramo ya es el final del anterior.
+            keep = slice(1 if ts else 0, None)
+        else:
+            keep = slice(0, mask.sum())
+        ts.append(sol.t[keep])
+        ys.append(sol.y[:, keep])
+        if dense_output:
+            sol_ts.append(sol.sol.ts if not sol_ts else sol.sol.ts[1:])
+            interpolants.extend(sol.sol.interpolants)
+        if sol.t_events is not None:
+            if t_events is None:
+                t_events = [[] for _ in sol.t_events]
+                y_events = [[] for _ in sol.y_events]
+            for e, (te, ye) in enumerate(zip(sol.t_events, sol.y_events)):
+                t_events[e].append(te)
+                y_events[e].append(ye)
+        if sol.status != 0:
+            break
+        y = sol.y[:, -1].copy()
+    if t_events is not None:
+        t_events = [np.concatenate(te) for te in t_events]
+        y_events = [np.concatenate([np.reshape(e, (-1, y.shape[0])) for e in ye]) for ye in y_events]
+    dense = OdeSolution(np.concatenate(sol_ts), interpolants) if dense_output else None
+    return OptimizeResult(t=np.concatenate(ts), y=np.concatenate(ys, axis=1), sol=dense,
+                          t_events=t_events, y_events=y_events, nfev=nfev, njev=njev, nlu=nlu,
+                          status=sol.status, message=sol.message, success=sol.status >= 0,
+                          segments=done)
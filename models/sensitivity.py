@@ -0,0 +1,250 @@
+import numpy as np
+from scipy.integrate import solve_ivp
+from scipy.optimize import OptimizeResult
+
+from .compartments import _destinations, _nodes, _split_args, generate_fun, generate_jac, resolve
+
+#####################################################
+##### SENSIBILIDADES RESPECTO A LOS PARÁMETROS ######
+#####################################################
+#
+# Los parámetros libres forman un vector `x` de tamaño `m`. Cada tasa libre del
+# modelo se obtiene indexando `x` con un vector de índices de tamaño `K`, igual
+# que en `calibration.Calibration`: `{'Beta': [0, 0], 'Gamma': [1, 1]}` usa un
+# `Beta` y un `Gamma` comunes a los dos nodos. Por defecto cada tasa es libre en
+# cada nodo (`m = K * len(spec.parameters)`).
+#
+# Modo directo: se integra el sistema aumentado `y' = f(y)`,
+# `S_j' = J(y) S_j + df/dx_j`, donde `S_j = dy/dx_j`. Una sola integración da la
+# trayectoria y sus derivadas respecto a los `m` parámetros.
+#
+# Modo adjunto: para una pérdida `L = sum_i g_i(y(t_i))` se integra hacia atrás
+# `lambda' = -J(y)^T lambda`, sumando `dg_i/dy` en cada `t_i`, y se acumula
+# `dL/dx = int lambda^T df/dx dt`. El costo no depende de `m`, por lo que
+# también se obtienen las derivadas respecto a todas las entradas de las
+# matrices de movimiento.
+
+def _free_indices(spec, K, free):
+    '''
+    Normaliza el diccionario de parámetros libres. Devuelve el diccionario de
+    vectores de índices y la cantidad `m` de parámetros libres.
+    '''
+    if free is None:
+        free = {name: r * K + np.arange(K) for r, name in enumerate(spec.parameters)}
+    free = {name: np.broadcast_to(np.asarray(index, dtype=np.int64), (K,))
+            for name, index in free.items()}
+    unknown = set(free) - set(spec.parameters)
+    if unknown:
+        raise ValueError(f'Parámetros libres desconocidos: {sorted(unknown)}.')
+    m = 1 + max(int(index.max()) for index in free.values())
+    return free, m
+
+def _parameter_derivative(spec, dest, K, free, C, S, T, infectious, N, Beta, transitions):
+    '''
+    Estructura de `df/dx`. Devuelve `(rows, cols, values)`, donde `values(y)`
+    da los valores de las entradas `(rows, cols)` de la matriz `n x m`.
+    '''
+    P = dest.shape[0]
+    positions = np.arange(P)
+    rows, cols, parts = [], [], []
+    if S is not None and spec.infection.rate in free:
+        col = free[spec.infection.rate][dest]
+        rows += [S*P + positions, T*P + positions]
+        cols += [col, col]
+        parts.append(None)
+    for (src, dst, _), tr in zip(transitions, spec.transitions):
+        if tr.rate in free:
+            col = free[tr.rate][dest]
+            rows += [src*P + positions, dst*P + positions]
+            cols += [col, col]
+            parts.append(src)
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+    def values(y):
+        y = y.reshape((C,P))
+        out = []
+        for part in parts:
+            if part is None:
+                N_p = y.sum(axis=0) if N is None else y[N]
+                I_n = np.bincount(dest, weights=y[infectious].sum(axis=0), minlength=K)
+                N_n = np.bincount(dest, weights=N_p, minlength=K)
+                v = (I_n / N_n)[dest] * y[S]
+            else:
+                v = y[part]
+            out += [- v, v]
+        return np.concatenate(out) if out else np.zeros(0)
+    return rows, cols, values
+
+def generate_sensitivity(spec, movement):
+    '''
+    Genera la fábrica del sistema aumentado de sensibilidades directas de un
+    modelo compartimental con un esquema de movimiento.
+
+    Parámetros
+    ---
+    `spec`: Especificación del modelo (`ModelSpec`).
+
+    `movement`: `'none'` (nodos aislados), `'eulerian'` o `'lagrange'`.
+
+    Retorno
+    ---
+    `factory`: Función con los mismos argumentos que la fábrica de
+    `generate_fun`, más el argumento opcional `free`, que devuelve `(fun, m)`.
+    `fun(t, z)` es el sistema aumentado, con `z = [y, S.ravel()]` y `S` de
+    forma `m x n` (`S[j] = dy/dx_j`).
+    '''
+    fun_factory = generate_fun(spec, movement)
+    jac_factory = generate_jac(spec, movement)
+    def factory(*args, free=None):
+        mobility, params = _split_args(movement, args)
+        C, S, T, infectious, N, Beta, transitions = resolve(spec, params)
+        K = _nodes(mobility, Beta, transitions)
+        free, m = _free_indices(spec, K, free)
+        dest = _destinations(movement, K)
+        n = C * dest.shape[0]
+        fun = fun_factory(*args)
+        jac, _ = jac_factory(*args)
+        rows, cols, values = _parameter_derivative(spec, dest, K, free, C, S, T,
+                                                   infectious, N, Beta, transitions)
+        flat = cols * n + rows
+        def sens_fun(t, z):
+            y = z[:n]
+            Sm = z[n:].reshape((m, n))
+            dS = (jac(t, y) @ Sm.T).T
+            dS += np.bincount(flat, weights=values(y), minlength=m*n).reshape((m, n))
+            return np.concatenate((fun(t, y), dS.ravel()))
+        return sens_fun, m
+    return factory
+
+def solve_sensitivity(spec, movement, args, y0, t_span, t_eval=None, free=None, method='RK45', **options):
+    '''
+    Integra un modelo junto con sus sensibilidades directas.
+
+    Parámetros
+    ---
+    `spec`, `movement`: Modelo y esquema de movimiento, como en `generate_sensitivity`.
+
+    `args`: Argumentos de la fábrica (matrices de movimiento y tasas).
+
+    `y0`: Estado inicial. Se supone que no depende de los parámetros.
+
+    `t_span`, `t_eval`, `method`, `options`: Como en `solve_ivp`.
+
+    `free`: Diccionario de parámetros libres (por defecto, todas las tasas por nodo).
+
+    Retorno
+    ---
+    El resultado de `solve_ivp`, donde `y` tiene forma `n x len(t)` y el nuevo
+    campo `sensitivity` tiene forma `m x n x len(t)`.
+    '''
+    fun, m = generate_sensitivity(spec, movement)(*args, free=free)
+    y0 = np.asarray(y0, dtype=float)
+    n = y0.shape[0]
+    z0 = np.concatenate((y0, np.zeros(m * n)))
+    sol = solve_ivp(fun, t_span, z0, t_eval=t_eval, method=method, **options)
+    sol.sensitivity = sol.y[n:].reshape((m, n, -1))
+    sol.y = sol.y[:n]
+    return sol
+
+def _mobility_gradient(movement, C, K):
+    '''
+    Devuelve `grad(y, lam)`, la derivada de `lam^T f` respecto a las entradas de
+    las matrices de movimiento, aplanadas (`F`, o `Out` seguida de `In`).
+    '''
+    if movement == 'lagrange':
+        diag = np.arange(K)
+        def grad(y, lam):
+            y = y.reshape((C,K,K))
+            lam = lam.reshape((C,K,K))
+            y_ii = y[:, diag, diag]
+            lam_ii = lam[:, diag, diag]
+            g_out = np.einsum('ci,cij->ij', y_ii, lam) - (y_ii * lam_ii).sum(axis=0)[:, None]
+            g_in = (y * (lam_ii[:, :, None] - lam)).sum(axis=0)
+            g_out[diag, diag] = 0
+            g_in[diag, diag] = 0
+            return np.concatenate((g_out.ravel(), g_in.ravel()))
+        return grad, 2 * K * K
+    if movement == 'eulerian':
+        def grad(y, lam):
+            y = y.reshape((C,K))
+            lam = lam.reshape((C,K))
+            g = np.einsum('ci,cj->ij', y, lam) - (y * lam).sum(axis=0)[:, None]
+            g[np.arange(K), np.arange(K)] = 0
+            return g.ravel()
+        return grad, K * K
+    return None, 0
+
+def adjoint_gradient(spec, movement, args, y0, t_span, t_eval, dloss, free=None,
+                     mobility=False, method='RK45', rtol=1e-6, atol=1e-9):
+    '''
+    Gradiente de una pérdida escalar mediante el método adjunto.
+
+    Parámetros
+    ---
+    `spec`, `movement`, `args`, `free`: Como en `solve_sensitivity`.
+
+    `y0`: Estado inicial.
+
+    `t_span`: Intervalo de integración. `t_eval`: Tiempos de observación, crecientes.
+
+    `dloss`: Función `dloss(i, y)` que devuelve `dg_i/dy`, la derivada de la
+    pérdida respecto al estado `y = y(t_eval[i])`.
+
+    `mobility`: Si es `True` también se calcula el gradiente respecto a las
+    entradas fuera de la diagonal de las matrices de movimiento.
+
+    `method`, `rtol`, `atol`: Opciones de `solve_ivp`, para ambas integraciones.
+
+    Retorno
+    ---
+    `OptimizeResult` con `x` (gradiente respecto a los `m` parámetros libres),
+    `y0` (gradiente respecto al estado inicial), `y` (trayectoria en `t_eval`) y,
+    si `mobility` es `True`, `mobility`: `(dOut, dIn)` en el lagrangiano o `dF`
+    en el euleriano.
+    '''
+    mob, params = _split_args(movement, args)
+    C, S, T, infectious, N, Beta, transitions = resolve(spec, params)
+    K = _nodes(mob, Beta, transitions)
+    free, m = _free_indices(spec, K, free)
+    dest = _destinations(movement, K)
+    n = C * dest.shape[0]
+    t_eval = np.asarray(t_eval, dtype=float)
+    jac, _ = generate_jac(spec, movement)(*args)
+    rows, cols, values = _parameter_derivative(spec, dest, K, free, C, S, T,
+                                               infectious, N, Beta, transitions)
+    grad_mob, n_mob = _mobility_gradient(movement, C, K) if mobility else (None, 0)
+
+    forward = solve_ivp(generate_fun(spec, movement)(*args), t_span, y0, t_eval=t_eval,
+                        method=method, rtol=rtol, atol=atol, dense_output=True)
+    if forward.status != 0:
+        raise RuntimeError(f'Falló la integración hacia adelante: {forward.message}')
+
+    def backward(t, w):
+        y = forward.sol(t)
+        lam = w[:n]
+        dw = [- (jac(t, y).T @ lam),
+              - np.bincount(cols, weights=values(y) * lam[rows], minlength=m)]
+        if grad_mob is not None:
+            dw.append(- grad_mob(y, lam))
+        return np.concatenate(dw)
+
+    w = np.zeros(n + m + n_mob)
+    nfev = forward.nfev
+    for i in range(t_eval.shape[0] - 1, -1, -1):
+        w[:n] += dloss(i, forward.y[:, i])
+        t_prev = t_eval[i-1] if i > 0 else t_span[0]
+        if t_prev < t_eval[i]:
+            sol = solve_ivp(backward, (t_eval[i], t_prev), w, method=method, rtol=rtol, atol=atol)
+            if sol.status != 0:
+                raise RuntimeError(f'Falló la integración adjunta: {sol.message}')
+            w = sol.y[:, -1]
+            nfev += sol.nfev
+
+    result = OptimizeResult(x=w[n:n+m], y0=w[:n], y=forward.y, nfev=nfev)
+    if grad_mob is not None:
+        g = w[n+m:]
+        if movement == 'lagrange':
+            result.mobility = (g[:K*K].reshape((K,K)), g[K*K:].reshape((K,K)))
+        else:
+            result.mobility = g.reshape((K,K))
+    return result
@@ -0,0 +1,375 @@
+import numpy as np
+import scipy.sparse as sp
+
+#####################################################################
+##### ESTADO LAGRANGIANO DISPERSO (DIAGONAL + ARISTAS DE `Out`) #####
+#####################################################################
+#
+# En lugar del estado denso `C x K x K`, cada compartimento guarda solo
+# `K + E` valores: primero los `K` agentes que están en su propio nodo
+# (`y[c,i,i]`) y luego los `E` agentes de cada arista `(i,j)` con
+# `Out[i,j] != 0` (`y[c,i,j]`), en orden de filas. El vector aplanado tiene
+# tamaño `C*(K+E)`.
+
+def lagrange_edges(Out):
+    '''
+    Obtiene la lista de aristas de la matriz de emigración.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K`.
+    Puede ser un arreglo denso o una matriz de `scipy.sparse`.
+
+    Retorno
+    ---
+    `rows`, `cols`: Vectores de tamaño `E` con el nodo de residencia y el nodo
+    destino de cada arista `(i,j)`, `i != j`, con `Out[i,j] != 0`, ordenados por filas.
+    '''
+    Out = sp.coo_matrix(Out)
+    mask = (Out.row != Out.col) & (Out.data != 0)
+    rows, cols = Out.row[mask], Out.col[mask]
+    order = np.lexsort((cols, rows))
+    return rows[order].astype(np.intp), cols[order].astype(np.intp)
+
+def _sparse_structure(Out, In):
+    '''
+    Precalcula las aristas y las tasas por arista que usan los modelos dispersos.
+    '''
+    K = Out.shape[0]
+    rows, cols = lagrange_edges(Out)
+    Out = sp.csr_matrix(Out, dtype=float)
+    In = sp.csr_matrix(In, dtype=float)
+    Out_e = np.asarray(Out[rows, cols]).ravel()
+    In_e = np.asarray(In[rows, cols]).ravel()
+    Out_i_k = np.asarray(Out.sum(axis=1)).ravel()
+    In_ii = In.diagonal()
+    return K, rows, cols, Out_e, In_e, Out_i_k, In_ii
+
+def _segment_sum(index, values, K):
+    '''
+    Suma `values` (forma `C x E`) por segmentos según `index` (tamaño `E`).
+    Devuelve un arreglo de forma `C x K`.
+    '''
+    C = values.shape[0]
+    flat_index = (np.arange(C)[:, None] * K + index).ravel()
+    return np.bincount(flat_index, weights=values.ravel(), minlength=C*K).reshape((C,K))
+
+def _sparse_movement(y_ii, y_e, K, rows, Out_e, In_e, Out_i_k, In_ii):
+    '''
+    Término de movimiento lagrangiano sobre el estado disperso.
+    Devuelve `(d_ii, d_e)` con formas `C x K` y `C x E`.
+    '''
+    back = In_e * y_e
+    d_ii = - y_ii * Out_i_k + In_ii * y_ii + _segment_sum(rows, back, K)
+    d_e = Out_e * y_ii[:, rows] - back
+    return d_ii, d_e
+
+def _sparse_force(Beta, I_ii, I_e, N_ii, N_e, cols):
+    '''
+    Fuerza de infección por nodo destino, con las sumas `I_k_i` y `N_k_i`
+    calculadas como reducciones por segmentos sobre las aristas.
+    '''
+    K = I_ii.shape[0]
+    I_k_i = I_ii + np.bincount(cols, weights=I_e, minlength=K)
+    N_k_i = N_ii + np.bincount(cols, weights=N_e, minlength=K)
+    return Beta * I_k_i / N_k_i
+
+def pack_lagrange_state(y0, Out, C):
+    '''
+    Convierte un estado lagrangiano denso al formato disperso.
+
+    Parámetros
+    ---
+    `y0`: Vector de tamaño `C*K*K` (o arreglo `C x K x K`), con la misma
+    estructura que usan los modelos de `original_models`.
+
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K`.
+
+    `C`: Cantidad de compartimentos del modelo (por ejemplo `4` para SIR).
+
+    Retorno
+    ---
+    `y`: Vector de tamaño `C*(K+E)`.
+    Lanza `ValueError` si `y0` tiene agentes fuera de la diagonal y de las aristas de `Out`.
+    '''
+    K = Out.shape[0]
+    rows, cols = lagrange_edges(Out)
+    y0 = np.asarray(y0, dtype=float).reshape((C,K,K))
+    diag = np.arange(K)
+    y_ii = y0[:, diag, diag]
+    y_e = y0[:, rows, cols]
+    if not np.isclose(y_ii.sum() + y_e.sum(), y0.sum()):
+        raise ValueError('`y0` tiene agentes en pares (i,j) que no son aristas de `Out`.')
+    return np.concatenate((y_ii, y_e), axis=1).reshape((C*(K+len(rows)),))
+
+def unpack_lagrange_state(y, Out, C):
+    '''
+    Convierte un estado lagrangiano disperso al formato denso.
+
+    Parámetros
+    ---
+    `y`: Vector de tamaño `C*(K+E)`, o arreglo `C*(K+E) x T` (como `sol.y`).
+
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K`.
+
+    `C`: Cantidad de compartimentos del modelo.
+
+    Retorno
+    ---
+    `dense`: Vector de tamaño `C*K*K`, o arreglo `C*K*K x T`.
+    '''
+    K = Out.shape[0]
+    rows, cols = lagrange_edges(Out)
+    y = np.asarray(y, dtype=float)
+    extra = y.shape[1:]
+    y = y.reshape((C, K+len(rows)) + extra)
+    dense = np.zeros((C,K,K) + extra)
+    diag = np.arange(K)
+    dense[:, diag, diag] = y[:, :K]
+    dense[:, rows, cols] = y[:, K:]
+    return dense.reshape((C*K*K,) + extra)
+
+def fun_lagrange_mov_sparse(O, I):
+    '''
+    Genera el sistema de ecuaciones para un modelo movimiento lagrangiano
+    sobre el estado disperso.
+
+    Parámetros
+    ---
+    `O`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `I`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` (vector de tamaño `K+E`, ver `pack_lagrange_state`).
+    '''
+    K, rows, _, Out_e, In_e, Out_i_k, In_ii = _sparse_structure(O, I)
+    def fun(t,y):
+        y = y.reshape((1,-1))
+        d_ii, d_e = _sparse_movement(y[:, :K], y[:, K:], K, rows, Out_e, In_e, Out_i_k, In_ii)
+        return np.concatenate((d_ii, d_e), axis=1).reshape((-1,))
+    return fun
+
+##########################################################
+###### MODELO SIR CON MOVIMIENTO LAGRANGIANO DISPERSO ####
+##########################################################
+
+def fun_sir_lagrange_sparse(Out, In, Beta, Gamma):
+    '''
+    Genera el sistema de ecuaciones para un modelo SIR movimiento lagrangiano,
+    guardando solo la diagonal y las aristas de `Out`. El costo de memoria y de
+    cada evaluación es `O(K + E)`.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `4*(K+E)` (aplanado),
+    con los susceptibles, los infestados, los recuperados y la población total
+    (ver `pack_lagrange_state`).
+    '''
+    K, rows, cols, Out_e, In_e, Out_i_k, In_ii = _sparse_structure(Out, In)
+    Gamma_e = Gamma[cols]
+    def fun(t,y):
+        y = y.reshape((4,-1))
+        y_ii, y_e = y[:, :K], y[:, K:]
+        d_ii, d_e = _sparse_movement(y_ii, y_e, K, rows, Out_e, In_e, Out_i_k, In_ii)
+        force = _sparse_force(Beta, y_ii[1], y_e[1], y_ii[3], y_e[3], cols)
+        for d, s, force_, gamma in ((d_ii, y_ii, force, Gamma), (d_e, y_e, force[cols], Gamma_e)):
+            infection = force_ * s[0]
+            recovery = gamma * s[1]
+            d[0] -= infection
+            d[1] += infection - recovery
+            d[2] += recovery
+        return np.concatenate((d_ii, d_e), axis=1).reshape((-1,))
+    return fun
+
+def fun_sir_lagrange_lite_sparse(Out, In, Beta, Gamma):
+    '''
+    Genera el sistema de ecuaciones para un modelo SIR movimiento lagrangiano
+    sobre el estado disperso. No contempla las ecuaciones diferenciales
+    destinadas para la variación de la población total por nodo.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `3*(K+E)` (aplanado),
+    con los susceptibles, los infestados y los recuperados.
+    '''
+    K, rows, cols, Out_e, In_e, Out_i_k, In_ii = _sparse_structure(Out, In)
+    Gamma_e = Gamma[cols]
+    def fun(t,y):
+        y = y.reshape((3,-1))
+        y_ii, y_e = y[:, :K], y[:, K:]
+        d_ii, d_e = _sparse_movement(y_ii, y_e, K, rows, Out_e, In_e, Out_i_k, In_ii)
+        force = _sparse_force(Beta, y_ii[1], y_e[1], y_ii.sum(axis=0), y_e.sum(axis=0), cols)
+        for d, s, force_, gamma in ((d_ii, y_ii, force, Gamma), (d_e, y_e, force[cols], Gamma_e)):
+            infection = force_ * s[0]
+            recovery = gamma * s[1]
+            d[0] -= infection
+            d[1] += infection - recovery
+            d[2] += recovery
+        return np.concatenate((d_ii, d_e), axis=1).reshape((-1,))
+    return fun
+
+##########################################################
+###### MODELO SIS CON MOVIMIENTO LAGRANGIANO DISPERSO ####
+##########################################################
+
+def fun_sis_lagrange_sparse(Out, In, Beta, Gamma):
+    '''
+    Genera el sistema de ecuaciones para un modelo SIS movimiento lagrangiano
+    sobre el estado disperso.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `3*(K+E)` (aplanado),
+    con los susceptibles, los infestados y la población total.
+    '''
+    K, rows, cols, Out_e, In_e, Out_i_k, In_ii = _sparse_structure(Out, In)
+    Gamma_e = Gamma[cols]
+    def fun(t,y):
+        y = y.reshape((3,-1))
+        y_ii, y_e = y[:, :K], y[:, K:]
+        d_ii, d_e = _sparse_movement(y_ii, y_e, K, rows, Out_e, In_e, Out_i_k, In_ii)
+        force = _sparse_force(Beta, y_ii[1], y_e[1], y_ii[2], y_e[2], cols)
+        for d, s, force_, gamma in ((d_ii, y_ii, force, Gamma), (d_e, y_e, force[cols], Gamma_e)):
+            infection = force_ * s[0]
+            recovery = gamma * s[1]
+            d[0] += recovery - infection
+            d[1] += infection - recovery
+        return np.concatenate((d_ii, d_e), axis=1).reshape((-1,))
+    return fun
+
+def fun_sis_lagrange_lite_sparse(Out, In, Beta, Gamma):
+    '''
+    Genera el sistema de ecuaciones para un modelo SIS movimiento lagrangiano
+    sobre el estado disperso. No contempla las ecuaciones diferenciales
+    destinadas para la variación de la población total por nodo.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `2*(K+E)` (aplanado),
+    con los susceptibles y los infestados.
+    '''
+    K, rows, cols, Out_e, In_e, Out_i_k, In_ii = _sparse_structure(Out, In)
+    Gamma_e = Gamma[cols]
+    def fun(t,y):
+        y = y.reshape((2,-1))
+        y_ii, y_e = y[:, :K], y[:, K:]
+        d_ii, d_e = _sparse_movement(y_ii, y_e, K, rows, Out_e, In_e, Out_i_k, In_ii)
+        force = _sparse_force(Beta, y_ii[1], y_e[1], y_ii.sum(axis=0), y_e.sum(axis=0), cols)
+        for d, s, force_, gamma in ((d_ii, y_ii, force, Gamma), (d_e, y_e, force[cols], Gamma_e)):
+            infection = force_ * s[0]
+            recovery = gamma * s[1]
+            d[0] += recovery - infection
+            d[1] += infection - recovery
+        return np.concatenate((d_ii, d_e), axis=1).reshape((-1,))
+    return fun
+
+###########################################################
+###### MODELO SEIR CON MOVIMIENTO LAGRANGIANO DISPERSO ####
+###########################################################
+
+def fun_seir_lagrange_sparse(Out, In, Beta, Gamma, Sigma):
+    '''
+    Genera el sistema de ecuaciones para un modelo SEIR movimiento lagrangiano
+    sobre el estado disperso.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Sigma`: Tasa de Incubación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `5*(K+E)` (aplanado),
+    con los susceptibles, los expuestos, los infestados, los recuperados
+    y la población total.
+    '''
+    K, rows, cols, Out_e, In_e, Out_i_k, In_ii = _sparse_structure(Out, In)
+    Gamma_e, Sigma_e = Gamma[cols], Sigma[cols]
+    def fun(t,y):
+        y = y.reshape((5,-1))
+        y_ii, y_e = y[:, :K], y[:, K:]
+        d_ii, d_e = _sparse_movement(y_ii, y_e, K, rows, Out_e, In_e, Out_i_k, In_ii)
+        force = _sparse_force(Beta, y_ii[2], y_e[2], y_ii[4], y_e[4], cols)
+        for d, s, force_, gamma, sigma in ((d_ii, y_ii, force, Gamma, Sigma),
+                                           (d_e, y_e, force[cols], Gamma_e, Sigma_e)):
+            infection = force_ * s[0]
+            incubation = sigma * s[1]
+            recovery = gamma * s[2]
+            d[0] -= infection
+            d[1] += infection - incubation
+            d[2] += incubation - recovery
+            d[3] += recovery
+        return np.concatenate((d_ii, d_e), axis=1).reshape((-1,))
+    return fun
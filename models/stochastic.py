@@ -0,0 +1,371 @@
+from collections import namedtuple
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import OptimizeResult
+
+from .compartments import (SEIR, SEIR_ORIGINAL_EULERIAN, SIR, SIS, _destinations, _nodes,
+                           _split_args, resolve)
+
+#####################################################
+##### MODELOS ESTOCÁSTICOS ##########################
+#####################################################
+#
+# Cada evento mueve a una persona de una entrada del estado a otra: un
+# contagio (S -> destino de la infección en la misma posición), una transición
+# lineal, o un viaje (euleriano: de `i` a `j` con tasa `F[i,j]`; lagrangiano:
+# salida de `(i,i)` a `(i,j)` con tasa `Out[i,j]` y regreso de `(i,j)` a `(i,i)`
+# con tasa `In[i,j]`). La propensión de cada evento es su tasa por la cantidad
+# de personas en la entrada de origen, y la tasa de contagio en el nodo `n` es
+# `Beta[n] * I_n / N_n`, igual que en los modelos deterministas.
+#
+# El compartimento `N` de los modelos completos no se simula: es la suma de
+# los demás compartimentos, y se reconstruye al devolver los resultados, que
+# tienen la misma estructura que el vector `y` de los modelos deterministas.
+#
+# Todas las réplicas avanzan juntas: las propensiones se calculan para un
+# arreglo `réplicas x eventos` en cada paso. Cada réplica tiene su propio
+# generador de números aleatorios (derivado de `SeedSequence(seed).spawn`),
+# por lo que su trayectoria no depende de cuántas réplicas se simulen a la vez.
+
+StochasticModel = namedtuple('StochasticModel', ['propensities', 'src', 'dst', 'stoichiometry',
+                                                 'to_counts', 'to_state'])
+
+def generate_stochastic(spec, movement):
+    '''
+    Genera la fábrica de un modelo estocástico a partir de su especificación.
+
+    Parámetros
+    ---
+    `spec`: Especificación del modelo (`ModelSpec`).
+
+    `movement`: `'none'` (nodos aislados), `'eulerian'` o `'lagrange'`.
+
+    Retorno
+    ---
+    `factory`: Función con los mismos argumentos que la fábrica de
+    `generate_fun`, que devuelve un `StochasticModel` para `simulate`.
+    '''
+    def factory(*args):
+        mobility, params = _split_args(movement, args)
+        C, S, T, infectious, N, Beta, transitions = resolve(spec, params)
+        K = _nodes(mobility, Beta, transitions)
+        dest = _destinations(movement, K)
+        P = dest.shape[0]
+        species = [c for c in range(C) if c != N]
+        index = {c: s for s, c in enumerate(species)}
+        n_s = len(species) * P
+        positions = np.arange(P)
+
+        src, dst, rates = [], [], []
+        def add(a, b, rate):
+            keep = rate > 0
+            src.append(a[keep])
+            dst.append(b[keep])
+            rates.append(rate[keep])
+        for s in range(len(species)):
+            if movement == 'eulerian':
+                F = np.asarray(mobility[0], dtype=float)
+                i, j = np.nonzero(F)
+                add(s*P + i, s*P + j, F[i, j])
+            elif movement == 'lagrange':
+                Out, In = (np.asarray(M, dtype=float) for M in mobility)
+                i, j = np.nonzero(Out)
+                add(s*P + i*K + i, s*P + i*K + j, Out[i, j])
+                i, j = np.nonzero(In)
+                add(s*P + i*K + j, s*P + i*K + i, In[i, j])
+        for c_src, c_dst, rate in transitions:
+            rate = np.asarray(rate, dtype=float)[dest]
+            add(index[c_src]*P + positions, index[c_dst]*P + positions, rate)
+        n_const = sum(r.shape[0] for r in rates)
+        if S is not None:
+            src.append(index[S]*P + positions)
+            dst.append(index[T]*P + positions)
+        src = np.concatenate(src).astype(np.int64)
+        dst = np.concatenate(dst).astype(np.int64)
+        rates = np.concatenate(rates)
+        n_r = src.shape[0]
+        V = sp.csr_matrix((np.concatenate((- np.ones(n_r), np.ones(n_r))),
+                           (np.concatenate((src, dst)), np.tile(np.arange(n_r), 2))),
+                          shape=(n_s, n_r))
+        inf_species = [index[c] for c in infectious]
+        S_s = None if S is None else index[S]
+        Beta = None if Beta is None else np.asarray(Beta, dtype=float)
+
+        def propensities(X):
+            B = X.shape[0]
+            A = np.empty((B, n_r))
+            A[:, :n_const] = rates * X[:, src[:n_const]]
+            if S_s is not None:
+                Xr = X.reshape((B, len(species), P))
+                I_p = Xr[:, inf_species].sum(axis=1)
+                N_p = Xr.sum(axis=1)
+                if movement == 'lagrange':
+                    I_p = I_p.reshape((B,K,K)).sum(axis=1)
+                    N_p = N_p.reshape((B,K,K)).sum(axis=1)
+                force = np.divide(Beta * I_p, N_p, out=np.zeros((B,K)), where=N_p > 0)
+                A[:, n_const:] = force[:, dest] * Xr[:, S_s]
+            return A
+
+        def to_counts(y0):
+            y0 = np.asarray(y0, dtype=float).reshape((C,P))[species]
+            counts = np.rint(y0)
+            if not np.allclose(counts, y0) or (counts < 0).any():
+                raise ValueError('`y0` debe tener cantidades enteras no negativas de personas.')
+            return counts.astype(np.int64).ravel()
+
+        def to_state(X):
+            B = X.shape[0]
+            y = np.empty((B, C, P))
+            y[:, species] = X.reshape((B, len(species), P))
+            if N is not None:
+                y[:, N] = y[:, species].sum(axis=1)
+            return y.reshape((B, C*P))
+
+        return StochasticModel(propensities, src, dst, V, to_counts, to_state)
+    return factory
+
+#####################################################
+##### SIMULACIÓN DE RÉPLICAS ########################
+#####################################################
+
+class _Streams:
+    '''
+    Generadores independientes por réplica. Los uniformes se piden por bloques
+    a cada generador, de modo que un paso de todas las réplicas no necesita
+    ciclos de Python. Los conteos de Poisson del tau-leaping, en cambio, se
+    piden réplica por réplica (ver `poisson`).
+    '''
+    def __init__(self, seed, replicates, block=256):
+        seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.generators = [np.random.default_rng(s) for s in seq.spawn(replicates)]
+        self.block = block
+        self.buffer = np.empty((replicates, block))
+        self.pos = np.full(replicates, block)
+
+    def uniform(self, rows):
+        empty = rows[self.pos[rows] >= self.block]
+        for r in empty:
+            self.buffer[r] = self.generators[r].random(self.block)
+            self.pos[r] = 0
+        u = self.buffer[rows, self.pos[rows]]
+        self.pos[rows] += 1
+        return u
+
+    def poisson(self, rows, lam):
+        # El ciclo es deliberado: las medias cambian en cada paso, por lo que no
+        # se pueden pedir por bloques, y un único generador para todas las
+        # réplicas haría que los conteos de cada una dependieran de qué otras
+        # siguen activas. Invertir la distribución sobre uniformes del bloque
+        # (`scipy.stats.poisson.ppf`) conserva la independencia, pero es más
+        # lento que este ciclo.
+        return np.array([self.generators[r].poisson(l) for r, l in zip(rows, lam)])
+
+class _Statistics:
+    '''
+    Acumula en línea la media, la varianza, el mínimo y el máximo de un
+    observable en cada tiempo de observación, sin guardar las trayectorias.
+    Las sumas se hacen respecto a un valor de referencia (el observable del
+    estado inicial) para evitar la cancelación numérica.
+    '''
+    def __init__(self, T, reference):
+        m = reference.shape[0]
+        self.reference = reference
+        self.count = np.zeros(T, dtype=np.int64)
+        self.sum = np.zeros((T, m))
+        self.sumsq = np.zeros((T, m))
+        self.min = np.full((T, m), np.inf)
+        self.max = np.full((T, m), -np.inf)
+
+    def update(self, k, values):
+        d = values - self.reference
+        np.add.at(self.count, k, 1)
+        np.add.at(self.sum, k, d)
+        np.add.at(self.sumsq, k, d * d)
+        np.minimum.at(self.min, k, values)
+        np.maximum.at(self.max, k, values)
+
+    def result(self):
+        count = np.maximum(self.count, 1)[:, None]
+        mean = self.sum / count
+        var = np.maximum(self.sumsq / count - mean * mean, 0)
+        var *= count / np.maximum(count - 1, 1)
+        return (mean + self.reference).T, np.sqrt(var).T, self.min.T, self.max.T
+
+def simulate(model, y0, t_eval, replicates=1, method='ssa', seed=None, observable=None,
+             keep_paths=False, epsilon=0.03):
+    '''
+    Simula réplicas de un modelo estocástico.
+
+    Parámetros
+    ---
+    `model`: `StochasticModel` (por ejemplo el de `stochastic_sir_lagrange`).
+
+    `y0`: Estado inicial con la estructura de los modelos deterministas y
+    cantidades enteras de personas.
+
+    `t_eval`: Tiempos de observación, crecientes. La simulación va de
+    `t_eval[0]` a `t_eval[-1]`.
+
+    `replicates`: Cantidad de réplicas.
+
+    `method`: `'ssa'` (algoritmo de Gillespie exacto) o `'tau'` (tau-leaping
+    adaptativo de Cao, Gillespie y Petzold; los pasos con `tau` menor que
+    `10 / a0` se hacen con SSA).
+
+    `seed`: Semilla (entero o `SeedSequence`) de la que se derivan los generadores de las réplicas.
+
+    `observable`: Función opcional `observable(Y)` que recibe los estados de
+    varias réplicas (filas de `Y`, con la estructura de `y`) y devuelve una
+    fila de valores por réplica. Por defecto se usa el estado completo.
+
+    `keep_paths`: Si es `True` también se guardan las trayectorias del observable.
+
+    `epsilon`: Cambio relativo máximo de cada compartimento en un salto de tau-leaping.
+
+    Retorno
+    ---
+    `OptimizeResult` con `t`, `mean`, `std`, `min` y `max` (de forma
+    `m x len(t)`, con `m` el tamaño del observable), `nsteps` (pasos por
+    réplica) y, si `keep_paths` es `True`, `paths` (`réplicas x m x len(t)`).
+    '''
+    if method not in ('ssa', 'tau'):
+        raise ValueError("`method` debe ser 'ssa' o 'tau'.")
+    t_eval = np.asarray(t_eval, dtype=float)
+    T = t_eval.shape[0]
+    R = replicates
+    observe = (lambda Y: Y) if observable is None else observable
+    x0 = model.to_counts(y0)
+    X = np.tile(x0, (R, 1))
+    stats = _Statistics(T, observe(model.to_state(x0[None]))[0].astype(float))
+    paths = np.empty((R, stats.sum.shape[1], T)) if keep_paths else None
+    streams = _Streams(seed, R)
+    src, dst, V = model.src, model.dst, model.stoichiometry
+    V_abs = abs(V)
+    t = np.full(R, t_eval[0])
+    next_obs = np.zeros(R, dtype=np.int64)
+    nsteps = np.zeros(R, dtype=np.int64)
+    shrink = np.ones(R)
+
+    def record(rows, t_new):
+        # Registra el estado actual de `rows` en las observaciones anteriores a `t_new`.
+        while rows.shape[0]:
+            k = next_obs[rows]
+            due = k < T
+            due[due] = t_eval[k[due]] < t_new[due]
+            if not due.any():
+                return
+            rows, t_new, k = rows[due], t_new[due], k[due]
+            values = observe(model.to_state(X[rows]))
+            stats.update(k, values)
+            if keep_paths:
+                paths[rows, :, k] = values
+            next_obs[rows] += 1
+
+    def ssa_step(rows, A, a0):
+        u1 = streams.uniform(rows)
+        u2 = streams.uniform(rows)
+        t_new = t[rows] - np.log(1 - u1) / a0
+        record(rows, t_new)
+        r = (np.cumsum(A, axis=1) < (u2 * a0)[:, None]).sum(axis=1)
+        r = np.minimum(r, A.shape[1] - 1)
+        X[rows, src[r]] -= 1
+        X[rows, dst[r]] += 1
+        t[rows] = t_new
+        nsteps[rows] += 1
+
+    t_end = t_eval[-1]
+    while True:
+        rows = np.flatnonzero(t < t_end)
+        if rows.shape[0] == 0:
+            break
+        A = model.propensities(X[rows])
+        a0 = A.sum(axis=1)
+        dead = a0 <= 0
+        if dead.any():
+            # Sin eventos posibles el estado ya no cambia.
+            record(rows[dead], np.full(dead.sum(), np.inf))
+            t[rows[dead]] = np.inf
+            rows, A, a0 = rows[~dead], A[~dead], a0[~dead]
+        if method == 'ssa' or rows.shape[0] == 0:
+            if rows.shape[0]:
+                ssa_step(rows, A, a0)
+            continue
+
+        x = X[rows]
+        mu = np.abs((V @ A.T).T)
+        sigma2 = (V_abs @ A.T).T
+        bound = np.maximum(epsilon * x / 2, 1)
+        with np.errstate(divide='ignore'):
+            tau = np.minimum(bound / mu, bound * bound / sigma2).min(axis=1)
+        tau *= shrink[rows]
+        exact = tau < 10 / a0
+        if exact.any():
+            ssa_step(rows[exact], A[exact], a0[exact])
+        leap = ~exact
+        if not leap.any():
+            continue
+        rows, A, tau, x = rows[leap], A[leap], tau[leap], x[leap]
+        # Los saltos no pasan de la próxima observación, para registrarla exactamente.
+        record(rows, np.nextafter(t[rows], np.inf))
+        target = np.where(next_obs[rows] < T, t_eval[np.minimum(next_obs[rows], T - 1)], t_end)
+        tau = np.minimum(tau, target - t[rows])
+        counts = streams.poisson(rows, A * tau[:, None])
+        new_x = x + (V @ counts.T).T.astype(np.int64)
+        negative = (new_x < 0).any(axis=1)
+        shrink[rows[negative]] /= 2
+        ok = rows[~negative]
+        X[ok] = new_x[~negative]
+        t[ok] += tau[~negative]
+        shrink[ok] = 1
+        nsteps[ok] += 1
+    record(np.arange(R), np.full(R, np.inf))
+
+    mean, std, minimum, maximum = stats.result()
+    result = OptimizeResult(t=t_eval, mean=mean, std=std, min=minimum, max=maximum, nsteps=nsteps)
+    if keep_paths:
+        result.paths = paths
+    return result
+
+#####################################################
+##### MODELOS ESTOCÁSTICOS CON MOVIMIENTO ###########
+#####################################################
+
+def stochastic_sir_eulerian(F, Beta, Gamma):
+    '''
+    Versión estocástica de `fun_sir_eulerian`, para usar con `simulate`.
+    El estado tiene la misma estructura (`S`, `I`, `R` y `N` por nodo).
+    '''
+    return generate_stochastic(SIR, 'eulerian')(F, Beta, Gamma)
+
+def stochastic_sir_lagrange(Out, In, Beta, Gamma):
+    '''
+    Versión estocástica de `fun_sir_lagrange`, para usar con `simulate`.
+    El estado tiene la misma estructura (`4*K*K`).
+    '''
+    return generate_stochastic(SIR, 'lagrange')(Out, In, Beta, Gamma)
+
+def stochastic_sis_eulerian(F, Beta, Gamma):
+    '''
+    Versión estocástica de `fun_sis_eulerian`, para usar con `simulate`.
+    '''
+    return generate_stochastic(SIS, 'eulerian')(F, Beta, Gamma)
+
+def stochastic_sis_lagrange(Out, In, Beta, Gamma):
+    '''
+    Versión estocástica de `fun_sis_lagrange`, para usar con `simulate`.
+    '''
+    return generate_stochastic(SIS, 'lagrange')(Out, In, Beta, Gamma)
+
+def stochastic_seir_eulerian(F, Beta, Gamma, Sigma):
+    '''
+    Versión estocástica de `fun_seir_eulerian`, para usar con `simulate`. Igual
+    que el modelo determinista, la fuerza de infección usa el compartimento `y[1]`.
+    '''
+    return generate_stochastic(SEIR_ORIGINAL_EULERIAN, 'eulerian')(F, Beta, Gamma, Sigma)
+
+def stochastic_seir_lagrange(Out, In, Beta, Gamma, Sigma):
+    '''
+    Versión estocástica de `fun_seir_lagrange`, para usar con `simulate`.
+    '''
+    return generate_stochastic(SEIR, 'lagrange')(Out, In, Beta, Gamma, Sigma)
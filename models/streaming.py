@@ -0,0 +1,216 @@
+import numpy as np
+from scipy.integrate import BDF, DOP853, LSODA, RK23, RK45, Radau
+from scipy.optimize import OptimizeResult
+
+from .compartments import _destinations, _nodes, _split_args, resolve
+
+#####################################################
+##### SOLUCIÓN CON SALIDA INCREMENTAL ###############
+#####################################################
+#
+# `solve_streaming` avanza el integrador paso a paso (como `solve_ivp`) y, al
+# terminar cada paso, evalúa la salida densa en los tiempos de `t_eval` que
+# quedaron dentro del paso. Esos estados se escriben en disco (opcional) y se
+# reducen a los observables pedidos, y luego se descartan: la memoria usada
+# depende del tamaño de los observables y no de `n x len(t_eval)`.
+#
+# Un observable es una función `obs(t, Y)` que recibe los tiempos `t` y los
+# estados `Y` (de forma `n x len(t)`, como `sol.y`) y devuelve un arreglo
+# `m x len(t)`. Los observables acumulados (por ejemplo los casos acumulados a
+# partir de la incidencia) se integran en el tiempo con la salida densa de
+# cada paso y cuadratura de Gauss-Legendre.
+
+METHODS = {'RK23': RK23, 'RK45': RK45, 'DOP853': DOP853, 'Radau': Radau, 'BDF': BDF, 'LSODA': LSODA}
+
+# Mensaje de `solve_ivp` cuando la integración llega al final del intervalo.
+SUCCESS = 'The solver successfully reached the end of the integration interval.'
+
+_GAUSS_NODES, _GAUSS_WEIGHTS = np.polynomial.legendre.leggauss(3)
+
+def _integrate(obs, sol, a, b):
+    '''
+    Integral de `obs` sobre `[a, b]` con la salida densa `sol` del paso.
+    '''
+    if b <= a:
+        return 0.0
+    s = (a + b) / 2 + (b - a) / 2 * _GAUSS_NODES
+    return (b - a) / 2 * (obs(s, sol(s)) @ _GAUSS_WEIGHTS)
+
+def solve_streaming(fun, t_span, y0, t_eval, observables=None, cumulative=None, store=None,
+                    chunk=64, method='RK45', **options):
+    '''
+    Resuelve un modelo sin guardar la trayectoria completa en memoria.
+
+    Parámetros
+    ---
+    `fun`, `t_span`, `y0`, `method`, `options`: Como en `solve_ivp`. `method`
+    puede ser el nombre de un método o una subclase de `OdeSolver`.
+
+    `t_eval`: Tiempos de salida, crecientes y dentro de `t_span`.
+
+    `observables`: Diccionario `nombre -> obs(t, Y)` de observables que se
+    calculan en cada tiempo de salida.
+
+    `cumulative`: Diccionario `nombre -> obs(t, Y)` de observables cuya integral
+    desde `t_span[0]` se registra en cada tiempo de salida (por ejemplo los
+    casos acumulados a partir de `incidence`).
+
+    `store`: Ruta opcional de un archivo `.npy` donde se escribe el estado
+    completo, con forma `len(t_eval) x n` (una fila por tiempo). Se escribe por
+    bloques de `chunk` filas y se puede leer con `np.load(store, mmap_mode='r')`.
+
+    Retorno
+    ---
+    `OptimizeResult` con `t`, `observables` (diccionario `nombre -> m x len(t)`,
+    que incluye los acumulados), `store`, `nfev`, `njev`, `nlu`, `status`,
+    `message` y `success`, como `solve_ivp`.
+    '''
+    observables = dict(observables or {})
+    cumulative = dict(cumulative or {})
+    t0, t_bound = map(float, t_span)
+    t_eval = np.asarray(t_eval, dtype=float)
+    T = t_eval.shape[0]
+    y0 = np.asarray(y0, dtype=float)
+    if method in METHODS:
+        method = METHODS[method]
+    solver = method(fun, t0, y0, t_bound, **options)
+
+    # Los tamaños de los observables se obtienen evaluándolos en `y0`.
+    results = {name: np.empty((obs(np.array([t0]), y0[:, None]).shape[0], T))
+               for name, obs in {**observables, **cumulative}.items()}
+    totals = {name: 0.0 for name in cumulative}
+    writer = None if store is None else np.lib.format.open_memmap(
+        store, mode='w+', dtype=y0.dtype, shape=(T, y0.shape[0]))
+    buffer, buffer_start = [], 0
+
+    def emit(k, ts, Y):
+        nonlocal buffer, buffer_start
+        for name, obs in observables.items():
+            results[name][:, k:k+len(ts)] = obs(ts, Y)
+        if writer is not None:
+            buffer.append(Y.T)
+            rows = sum(b.shape[0] for b in buffer)
+            if rows >= chunk or k + len(ts) == T:
+                writer[buffer_start:buffer_start+rows] = np.concatenate(buffer)
+                writer.flush()
+                buffer, buffer_start = [], buffer_start + rows
+
+    k = 0
+    if T and t_eval[0] == t0:
+        emit(0, t_eval[:1], y0[:, None])
+        for name in cumulative:
+            results[name][:, 0] = 0.0
+        k = 1
+    status = None
+    while status is None:
+        message = solver.step()
+        if solver.status == 'finished':
+            status = 0
+            message = SUCCESS
+        elif solver.status == 'failed':
+            status = -1
+            break
+        t_old, t_new = solver.t_old, solver.t
+        j = np.searchsorted(t_eval, t_new, side='right')
+        if j == k and not cumulative:
+            continue
+        sol = solver.dense_output()
+        ts = t_eval[k:j]
+        if cumulative:
+            # Se integra por tramos para registrar el acumulado en cada salida.
+            edges = np.concatenate(([t_old], ts, [t_new]))
+            for i in range(len(ts)):
+                for name, obs in cumulative.items():
+                    totals[name] = totals[name] + _integrate(obs, sol, edges[i], edges[i+1])
+                    results[name][:, k+i] = totals[name]
+            for name, obs in cumulative.items():
+                totals[name] = totals[name] + _integrate(obs, sol, edges[-2], edges[-1])
+        if j > k:
+            emit(k, ts, sol(ts))
+            k = j
+
+    if writer is not None:
+        if buffer:
+            writer[buffer_start:buffer_start+sum(b.shape[0] for b in buffer)] = np.concatenate(buffer)
+        writer.flush()
+        del writer
+    return OptimizeResult(t=t_eval[:k], observables={name: r[:, :k] for name, r in results.items()},
+                          store=store, nfev=solver.nfev, njev=solver.njev, nlu=solver.nlu,
+                          status=status, message=message, success=status >= 0)
+
+#####################################################
+##### OBSERVABLES ###################################
+#####################################################
+
+def _reduce(X, movement, K, by):
+    '''
+    Agrega un arreglo por posición (`P x B`) por nodo de residencia, por nodo
+    donde se encuentran las personas, o en total.
+    '''
+    if by not in ('residence', 'destination', 'total'):
+        raise ValueError("`by` debe ser 'residence', 'destination' o 'total'.")
+    B = X.shape[-1]
+    if by == 'total':
+        return X.sum(axis=0, keepdims=True)
+    if movement != 'lagrange':
+        return X
+    X = X.reshape((K, K, B))
+    if by == 'residence':
+        return X.sum(axis=1)
+    return X.sum(axis=0)
+
+def compartment_total(spec, movement, K, compartment, by='residence'):
+    '''
+    Observable con la cantidad de personas de un compartimento.
+
+    Parámetros
+    ---
+    `spec`, `movement`: Modelo y esquema de movimiento (ver `compartments`).
+
+    `K`: Cantidad de nodos.
+
+    `compartment`: Nombre del compartimento (por ejemplo `'I'`).
+
+    `by`: `'residence'` (por nodo de residencia), `'destination'` (por nodo en
+    que se encuentran las personas) o `'total'`. En los modelos sin movimiento
+    lagrangiano ambos agrupamientos por nodo coinciden.
+    '''
+    c = spec.compartments.index(compartment)
+    C = len(spec.compartments)
+    P = _destinations(movement, K).shape[0]
+    def obs(t, Y):
+        return _reduce(Y.reshape((C, P, -1))[c], movement, K, by)
+    return obs
+
+def incidence(spec, movement, *args, by='residence'):
+    '''
+    Observable con la incidencia (nuevos contagios por unidad de tiempo), es
+    decir, el flujo de la infección `Beta * S * I_n / N_n`. Integrado con
+    `solve_streaming(..., cumulative=...)` da los casos acumulados.
+
+    Parámetros
+    ---
+    `spec`, `movement`: Modelo y esquema de movimiento (ver `compartments`).
+
+    `args`: Argumentos de la fábrica del modelo (matrices de movimiento y tasas).
+
+    `by`: Agrupamiento, como en `compartment_total`.
+    '''
+    mobility, params = _split_args(movement, args)
+    C, S, T, infectious, N, Beta, transitions = resolve(spec, params)
+    if S is None:
+        raise ValueError('El modelo no tiene infección.')
+    K = _nodes(mobility, Beta, transitions)
+    dest = _destinations(movement, K)
+    P = dest.shape[0]
+    Beta = np.asarray(Beta, dtype=float)
+    def obs(t, Y):
+        Y = Y.reshape((C, P, -1))
+        N_p = Y.sum(axis=0) if N is None else Y[N]
+        I_p = Y[infectious].sum(axis=0)
+        I_n = _reduce(I_p, movement, K, 'destination')
+        N_n = _reduce(N_p, movement, K, 'destination')
+        # Los nodos vacíos no tienen infecciones.
+        force = np.divide(Beta[:, None] * I_n, N_n, out=np.zeros(N_n.shape), where=N_n > 0)
+        return _reduce(force[dest] * Y[S], movement, K, by)
+    return obs
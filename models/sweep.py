@@ -0,0 +1,199 @@
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+from scipy.integrate import solve_ivp
+from scipy.optimize import OptimizeResult
+
+from .scenarios import ScenarioStore
+
+#################################################
+##### BARRIDOS DE ESCENARIOS REANUDABLES ########
+#################################################
+#
+# `run_sweep` resuelve un modelo para todos los escenarios de un
+# `ScenarioStore` y guarda los resultados en otro `ScenarioStore`, agrupados
+# por `K` como los escenarios. Los escenarios se reparten en bloques de
+# `chunk` identificadores del mismo grupo; cada proceso trabajador abre el
+# almacén de entrada en modo de solo lectura y lee de él los parámetros de
+# cada bloque, de modo que las tareas solo envían identificadores. Se
+# mantienen unos pocos bloques pendientes por proceso y cada proceso que
+# termina toma el siguiente, así que los bloques lentos (los de `K` grande)
+# no dejan procesos ociosos.
+#
+# Cada bloque terminado se agrega al almacén de resultados, cuyo campo
+# `scenario` indica el escenario de cada fila; ese almacén es también el punto
+# de control: al volver a llamar a `run_sweep` con la misma carpeta solo se
+# resuelven los escenarios que no están en él. Una interrupción pierde a lo
+# sumo los bloques en curso.
+
+Progress = namedtuple('Progress', ['done', 'total', 'elapsed', 'throughput', 'eta'])
+
+_WORKER_CONFIG = None
+_WORKER_STORE = None
+
+def _init_worker(config):
+    global _WORKER_CONFIG, _WORKER_STORE
+    _WORKER_CONFIG = config
+    _WORKER_STORE = None
+
+def _worker_chunk(ids):
+    global _WORKER_STORE
+    if _WORKER_STORE is None:
+        _WORKER_STORE = ScenarioStore(_WORKER_CONFIG[0])
+    return _solve_chunk(_WORKER_STORE, _WORKER_CONFIG, ids)
+
+def _solve_chunk(store, config, ids):
+    '''
+    Resuelve los escenarios `ids` (todos del mismo grupo) y devuelve el
+    diccionario de campos apilados que se agrega al almacén de resultados.
+    '''
+    _, factory, fields, y0, t_eval, method, options, observe = config
+    rows = {'scenario': [], 'y': [], 'status': [], 'nfev': [], 'seconds': []}
+    for i in ids:
+        start = time.perf_counter()
+        scenario = store.get(int(i))
+        args = [np.asarray(scenario[name]) for name in fields]
+        if isinstance(y0, str):
+            state = np.asarray(scenario[y0])
+        else:
+            state = np.asarray(y0(int(store.index()[i]['K'])) if callable(y0) else y0, dtype=float)
+        sol = solve_ivp(factory(*args), (t_eval[0], t_eval[-1]), state, t_eval=t_eval,
+                        method=method, **options)
+        y = np.full((state.shape[0], t_eval.shape[0]), np.nan)
+        y[:, :sol.y.shape[1]] = sol.y
+        if observe is not None:
+            y = np.asarray(observe(t_eval, y))
+        rows['scenario'].append(int(i))
+        rows['y'].append(y)
+        rows['status'].append(sol.status)
+        rows['nfev'].append(sol.nfev)
+        rows['seconds'].append(time.perf_counter() - start)
+    return {'scenario': np.array(rows['scenario'], dtype=np.int64), 'y': np.stack(rows['y']),
+            'status': np.array(rows['status'], dtype=np.int8), 'nfev': np.array(rows['nfev'], dtype=np.int64),
+            'seconds': np.array(rows['seconds'])}
+
+def completed(directory):
+    '''
+    Identificadores de los escenarios ya resueltos en la carpeta de resultados
+    `directory` (vacío si no existe).
+    '''
+    try:
+        results = ScenarioStore(directory)
+    except FileNotFoundError:
+        return np.empty(0, dtype=np.int64)
+    done = [results.group(K)['scenario'] for K in results.sizes()]
+    return np.sort(np.concatenate(done)) if done else np.empty(0, dtype=np.int64)
+
+def run_sweep(factory, scenarios, directory, fields, y0, t_eval, method='RK45', options=None,
+              observe=None, workers=1, chunk=16, report=None):
+    '''
+    Resuelve un modelo para cada escenario de un almacén, en paralelo y con
+    puntos de control.
+
+    Parámetros
+    ---
+    `factory`: Fábrica del modelo (por ejemplo `original_models.fun_sir_lagrange`).
+    Debe ser una función de módulo, para poder enviarla a los procesos.
+
+    `scenarios`: `ScenarioStore` (o su carpeta) con los escenarios.
+
+    `directory`: Carpeta del almacén de resultados. Si ya existe, el barrido
+    continúa donde se detuvo.
+
+    `fields`: Campos de cada escenario que se pasan a la fábrica, en orden, por
+    ejemplo `('Out', 'In', 'Beta', 'Gamma')`.
+
+    `y0`: Estado inicial: el nombre de un campo de los escenarios, un arreglo
+    común a todos o una función de módulo que recibe `K` y lo devuelve (como
+    `GenerateY0_SIR_lagrange` de experiment_02).
+
+    `t_eval`: Tiempos de salida; la integración va de `t_eval[0]` a `t_eval[-1]`.
+
+    `method`, `options`: Método y opciones adicionales de `solve_ivp`.
+
+    `observe`: Función de módulo opcional `observe(t, Y)` que reduce la
+    trayectoria (`n x len(t_eval)`) a lo que se guarda (por ejemplo los
+    infestados por nodo). Por defecto se guarda la trayectoria completa. Si el
+    integrador falla, las columnas que faltan son `nan`.
+
+    `workers`: Cantidad de procesos. `1` resuelve en el proceso actual y `-1`
+    usa todos los núcleos.
+
+    `chunk`: Cantidad de escenarios por tarea y por escritura en disco.
+
+    `report`: Función opcional que recibe un `Progress(done, total, elapsed,
+    throughput, eta)` después de cada bloque (`throughput` en escenarios por
+    segundo, contando solo los resueltos en esta llamada).
+
+    Retorno
+    ---
+    `OptimizeResult` con `results` (el `ScenarioStore` de resultados, con los
+    campos `scenario`, `y`, `status`, `nfev` y `seconds` por fila), `solved`
+    (escenarios resueltos en esta llamada), `skipped` (ya resueltos antes),
+    `elapsed` y `throughput`.
+    '''
+    if not isinstance(scenarios, ScenarioStore):
+        scenarios = ScenarioStore(scenarios)
+    t_eval = np.asarray(t_eval, dtype=float)
+    options = dict(options or {})
+    workers = os.cpu_count() if workers == -1 else workers
+    sweep = {'source': os.path.abspath(scenarios.directory),
+             'factory': f'{factory.__module__}.{factory.__qualname__}',
+             'fields': list(fields), 't_eval': t_eval.tolist(), 'method': str(method)}
+    results = ScenarioStore(directory, mode='a')
+    previous = results.attrs.get('sweep')
+    if previous is None:
+        results.set_attrs(sweep=sweep)
+    elif previous != sweep:
+        raise ValueError(f'{directory} tiene resultados de otro barrido: {previous}.')
+
+    done = set(completed(directory).tolist())
+    tasks = []
+    for K in scenarios.sizes():
+        pending = [i for i in scenarios.ids(K).tolist() if i not in done]
+        tasks += [pending[a:a+chunk] for a in range(0, len(pending), chunk)]
+    total = len(scenarios)
+    solved = 0
+    start = time.perf_counter()
+    config = (scenarios.directory, factory, tuple(fields), y0, t_eval, method, options, observe)
+
+    def store(rows):
+        nonlocal solved
+        results.extend(rows, K=int(scenarios.index()[rows['scenario'][0]]['K']))
+        solved += rows['scenario'].shape[0]
+        if report is not None:
+            elapsed = time.perf_counter() - start
+            throughput = solved / elapsed if elapsed > 0 else np.inf
+            remaining = total - len(done) - solved
+            report(Progress(len(done) + solved, total, elapsed, throughput,
+                            remaining / throughput if throughput > 0 else np.inf))
+
+    if workers <= 1:
+        for ids in tasks:
+            store(_solve_chunk(scenarios, config, ids))
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(config,)) as pool:
+            queue = iter(tasks)
+            running = set()
+            try:
+                while True:
+                    # Se mantienen dos bloques pendientes por proceso.
+                    while len(running) < 2 * workers:
+                        ids = next(queue, None)
+                        if ids is None:
+                            break
+                        running.add(pool.submit(_worker_chunk, ids))
+                    if not running:
+                        break
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        store(future.result())
+            except BaseException:
+                pool.shutdown(wait=True, cancel_futures=True)
+                raise
+    elapsed = time.perf_counter() - start
+    return OptimizeResult(results=results, solved=solved, skipped=len(done), elapsed=elapsed,
+                          throughput=solved / elapsed if elapsed > 0 else np.inf)
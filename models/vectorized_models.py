@@ -0,0 +1,320 @@
+from .compartments import (EULER_SPARSE_DENSITY, MOVEMENT, SEIR, SEIR_ORIGINAL_EULERIAN,
+                           SIR, SIR_LITE, SIS, SIS_LITE, euler_operator, generate_fun)
+
+# Las fábricas de este módulo son envolturas sobre los núcleos vectorizados que
+# genera `compartments.generate_fun` a partir de la especificación de cada modelo.
+
+#######################################################
+##### MOVIMIENTO EULERIANO Y LAGRANGIANO (PUROS) ######
+#######################################################
+
+def fun_euler_mov(F):
+    '''
+    Versión matricial de `original_models.fun_euler_mov`. El operador de
+    movimiento se construye una sola vez con `euler_operator`.
+
+    Parámetros
+    ---
+    `F`: Matriz de movimiento de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Indica la tasa de traslado de un nodo `i` a un nodo `j`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` (vector de una dimensión, de tamaño `K`, con la población inicial de cada nodo).
+    '''
+    return generate_fun(MOVEMENT, 'eulerian')(F)
+
+def fun_lagrange_mov(O, I):
+    '''
+    Versión vectorizada de `original_models.fun_lagrange_mov`.
+
+    Parámetros
+    ---
+    `O`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Indica la tasa de traslado de los agentes de `i` en `i` que se mueven al nodo `j`.
+
+    `I`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Indica la tasa de traslado de los agentes de `i` en `j` que regresan al nodo `i`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` (vector de dimensión `K x K`, con la población inicial en cada nodo `i` que se encuentran en el nodo `j`).
+    '''
+    return generate_fun(MOVEMENT, 'lagrange')(O, I)
+
+###############################################################
+###### MODELO SIR CON MOVIMIENTO LAGRANGIANO (VECTORIZADO) ####
+###############################################################
+
+def fun_sir_lagrange(Out, In, Beta, Gamma):
+    '''
+    Versión vectorizada de `original_models.fun_sir_lagrange`. Usa la misma
+    firma y la misma estructura del vector `y`, por lo que puede sustituirla
+    directamente en `solve_ivp`. El vector `y` recibido no se modifica.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `4*K*K` (aplanado),
+    con los susceptibles iniciales, los infestados, los recuperados
+    y la población total, de un nodo en otro.
+    '''
+    return generate_fun(SIR, 'lagrange')(Out, In, Beta, Gamma)
+
+def fun_sir_lagrange_lite(Out, In, Beta, Gamma):
+    '''
+    Versión vectorizada de `original_models.fun_sir_lagrange_lite`.
+    No contempla las ecuaciones diferenciales destinadas para la variación de
+    la población total por nodo.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `3*K*K` (aplanado),
+    con los susceptibles iniciales, los infestados, y los recuperados
+    , de un nodo en otro.
+    '''
+    return generate_fun(SIR_LITE, 'lagrange')(Out, In, Beta, Gamma)
+
+###############################################################
+###### MODELO SIS CON MOVIMIENTO LAGRANGIANO (VECTORIZADO) ####
+###############################################################
+
+def fun_sis_lagrange(Out, In, Beta, Gamma):
+    '''
+    Versión vectorizada de `original_models.fun_sis_lagrange`.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `3*K*K` (aplanado),
+    con los susceptibles iniciales, los infestados
+    y la población total, de un nodo en otro.
+    '''
+    return generate_fun(SIS, 'lagrange')(Out, In, Beta, Gamma)
+
+def fun_sis_lagrange_lite(Out, In, Beta, Gamma):
+    '''
+    Versión vectorizada de `original_models.fun_sis_lagrange_lite`.
+    No contempla las ecuaciones diferenciales destinadas para la variación de
+    la población total por nodo.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `2*K*K` (aplanado),
+    con los susceptibles iniciales,y los infestados
+    , de un nodo en otro.
+    '''
+    return generate_fun(SIS_LITE, 'lagrange')(Out, In, Beta, Gamma)
+
+################################################################
+###### MODELO SEIR CON MOVIMIENTO LAGRANGIANO (VECTORIZADO) ####
+################################################################
+
+def fun_seir_lagrange(Out, In, Beta, Gamma, Sigma):
+    '''
+    Versión vectorizada de `original_models.fun_seir_lagrange`.
+
+    Parámetros
+    ---
+    `Out`: Matriz de movimiento de emigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `In`: Matriz de movimiento de inmigración de dimensión `K x K` (matriz cuadrada con diagonal nula).
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Sigma`: Tasa de Incubación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `5*K*K` (aplanado),
+    con los susceptibles iniciales, los expuestos, los infestados, los recuperados
+    y la población total, de un nodo en otro.
+    '''
+    return generate_fun(SEIR, 'lagrange')(Out, In, Beta, Gamma, Sigma)
+
+#############################################################
+###### MODELO SIR CON MOVIMIENTO EULERIANO (VECTORIZADO) ####
+#############################################################
+
+def fun_sir_eulerian(F, Beta, Gamma):
+    '''
+    Versión matricial de `original_models.fun_sir_eulerian`. El operador de
+    movimiento se construye una sola vez con `euler_operator`.
+
+    Parámetros
+    ---
+    `F`: Matriz de movimiento de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `4*K` (aplanado),
+    con los susceptibles iniciales por cada nodo, más los infestados, los recuperados
+    y la población total, cada uno por cada nodo.
+    '''
+    return generate_fun(SIR, 'eulerian')(F, Beta, Gamma)
+
+def fun_sir_eulerian_lite(F, Beta, Gamma):
+    '''
+    Versión matricial de `original_models.fun_sir_eulerian_lite`.
+    Se asume que `N_i_0 = S_i_0 + I_i_0 + R_i_0`.
+
+    Parámetros
+    ---
+    `F`: Matriz de movimiento de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `3*K` (aplanado),
+    con los susceptibles iniciales por cada nodo, más los infestados, y los recuperados,
+    cada uno por cada nodo.
+    '''
+    return generate_fun(SIR_LITE, 'eulerian')(F, Beta, Gamma)
+
+#############################################################
+###### MODELO SIS CON MOVIMIENTO EULERIANO (VECTORIZADO) ####
+#############################################################
+
+def fun_sis_eulerian(F, Beta, Gamma):
+    '''
+    Versión matricial de `original_models.fun_sis_eulerian`.
+
+    Parámetros
+    ---
+    `F`: Matriz de movimiento de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `3*K` (aplanado),
+    con los susceptibles iniciales por cada nodo, más los infestados
+    y la población total, cada uno por cada nodo.
+    '''
+    return generate_fun(SIS, 'eulerian')(F, Beta, Gamma)
+
+def fun_sis_eulerian_lite(F, Beta, Gamma):
+    '''
+    Versión matricial de `original_models.fun_sis_eulerian_lite`.
+    Se asume que `N_i_0 = S_i_0 + I_i_0`.
+
+    Parámetros
+    ---
+    `F`: Matriz de movimiento de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `2*K` (aplanado),
+    con los susceptibles iniciales por cada nodo, más los infestados,
+    cada uno por cada nodo.
+    '''
+    return generate_fun(SIS_LITE, 'eulerian')(F, Beta, Gamma)
+
+##############################################################
+###### MODELO SEIR CON MOVIMIENTO EULERIANO (VECTORIZADO) ####
+##############################################################
+
+def fun_seir_eulerian(F, Beta, Gamma, Sigma):
+    '''
+    Versión matricial de `original_models.fun_seir_eulerian`.
+
+    Parámetros
+    ---
+    `F`: Matriz de movimiento de dimensión `K x K` (matriz cuadrada con diagonal nula).
+    Puede ser densa o de `scipy.sparse`.
+
+    `Beta`: Probabilidad de Contagio por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Gamma`: Tasa de Recuperación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    `Sigma`: Tasa de Incubación por nodo. Vector de tipo `float` y tamaño `K`.
+
+    Retorno
+    ---
+    `fun`: Función con el sistema de ecuaciones.
+    Tiene por parámetros `t` (variable independiente),
+    y `y` con la siguiente estructura: Vector de tamaño `5*K` (aplanado),
+    con los susceptibles iniciales por cada nodo, más los expuestos, los infestados, los recuperados
+    y la población total, cada uno por cada nodo.
+    '''
+    return generate_fun(SEIR_ORIGINAL_EULERIAN, 'eulerian')(F, Beta, Gamma, Sigma)
+